@@ -1,6 +1,8 @@
 import datetime
 import os.path
 import re
+import sys
+import threading
 from dateutil import parser as dateutil_parser
 import dateparser
 import pytz
@@ -14,6 +16,11 @@ from googleapiclient.errors import HttpError
 from google.adk.agents import Agent
 from google.genai import types
 
+# Share the backend's Google client cache (backend/src is not on the path when run by adk)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from util.google_services import get_service
+from util.free_slots import daily_windows, clip_windows, find_free_slots, WORKING_DAYS, WORKING_HOURS
+
 
 MODEL = "gemini-2.0-flash-001"
 SCOPES = ["https://www.googleapis.com/auth/calendar"]
@@ -210,24 +217,38 @@ def parse_natural_language_datetime(datetime_string: str, duration: Optional[str
 
     return start_datetime, end_datetime, time_window
 
+# Loaded from token.json once and refreshed in place; the calendar client is
+# cached by util.google_services, so tools don't rebuild it on every call
+_creds = None
+_creds_lock = threading.Lock()
+
+def get_calendar_credentials():
+    global _creds
+    with _creds_lock:
+        if _creds is not None and _creds.valid:
+            return _creds
+        creds = _creds
+        if creds is None and os.path.exists("token.json"):
+            try:
+                creds = Credentials.from_authorized_user_file("token.json", SCOPES)
+            except (UnicodeDecodeError, ValueError):
+                print("Warning: 'token.json' is invalid or has an encoding issue. Attempting to re-authorize.")
+                os.remove("token.json")
+
+        if not creds or not creds.valid:
+            if creds and creds.expired and creds.refresh_token:
+                creds.refresh(Request())
+            else:
+                flow = InstalledAppFlow.from_client_secrets_file("credentials.json", SCOPES)
+                creds = flow.run_local_server(port=0)
+            with open("token.json", "w", encoding="utf-8") as token:
+                token.write(creds.to_json())
+        _creds = creds
+        return creds
+
 def get_calendar_service():
-    creds = None
-    if os.path.exists("token.json"):
-        try:
-            creds = Credentials.from_authorized_user_file("token.json", SCOPES)
-        except (UnicodeDecodeError, ValueError):
-            print("Warning: 'token.json' is invalid or has an encoding issue. Attempting to re-authorize.")
-            os.remove("token.json")
-
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file("credentials.json", SCOPES)
-            creds = flow.run_local_server(port=0)
-        with open("token.json", "w", encoding="utf-8") as token:
-            token.write(creds.to_json())
-    return build("calendar", "v3", credentials=creds)
+    creds = get_calendar_credentials()
+    return get_service("calendar", "v3", creds, cache_key=f"token.json:{creds.refresh_token or creds.token}")
 
 def create_event(
     summary: str,
@@ -369,22 +390,68 @@ def search_events(
     except HttpError as error:
         raise ValueError(f"Failed to search events: {str(error)}")
 
+# Longest range suggest_meeting_times searches, and the most calendars one
+# freebusy query accepts
+MAX_SUGGESTION_DAYS = 31
+MAX_FREEBUSY_CALENDARS = 50
+
+def query_busy_periods(service, calendar_ids: List[str], time_min: datetime.datetime,
+                       time_max: datetime.datetime) -> List[tuple]:
+    """
+    Busy (start, end) periods of every calendar in one freebusy query, in UTC.
+    Calendars Google can't read (not shared, unknown address) are skipped with
+    a warning; raises ValueError if none can be read.
+    """
+    body = {
+        "timeMin": time_min.astimezone(pytz.UTC).isoformat(),
+        "timeMax": time_max.astimezone(pytz.UTC).isoformat(),
+        "items": [{"id": calendar_id} for calendar_id in calendar_ids]
+    }
+    try:
+        calendars = service.freebusy().query(body=body).execute().get("calendars", {})
+    except HttpError as error:
+        raise ValueError(f"Failed to query free/busy status: {str(error)}")
+
+    busy = []
+    readable = 0
+    for calendar_id in calendar_ids:
+        calendar = calendars.get(calendar_id, {})
+        if calendar.get("errors") or calendar_id not in calendars:
+            print(f"Warning: no free/busy information for {calendar_id}: {calendar.get('errors')}")
+            continue
+        readable += 1
+        for period in calendar.get("busy", []):
+            busy.append((datetime.datetime.fromisoformat(period["start"].replace('Z', '+00:00')),
+                         datetime.datetime.fromisoformat(period["end"].replace('Z', '+00:00'))))
+    if not readable:
+        raise ValueError(f"Could not read free/busy status for {', '.join(calendar_ids)}")
+    return busy
+
 def suggest_meeting_times(
     date_string: str,
     duration: Optional[str] = "1 hour",
     time_preference: Optional[str] = None,
     calendar_id: str = "primary",
-    max_suggestions: int = 3
+    max_suggestions: int = 3,
+    attendees: Optional[List[str]] = None,
+    days: int = 1,
+    granularity_minutes: int = 30,
+    include_weekends: bool = False
 ) -> List[str]:
     """
-    Suggest available meeting times based on calendar free/busy status.
+    Suggest meeting times when the user and every attendee are free, based on
+    calendar free/busy status.
     
     Args:
-        date_string: Target date (e.g., "next Tuesday").
+        date_string: Target date, or first day of the range (e.g., "next Tuesday").
         duration: Meeting duration (e.g., "1 hour", "30 minutes").
-        time_preference: Optional time window (e.g., "morning", "9 AM to 2 PM").
+        time_preference: Optional time window (e.g., "morning", "9 AM to 2 PM"). Defaults to working hours (9 AM to 6 PM).
         calendar_id: Calendar ID (default: "primary").
         max_suggestions: Maximum number of suggested slots.
+        attendees: Optional attendee emails whose calendars must also be free.
+        days: Number of days to search from the target date (at most 31).
+        granularity_minutes: Spacing between suggested start times (e.g., 15 for quarter hours).
+        include_weekends: Also suggest Saturday/Sunday slots when searching several days.
     
     Returns:
         List of formatted time slots in local time zone (e.g., "2025-09-23 10:00 AM IST").
@@ -396,53 +463,33 @@ def suggest_meeting_times(
     # Parse date and duration
     start_datetime, end_datetime, time_window = parse_natural_language_datetime(date_string, duration, time_preference)
     parsed_date = datetime.datetime.fromisoformat(start_datetime.replace('Z', '+00:00')).astimezone(user_tz)
-    day_start = parsed_date.replace(hour=0, minute=0, second=0, microsecond=0)
-    day_end = day_start + datetime.timedelta(days=1)
-
-    # Parse duration
+    days = max(1, min(int(days), MAX_SUGGESTION_DAYS))
+    first_day = parsed_date.date()
+    last_day = first_day + datetime.timedelta(days=days - 1)
     duration_minutes = parse_duration(duration)
 
-    # Query free/busy status
-    body = {
-        "timeMin": day_start.astimezone(pytz.UTC).isoformat(),
-        "timeMax": day_end.astimezone(pytz.UTC).isoformat(),
-        "items": [{"id": calendar_id}]
-    }
-    try:
-        freebusy = service.freebusy().query(body=body).execute()
-        busy_periods = freebusy.get("calendars", {}).get(calendar_id, {}).get("busy", [])
-    except HttpError as error:
-        raise ValueError(f"Failed to query free/busy status: {str(error)}")
-
-    # Convert busy periods to user TZ
-    busy_slots = []
-    for period in busy_periods:
-        start = datetime.datetime.fromisoformat(period["start"].replace('Z', '+00:00')).astimezone(user_tz)
-        end = datetime.datetime.fromisoformat(period["end"].replace('Z', '+00:00')).astimezone(user_tz)
-        busy_slots.append((start, end))
+    # The requested time of day, else working hours; a single named day is searched even on a weekend
+    window_start, window_end = time_window or WORKING_HOURS
+    weekdays = None if include_weekends or days == 1 else WORKING_DAYS
+    windows = daily_windows(first_day, last_day, user_tz, window_start, window_end, weekdays)
+    windows = clip_windows(windows, not_before=datetime.datetime.now(pytz.UTC))
 
-    # Find free slots
+    range_text = first_day.strftime('%Y-%m-%d') if days == 1 else f"{first_day:%Y-%m-%d} to {last_day:%Y-%m-%d}"
     free_slots = []
-    current_time = day_start
-    while current_time + datetime.timedelta(minutes=duration_minutes) <= day_end:
-        slot_end = current_time + datetime.timedelta(minutes=duration_minutes)
-        is_free = True
-        for busy_start, busy_end in busy_slots:
-            if not (slot_end <= busy_start or current_time >= busy_end):
-                is_free = False
-                break
-        if is_free and (not time_window or (time_window[0] <= current_time.time() <= time_window[1])):
-            free_slots.append(current_time)
-        current_time += datetime.timedelta(minutes=30)  # Check every 30 minutes
+    if windows:
+        calendar_ids = list(dict.fromkeys([calendar_id] + (attendees or [])))[:MAX_FREEBUSY_CALENDARS]
+        busy = query_busy_periods(service, calendar_ids, windows[0][0], windows[-1][1])
+        free_slots = find_free_slots(busy, windows, datetime.timedelta(minutes=duration_minutes),
+                                     datetime.timedelta(minutes=max(1, int(granularity_minutes))), max_suggestions)
 
     # Format suggestions
     if not free_slots:
-        return [f"No available slots found for a {duration} meeting on {day_start.strftime('%Y-%m-%d')}. Would you like suggestions for another day or a shorter duration?"]
+        return [f"No available slots found for a {duration} meeting on {range_text}. Would you like suggestions for another day or a shorter duration?"]
     
     formatted_slots = []
-    for slot in free_slots[:max_suggestions]:
-        slot_end = slot + datetime.timedelta(minutes=duration_minutes)
-        formatted_slots.append(f"{slot.strftime('%Y-%m-%d %I:%M %p %Z')} - {slot_end.strftime('%I:%M %p %Z')}")
+    for slot_start, slot_end in free_slots:
+        slot_start, slot_end = slot_start.astimezone(user_tz), slot_end.astimezone(user_tz)
+        formatted_slots.append(f"{slot_start.strftime('%Y-%m-%d %I:%M %p %Z')} - {slot_end.strftime('%I:%M %p %Z')}")
     return formatted_slots
 
 def list_events(max_results: int = 10):
@@ -490,6 +537,10 @@ When the user asks to search or query events:
 Meeting Time Suggestions Instructions:
 When the user asks to suggest meeting times (e.g., "Suggest a time for a meeting next Tuesday"):
 - Use `suggest_meeting_times` with the target date, duration, and optional time preference (e.g., "morning", "9 AM to 2 PM").
+- Without a time preference, slots fall within working hours (9 AM to 6 PM); over several days, weekends are skipped unless asked for.
+- For a range (e.g., "sometime next week"), pass the first day and `days` (e.g., 5).
+- If other people must attend, pass their emails as `attendees` so only times everyone is free are suggested.
+- For finer start times (e.g., quarter hours), set `granularity_minutes`.
 - Parse inputs using `parse_natural_language_datetime` to get the date and duration.
 - Return 2-3 free time slots in local TZ (e.g., IST).
 - If no slots are available, suggest alternative days or durations.
@@ -1,15 +1,23 @@
-from flask import Flask, request, jsonify, session, redirect, url_for
+from flask import Flask, request, jsonify, session, redirect, url_for, Response, stream_with_context, g
+from flask import Request as FlaskRequest
 from flask_cors import CORS
 import os
 import json
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 from authentication.goauth import SCOPES
 import os.path
-from email_handler.email_client import email_client_runner
-import tempfile
-import werkzeug
-from util.ocr import extract_text_from_pdf, extract_text_from_pdf_bytes
+from email_handler.email_client import build_gmail_service, build_search_query, get_message_detail, get_attachment
+from email_handler.email_sync import sync_mailbox, search_mailbox, EMAIL_SYNC_LABEL
+from email_handler.attachment_ingest import iter_ingest
+from email_handler.email_threads import assemble_threads, fetch_thread, strip_quoted_reply, attach_thread_to_case, with_email_bodies
+import atexit
+from util.ocr import extract_document, iter_document, format_pages, summarize_sources, spool_pdf, spooled_pdf, scratch_upload_stream, parse_ocr_settings, OCR_MODES
+from util.ocr_cache import get_cache_stats
+from util.google_services import get_service, get_service_stats
+from util.ocr_batch import iter_batch, spool_zip, remove_spooled, CaseDocumentWriter, OCR_BATCH_MAX_FILES
+from util.search_index import search, get_index_stats, index_documents, case_entry, email_entry, SEARCH_KINDS
+from util.ocr_jobs import submit_ocr_job, get_ocr_job, job_status, get_queue_stats, OCRQueueFull, DONE, FAILED
 
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
@@ -21,6 +29,7 @@ from google.auth.transport import requests as google_requests
 
 
 from util.db import *
+from bson.objectid import ObjectId
 # Load environment variables
 load_dotenv()
 
@@ -28,12 +37,25 @@ load_dotenv()
 os.environ['OAUTHLIB_RELAX_TOKEN_SCOPE'] = '1'
 os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
 
+class ScratchUploadRequest(FlaskRequest):
+    # Uploaded files are parsed straight into the OCR scratch dir and hashed on
+    # the way, instead of into Werkzeug's spooled temp file (on disk past
+    # 500 KB) that spool_pdf would then copy again
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return scratch_upload_stream(total_content_length, content_type, filename, content_length)
+
 app = Flask(__name__)
+app.request_class = ScratchUploadRequest
 app.secret_key = os.environ.get("SECRET_KEY") or os.urandom(24)
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 app.config['SESSION_COOKIE_SECURE'] = True
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=7)
 
+atexit.register(close_mongo_client)
+
+# Make sure the lawyers/cases indexes exist before serving queries
+ensure_indexes()
+
 # Enable CORS
 CORS(app, supports_credentials=True, origins=["http://localhost:3000","http://localhost:5000","http://localhost:6767"], expose_headers=["Content-Type", "Authorization"])
 
@@ -45,6 +67,26 @@ FRONTEND_URL = os.environ.get("FRONTEND_URL") or "http://localhost:3000"
 def index():
     return jsonify({"message": "Tender for Lawyers API"})
 
+@app.route('/api/health/db')
+def db_health():
+    healthy = check_mongo_health()
+    return jsonify({"healthy": healthy, "pool": get_pool_stats(), "lawyer_cache": get_lawyer_cache_stats()}), 200 if healthy else 503
+
+@app.route('/api/health/search')
+def search_health():
+    return jsonify({"index": get_index_stats()})
+
+@app.route('/api/health/google')
+def google_health():
+    return jsonify({"services": get_service_stats()})
+
+def current_lawyer():
+    """The signed-in lawyer, looked up at most once per request."""
+    if 'lawyer' not in g:
+        session_user = session.get('user')
+        g.lawyer = get_lawyer(session_user['email']) if session_user else None
+    return g.lawyer
+
 @app.route('/api/auth/login')
 def login():
     # Create flow instance to manage the OAuth 2.0 Authorization Grant Flow
@@ -129,7 +171,7 @@ def get_user():
     # Check if user is in session
     session_user = session.get('user')
     if session_user:
-        user = get_lawyer(session_user['email'])
+        user = current_lawyer()
         if user is None:
             return jsonify({"error": "User does not exist in the database"}), 401
         user['_id'] = str(user['_id'])
@@ -145,12 +187,198 @@ def get_credentials():
         return credentials
     return None
 
+def parse_date_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+    except ValueError:
+        raise ValueError(f"{name} must be a date (YYYY-MM-DD)")
+
 @app.route('/api/email')
 def get_emails():
-    sender = os.getenv("EMAIL_ADDRESS")
-    start_date = '12/5/2024'
-    credentials = get_credentials()
-    return jsonify(email_client_runner(credentials, sender, start_date))
+    """
+    List the lawyer's messages, newest first, one page at a time.
+
+    Query params (all optional):
+        - from: sender address or name
+        - after / before: dates (YYYY-MM-DD)
+        - label: Gmail label id (default: the synced label, INBOX)
+        - q: Gmail search syntax, e.g. 'has:attachment subject:deposition'
+        - limit: page size (default 20, at most 100)
+        - cursor: next_cursor from the previous page
+        - resync=true: force a full mailbox resync
+
+    Without q, and for the synced label, messages come from the local store,
+    which is brought up to date (via Gmail history) on the first page. Other
+    searches run against Gmail, following its page tokens.
+
+    Response: {"emails": [...], "next_cursor": ..., "sync": ...}
+    """
+    session_user = session.get('user')
+    if session_user is None:
+        return jsonify({"error": "Not authenticated"}), 401
+    user = current_lawyer()
+    if user is None:
+        return jsonify({"error": "User does not exist in the database"}), 401
+    credentials = session.get('credentials')
+    if not credentials:
+        return jsonify({"error": "No credentials in session"}), 401
+
+    try:
+        after = parse_date_arg('after')
+        before = parse_date_arg('before')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        limit = max(1, min(int(request.args.get('limit', 20)), MAX_CASES_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    sender = request.args.get('from')
+    query = request.args.get('q')
+    label = request.args.get('label') or EMAIL_SYNC_LABEL
+    cursor = request.args.get('cursor')
+
+    # Cursors say which source issued them: "store:<keyset>" or "gmail:<page token>"
+    source = 'gmail' if query or label != EMAIL_SYNC_LABEL else 'store'
+    if cursor:
+        prefix, _, cursor = cursor.partition(':')
+        if prefix != source or not cursor:
+            return jsonify({"error": "Invalid cursor"}), 400
+
+    sync = None
+    if source == 'store':
+        if not cursor:
+            sync = sync_mailbox(credentials, user['_id'], force_full=request.args.get('resync') == 'true')
+        try:
+            emails, next_cursor = find_emails(user['_id'], sender=sender, after=after, before=before,
+                                              label=label, limit=limit, cursor=cursor)
+        except ValueError:
+            return jsonify({"error": "Invalid cursor"}), 400
+        if emails is None:
+            return jsonify({"error": "Could not load emails"}), 500
+    else:
+        try:
+            service = build_gmail_service(Credentials(**credentials))
+            search = build_search_query(sender, after, before, query)
+            emails, next_cursor = search_mailbox(service, user['_id'], search, label, limit, cursor)
+        except HttpError as e:
+            if e.resp.status == 400:
+                return jsonify({"error": "Invalid search or cursor"}), 400
+            print(f"Error searching mailbox: {str(e)}")
+            return jsonify({"error": "Could not search mailbox"}), 502
+
+    # sync is None when Gmail could not be reached; the stored messages are still returned
+    body = {
+        "emails": emails,
+        "next_cursor": f"{source}:{next_cursor}" if next_cursor else None,
+        "sync": sync,
+    }
+    return json.dumps(body, default=str), 200, {"Content-Type": "application/json"}
+
+def session_gmail_service():
+    credentials = session.get('credentials')
+    if not credentials:
+        return None
+    return build_gmail_service(Credentials(**credentials))
+
+@app.route('/api/email/threads')
+def get_email_threads():
+    """
+    The newest stored messages (limit, default 50) grouped into conversations
+    by Gmail thread and In-Reply-To / References, newest conversation first.
+    """
+    session_user = session.get('user')
+    if session_user is None:
+        return jsonify({"error": "Not authenticated"}), 401
+    user = current_lawyer()
+    if user is None:
+        return jsonify({"error": "User does not exist in the database"}), 401
+    try:
+        limit = int(request.args.get('limit', 50))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    emails, _ = find_emails(user['_id'], label=request.args.get('label') or EMAIL_SYNC_LABEL, limit=limit)
+    if emails is None:
+        return jsonify({"error": "Could not load emails"}), 500
+    return json.dumps({"threads": assemble_threads(emails)}, default=str), 200, {"Content-Type": "application/json"}
+
+@app.route('/api/email/threads/<thread_id>')
+def get_email_thread(thread_id):
+    """One conversation with every message's body; new_text omits the quoted reply."""
+    session_user = session.get('user')
+    if session_user is None:
+        return jsonify({"error": "Not authenticated"}), 401
+    service = session_gmail_service()
+    if service is None:
+        return jsonify({"error": "No credentials in session"}), 401
+    try:
+        messages = fetch_thread(service, thread_id)
+    except HttpError as e:
+        if e.resp.status == 404:
+            return jsonify({"error": "Thread not found"}), 404
+        print(f"Error fetching thread {thread_id}: {str(e)}")
+        return jsonify({"error": "Could not fetch thread"}), 502
+    for message in messages:
+        message["new_text"] = strip_quoted_reply(message["body_text"])
+    thread = assemble_threads(messages)[0] if messages else {"thread_id": thread_id, "messages": []}
+    return json.dumps(thread, default=str), 200, {"Content-Type": "application/json"}
+
+@app.route('/api/email/<gmail_id>')
+def get_email_detail(gmail_id):
+    """
+    A single message with its body text and a list of its attachments
+    (ids, names, types and sizes; the files themselves are not downloaded).
+    """
+    session_user = session.get('user')
+    if session_user is None:
+        return jsonify({"error": "Not authenticated"}), 401
+    user = current_lawyer()
+    if user is None:
+        return jsonify({"error": "User does not exist in the database"}), 401
+
+    email = get_stored_email(user['_id'], gmail_id)
+    if email is None or "body_text" not in email:
+        service = session_gmail_service()
+        if service is None:
+            return jsonify({"error": "No credentials in session"}), 401
+        try:
+            email = get_message_detail(service, gmail_id)
+        except HttpError as e:
+            if e.resp.status == 404:
+                return jsonify({"error": "Email not found"}), 404
+            print(f"Error fetching email {gmail_id}: {str(e)}")
+            return jsonify({"error": "Could not fetch email"}), 502
+        save_email_body(user['_id'], email)
+        index_documents([email_entry(user['_id'], email)])
+    return json.dumps(email, default=str), 200, {"Content-Type": "application/json"}
+
+@app.route('/api/email/<gmail_id>/attachments/<attachment_id>')
+def get_email_attachment(gmail_id, attachment_id):
+    """Download one attachment of a message, only when it is asked for."""
+    session_user = session.get('user')
+    if session_user is None:
+        return jsonify({"error": "Not authenticated"}), 401
+    user = current_lawyer()
+    if user is None:
+        return jsonify({"error": "User does not exist in the database"}), 401
+    service = session_gmail_service()
+    if service is None:
+        return jsonify({"error": "No credentials in session"}), 401
+
+    stored = get_stored_email(user['_id'], gmail_id, {"attachments": 1}) or {}
+    info = next((a for a in stored.get("attachments", []) if a["attachment_id"] == attachment_id), {})
+    try:
+        data = get_attachment(service, gmail_id, attachment_id)
+    except HttpError as e:
+        if e.resp.status in (400, 404):
+            return jsonify({"error": "Attachment not found"}), 404
+        print(f"Error fetching attachment for {gmail_id}: {str(e)}")
+        return jsonify({"error": "Could not fetch attachment"}), 502
+    filename = info.get("filename", "attachment").replace('"', '')
+    return Response(data, mimetype=info.get("mime_type", "application/octet-stream"),
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
 
 @app.route('/api/auth/verify-token', methods=['POST'])
 def verify_token():
@@ -177,7 +405,7 @@ def verify_token():
         )
         
         # Verify token by making a simple API request
-        service = build("oauth2", "v2", credentials=credentials)
+        service = get_service("oauth2", "v2", credentials)
         user_info = service.userinfo().get().execute()
         
         return jsonify({"valid": True, "user": user_info})
@@ -186,16 +414,190 @@ def verify_token():
         print(f"Token verification error: {str(e)}")
         return jsonify({"valid": False, "error": str(e)}), 401
     
+def serialize_case(case):
+    case['_id'] = str(case['_id'])
+    case['user_id'] = str(case['user_id'])
+    return case
+
 @app.route('/api/cases')
 def api_get_cases():
+    """
+    List the current lawyer's cases.
+
+    Query params:
+        - limit / cursor: keyset pagination, newest first. Returns
+          {"cases": [...], "next_cursor": ...}; pass next_cursor back as cursor.
+        - format=ndjson: stream every case as one JSON object per line.
+        - fields=full: return every case field (summary fields by default).
+
+    Without limit, cursor or format the response is a plain JSON array.
+    """
+    session_user = session.get('user')
+    if session_user is None:
+        return jsonify({"error": "Not authenticated"}), 401
+    user = current_lawyer()
+    if user is None:
+        return jsonify({"error": "User does not exist in the database"}), 401
+
+    projection = None if request.args.get('fields') == 'full' else CASE_SUMMARY_PROJECTION
+
+    if request.args.get('format') == 'ndjson':
+        cases = iter_cases(user['_id'], projection)
+        if cases is None:
+            return jsonify({"error": "Could not load cases"}), 500
+
+        def generate():
+            for case in cases:
+                yield json.dumps(serialize_case(case), default=str) + "\n"
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    if 'limit' in request.args or 'cursor' in request.args:
+        try:
+            limit = int(request.args.get('limit', 20))
+        except ValueError:
+            return jsonify({"error": "limit must be an integer"}), 400
+        cursor = request.args.get('cursor')
+        if cursor and not ObjectId.is_valid(cursor):
+            return jsonify({"error": "Invalid cursor"}), 400
+        cases, next_cursor = get_cases_page(user['_id'], limit, cursor, projection)
+        if cases is None:
+            return jsonify({"error": "Could not load cases"}), 500
+        return jsonify({"cases": [serialize_case(case) for case in cases], "next_cursor": next_cursor})
+
+    cases = get_cases(user['_id'], projection)
+    if cases is None:
+        return jsonify({"error": "Could not load cases"}), 500
+    return jsonify([serialize_case(case) for case in cases])
+
+@app.route('/api/cases/<case_id>')
+def api_get_case(case_id):
+    session_user = session.get('user')
+    if session_user is None:
+        return jsonify({"error": "Not authenticated"}), 401
+    user = current_lawyer()
+    if user is None:
+        return jsonify({"error": "User does not exist in the database"}), 401
+    if not ObjectId.is_valid(case_id):
+        return jsonify({"error": "Invalid case id"}), 400
+    case = get_case(user['_id'], case_id)
+    if case is None:
+        return jsonify({"error": "Case not found"}), 404
+    return json.dumps(serialize_case(case), default=str), 200, {"Content-Type": "application/json"}
+
+@app.route('/api/cases/<case_id>/<kind>')
+def api_get_case_items(case_id, kind):
+    """Page through a case's documents, history or emails (limit / cursor, newest first)."""
+    if kind not in CASE_CHILD_COLLECTIONS:
+        return jsonify({"error": "Unknown case collection"}), 404
+    session_user = session.get('user')
+    if session_user is None:
+        return jsonify({"error": "Not authenticated"}), 401
+    user = current_lawyer()
+    if user is None:
+        return jsonify({"error": "User does not exist in the database"}), 401
+    if not ObjectId.is_valid(case_id):
+        return jsonify({"error": "Invalid case id"}), 400
+    if get_case(user['_id'], case_id, {"_id": 1}) is None:
+        return jsonify({"error": "Case not found"}), 404
+    try:
+        limit = int(request.args.get('limit', 20))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    cursor = request.args.get('cursor')
+    if cursor and not ObjectId.is_valid(cursor):
+        return jsonify({"error": "Invalid cursor"}), 400
+    items, next_cursor = get_case_items(case_id, kind, limit, cursor)
+    if items is None:
+        return jsonify({"error": "Could not load case items"}), 500
+    if kind == "emails":
+        items = with_email_bodies(items)
+    body = {"items": items, "next_cursor": next_cursor}
+    return json.dumps(body, default=str), 200, {"Content-Type": "application/json"}
+
+@app.route('/api/cases/<case_id>/threads', methods=['POST'])
+def api_attach_thread(case_id):
+    """
+    Attach a Gmail thread ({"thread_id": ...}) to a case's emails. Messages
+    already attached are skipped, so re-attaching a thread only adds new replies.
+    """
+    data = request.get_json(silent=True) or {}
+    if not data.get("thread_id"):
+        return jsonify({"error": "thread_id is required"}), 400
+    session_user = session.get('user')
+    if session_user is None:
+        return jsonify({"error": "Not authenticated"}), 401
+    user = current_lawyer()
+    if user is None:
+        return jsonify({"error": "User does not exist in the database"}), 401
+    if not ObjectId.is_valid(case_id):
+        return jsonify({"error": "Invalid case id"}), 400
+    if get_case(user['_id'], case_id, {"_id": 1}) is None:
+        return jsonify({"error": "Case not found"}), 404
+    service = session_gmail_service()
+    if service is None:
+        return jsonify({"error": "No credentials in session"}), 401
+    result = attach_thread_to_case(service, user['_id'], case_id, data["thread_id"])
+    if result is None:
+        return jsonify({"error": "Could not attach thread"}), 502
+    return jsonify(result)
+
+@app.route('/api/cases/<case_id>/attachments', methods=['POST'])
+def api_ingest_attachments(case_id):
+    """
+    OCR the PDF attachments of the lawyer's messages and store their text as
+    the case's documents, streaming one NDJSON line per file as it finishes.
+
+    Request JSON (all optional):
+        - gmail_ids: messages to take attachments from
+        - query: Gmail search to find the messages, e.g. 'from:opposing@firm.com'
+          (used when gmail_ids is not given; 'has:attachment filename:pdf' is added)
+        - mode and OCR settings, as for /api/ocr/extract
+    Without gmail_ids or query, the attachments of the emails already
+    attached to the case are ingested.
+
+    Response lines:
+        - document: batch OCR result plus "gmail_id" and "stored"
+        - done: counts (attachments, already_stored, duplicates, downloaded, stored, ...)
+        - error: {"error"}
+    """
+    data = request.get_json(silent=True) or {}
+    gmail_ids = data.get("gmail_ids")
+    if gmail_ids is not None and (not isinstance(gmail_ids, list) or not all(isinstance(i, str) for i in gmail_ids)):
+        return jsonify({"error": "gmail_ids must be a list of message ids"}), 400
+    query = data.get("query")
+    mode = data.get('mode', 'auto')
+    if mode not in OCR_MODES:
+        return jsonify({"error": f"mode must be one of {', '.join(OCR_MODES)}"}), 400
+    try:
+        settings = parse_ocr_settings(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     session_user = session.get('user')
     if session_user is None:
         return jsonify({"error": "Not authenticated"}), 401
-    user = get_lawyer(session_user['email'])
+    user = current_lawyer()
     if user is None:
         return jsonify({"error": "User does not exist in the database"}), 401
-    cases = get_cases(user['_id'])
-    return jsonify(cases)
+    if not ObjectId.is_valid(case_id):
+        return jsonify({"error": "Invalid case id"}), 400
+    if get_case(user['_id'], case_id, {"_id": 1}) is None:
+        return jsonify({"error": "Case not found"}), 404
+    service = session_gmail_service()
+    if service is None:
+        return jsonify({"error": "No credentials in session"}), 401
+    user_id = user['_id']
+
+    def generate():
+        try:
+            for event, body in iter_ingest(service, user_id, case_id, gmail_ids, query, mode=mode, settings=settings):
+                yield json.dumps(dict(body, event=event), default=str) + "\n"
+        except Exception as e:
+            print(f"Error ingesting attachments: {str(e)}")
+            yield json.dumps({"event": "error", "error": f"Error ingesting attachments: {str(e)}"}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.route('/api/cases', methods=['POST'])
 def api_create_case():
@@ -205,16 +607,58 @@ def api_create_case():
     session_user = session.get('user')
     if session_user is None:
         return jsonify({"error": "Not authenticated"}), 401
-    user = get_lawyer(session_user['email'])
+    user = current_lawyer()
     if user is None:
         return jsonify({"error": "User does not exist in the database"}), 401
-    create_case(user['_id'], data["case_name"], data["case_summary"], data["client_name"], data["client_email"])
-    cases = get_cases(user['_id'])
-    for case in cases:
-        case['_id'] = str(case['_id'])
-        case['user_id'] = str(case['user_id'])
-    return jsonify(cases)
+    case = create_case(user['_id'], data["case_name"], data["case_summary"], data["client_name"], data["client_email"])
+    if case is None:
+        return jsonify({"error": "Could not create case"}), 500
+    index_documents([case_entry(user['_id'], case)])
+    # Return only the new case; clients already hold the rest of the list
+    return jsonify(serialize_case(case)), 201
+
+
+@app.route('/api/search')
+def api_search():
+    """
+    Full-text search over the lawyer's cases, OCR'd documents and emails.
 
+    Query params:
+        - q: words to find; "quoted text" matches a phrase, word* a prefix
+        - kind: comma-separated subset of case, document, case_email, email
+        - case_id: only results belonging to this case
+        - limit (default 20, at most 100) / offset
+
+    Response: {"results": [{"kind", "ref_id", "case_id", "title", "snippet", "score"}], "next_offset": ...}
+    Matched words are wrapped in [ ] in snippets.
+    """
+    query = (request.args.get('q') or '').strip()
+    if not query:
+        return jsonify({"error": "q is required"}), 400
+    session_user = session.get('user')
+    if session_user is None:
+        return jsonify({"error": "Not authenticated"}), 401
+    user = current_lawyer()
+    if user is None:
+        return jsonify({"error": "User does not exist in the database"}), 401
+
+    kinds = [kind for kind in (request.args.get('kind') or '').split(',') if kind]
+    unknown = [kind for kind in kinds if kind not in SEARCH_KINDS]
+    if unknown:
+        return jsonify({"error": f"Unknown kind: {', '.join(unknown)}"}), 400
+    case_id = request.args.get('case_id')
+    if case_id and not ObjectId.is_valid(case_id):
+        return jsonify({"error": "Invalid case id"}), 400
+    try:
+        limit = max(1, min(int(request.args.get('limit', 20)), MAX_CASES_PAGE_SIZE))
+        offset = max(0, int(request.args.get('offset', 0)))
+    except ValueError:
+        return jsonify({"error": "limit and offset must be integers"}), 400
+
+    results = search(user['_id'], query, kinds, case_id, limit, offset)
+    if results is None:
+        return jsonify({"error": "Search failed"}), 500
+    return jsonify({"results": results, "next_offset": offset + limit if len(results) == limit else None})
 
 @app.route('/api/ocr/extract', methods=['POST'])
 def extract_text_from_pdf_endpoint():
@@ -223,9 +667,17 @@ def extract_text_from_pdf_endpoint():
     
     Request:
         - multipart/form-data with 'file' field containing the PDF file
-        
+        - optional 'mode' (form field or query param): 'auto' (default) reads
+          the PDF's text layer and only OCRs pages without one, 'ocr' OCRs
+          every page, 'native' only reads the text layer
+        - optional OCR settings (form fields or query params): 'dpi',
+          'grayscale', 'binarize', 'deskew', 'adaptive', 'max_dpi',
+          'min_confidence'. With adaptive=true pages are OCR'd at a low DPI
+          first and only re-OCR'd at a higher one when confidence is low
+
     Response:
-        - JSON with 'text' field containing the extracted text
+        - JSON with 'text' field containing the extracted text, and 'pages'
+          listing whether each page was read natively or OCR'd
     """
     try:
         print("OCR extract endpoint called")
@@ -247,26 +699,29 @@ def extract_text_from_pdf_endpoint():
         if not file.filename.lower().endswith('.pdf'):
             print(f"Not a PDF file: {file.filename}")
             return jsonify({"error": "File must be a PDF"}), 400
+
+        mode = request.form.get('mode') or request.args.get('mode') or 'auto'
+        if mode not in OCR_MODES:
+            return jsonify({"error": f"mode must be one of {', '.join(OCR_MODES)}"}), 400
+        try:
+            settings = parse_ocr_settings({**request.args.to_dict(), **request.form.to_dict()})
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
-        # Create a temporary file with a proper name
-        fd, temp_path = tempfile.mkstemp(suffix='.pdf')
-        os.close(fd)
-        file.save(temp_path)
-        
-        print(f"Saved file to temporary path: {temp_path}")
-        
-        # Extract text from the PDF
-        text = extract_text_from_pdf(temp_path)
-        
-        # Clean up
-        os.remove(temp_path)
-        print(f"Removed temporary file: {temp_path}")
+        # Stream the upload into RAM-backed scratch space (hashing it for the
+        # OCR cache as it goes); the file is removed even if extraction fails
+        with spooled_pdf(file.stream) as (pdf_path, content_hash):
+            print(f"Spooled upload to {pdf_path}")
+            document = extract_document(pdf_path, mode=mode, content_hash=content_hash, settings=settings)
+        text = format_pages(document["pages"])
         
         print(f"Extracted text length: {len(text)}")
         
         return jsonify({
             "text": text,
             "filename": file.filename,
+            "mode": mode,
+            **summarize_sources(document["sources"], document["cached_pages"]),
             "success": True
         })
     
@@ -279,5 +734,259 @@ def extract_text_from_pdf_endpoint():
         }), 500
 
 
+@app.route('/api/ocr/extract/stream', methods=['POST'])
+def stream_text_from_pdf_endpoint():
+    """
+    Extract text from a PDF and stream each page as soon as it is ready.
+
+    Request:
+        - same as /api/ocr/extract, plus optional 'format': 'sse' (default,
+          text/event-stream) or 'ndjson' (one JSON object per line)
+
+    Response events:
+        - page: {"page", "page_count", "pages_done", "source", "cached", "text"}
+        - done: {"pages_done", "native_pages", "ocr_pages", "cached_pages"}
+        - error: {"error"}
+        Pages are not necessarily in page order; use the 'page' field.
+    """
+    if 'file' not in request.files:
+        return jsonify({"error": "No file part"}), 400
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({"error": "No file selected"}), 400
+    if not file.filename.lower().endswith('.pdf'):
+        return jsonify({"error": "File must be a PDF"}), 400
+    mode = request.form.get('mode') or request.args.get('mode') or 'auto'
+    if mode not in OCR_MODES:
+        return jsonify({"error": f"mode must be one of {', '.join(OCR_MODES)}"}), 400
+    stream_format = request.form.get('format') or request.args.get('format') or 'sse'
+    if stream_format not in ('sse', 'ndjson'):
+        return jsonify({"error": "format must be sse or ndjson"}), 400
+    try:
+        settings = parse_ocr_settings({**request.args.to_dict(), **request.form.to_dict()})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Spool before the response starts; the generator removes the file
+    pdf_path, content_hash = spool_pdf(file.stream)
+    filename = file.filename
+
+    def encode(event, data):
+        if stream_format == 'sse':
+            return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        return json.dumps(dict(data, event=event)) + "\n"
+
+    def generate():
+        counts = {"pages_done": 0, "native_pages": 0, "ocr_pages": 0, "cached_pages": 0}
+        try:
+            for page in iter_document(pdf_path, mode=mode, content_hash=content_hash, settings=settings):
+                counts["pages_done"] += 1
+                counts["native_pages" if page["source"] == "native" else "ocr_pages"] += 1
+                counts["cached_pages"] += page["cached"]
+                yield encode("page", dict(page, pages_done=counts["pages_done"], filename=filename))
+            yield encode("done", dict(counts, filename=filename))
+        except Exception as e:
+            print(f"Error streaming text from PDF: {str(e)}")
+            yield encode("error", {"error": f"Error extracting text from PDF: {str(e)}"})
+        finally:
+            if os.path.exists(pdf_path):
+                os.remove(pdf_path)
+
+    mimetype = 'text/event-stream' if stream_format == 'sse' else 'application/x-ndjson'
+    # Disable proxy buffering so events reach the client as they are produced
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/api/ocr/batch', methods=['POST'])
+def batch_text_from_pdfs_endpoint():
+    """
+    Extract text from several PDFs at once, streaming each document's result
+    as NDJSON as soon as it is finished.
+
+    Request:
+        - multipart/form-data with one or more 'files' PDF fields and/or an
+          'archive' field holding a zip of PDFs
+        - optional 'mode' and OCR settings fields, as for /api/ocr/extract
+        - optional 'case_id': store each document's text against that case
+          (requires login; files the case already holds are not stored again)
+
+    Response lines:
+        - document: {"filename", "filenames", "content_hash", "text", "page_count",
+          "native_pages", "ocr_pages", "cached_pages", "success", "stored"}
+          (identical uploads are processed once and listed under "filenames").
+          With case_id, documents to store are sent after their bulk write, so
+          "stored" reports what was actually written
+        - done: {"documents", "failed", "stored"}
+        - error: {"error"}
+    """
+    files = [file for file in request.files.getlist('files') if file.filename]
+    archive = request.files.get('archive')
+    if not files and (archive is None or archive.filename == ''):
+        return jsonify({"error": "No files selected"}), 400
+    if any(not file.filename.lower().endswith('.pdf') for file in files):
+        return jsonify({"error": "Files must be PDFs"}), 400
+    if len(files) > OCR_BATCH_MAX_FILES:
+        return jsonify({"error": f"At most {OCR_BATCH_MAX_FILES} PDFs can be processed in one batch"}), 400
+    mode = request.form.get('mode', 'auto')
+    if mode not in OCR_MODES:
+        return jsonify({"error": f"mode must be one of {', '.join(OCR_MODES)}"}), 400
+    try:
+        settings = parse_ocr_settings(request.form)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    case_id = request.form.get('case_id')
+    user_id = None
+    if case_id:
+        if session.get('user') is None:
+            return jsonify({"error": "Not authenticated"}), 401
+        user = current_lawyer()
+        if user is None:
+            return jsonify({"error": "User does not exist in the database"}), 401
+        if not ObjectId.is_valid(case_id):
+            return jsonify({"error": "Invalid case id"}), 400
+        if get_case(user['_id'], case_id, {"_id": 1}) is None:
+            return jsonify({"error": "Case not found"}), 404
+        user_id = user['_id']
+
+    # Spool everything before the response starts; the generator removes the files
+    documents = []
+    try:
+        for file in files:
+            pdf_path, content_hash = spool_pdf(file.stream)
+            documents.append({"filename": file.filename, "path": pdf_path, "content_hash": content_hash})
+        if archive is not None and archive.filename:
+            documents.extend(spool_zip(archive.stream))
+    except ValueError as e:
+        remove_spooled(documents)
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        remove_spooled(documents)
+        print(f"Error reading batch upload: {str(e)}")
+        return jsonify({"error": f"Error reading upload: {str(e)}"}), 400
+    if not documents:
+        return jsonify({"error": "No PDFs found in upload"}), 400
+    if len(documents) > OCR_BATCH_MAX_FILES:
+        remove_spooled(documents)
+        return jsonify({"error": f"At most {OCR_BATCH_MAX_FILES} PDFs can be processed in one batch"}), 400
+
+    already_stored = get_case_document_hashes(case_id, [d["content_hash"] for d in documents]) if case_id else set()
+
+    def encode(event, data):
+        return json.dumps(dict(data, event=event)) + "\n"
+
+    def generate():
+        counts = {"documents": 0, "failed": 0, "stored": 0}
+        writer = CaseDocumentWriter(user_id, case_id) if case_id else None
+
+        try:
+            for result in iter_batch(documents, mode=mode, settings=settings):
+                counts["documents"] += 1
+                if not result["success"]:
+                    counts["failed"] += 1
+                elif case_id and result["content_hash"] not in already_stored:
+                    already_stored.add(result["content_hash"])
+                    for written in writer.add(result):
+                        yield encode("document", written)
+                    continue
+                yield encode("document", dict(result, stored=False))
+            if writer is not None:
+                for written in writer.flush():
+                    yield encode("document", written)
+                counts["stored"] = writer.stored
+            yield encode("done", counts)
+        except Exception as e:
+            print(f"Error in batch OCR: {str(e)}")
+            yield encode("error", {"error": f"Error extracting text from PDFs: {str(e)}"})
+        finally:
+            remove_spooled(documents)
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def ocr_job_owner():
+    # Per-user job limits key on the signed-in email, or the client address
+    session_user = session.get('user')
+    if session_user and session_user.get('email'):
+        return session_user['email']
+    return request.remote_addr
+
+@app.route('/api/ocr/jobs', methods=['POST'])
+def submit_ocr_job_endpoint():
+    """
+    Queue a PDF for background OCR.
+
+    Request:
+        - multipart/form-data with 'file' field containing the PDF file
+        - optional 'mode' form field: 'auto' (default), 'ocr' or 'native'
+        - optional OCR settings form fields, as for /api/ocr/extract
+
+    Response:
+        - 202 with 'job_id'; poll /api/ocr/jobs/<job_id> for progress
+        - 429 if the OCR queue or the caller's job limit is full
+    """
+    if 'file' not in request.files:
+        return jsonify({"error": "No file part"}), 400
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({"error": "No file selected"}), 400
+    if not file.filename.lower().endswith('.pdf'):
+        return jsonify({"error": "File must be a PDF"}), 400
+    try:
+        settings = parse_ocr_settings(request.form)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    mode = request.form.get('mode', 'auto')
+    if mode not in OCR_MODES:
+        return jsonify({"error": f"mode must be one of {', '.join(OCR_MODES)}"}), 400
+
+    pdf_path = None
+    try:
+        # The job takes ownership of the spooled file and removes it when done
+        pdf_path, content_hash = spool_pdf(file.stream)
+        job_id = submit_ocr_job(ocr_job_owner(), pdf_path, file.filename, mode=mode,
+                                content_hash=content_hash, settings=settings)
+    except OCRQueueFull as e:
+        os.remove(pdf_path)
+        return jsonify({"error": str(e)}), 429, {"Retry-After": "5"}
+    except Exception as e:
+        if pdf_path and os.path.exists(pdf_path):
+            os.remove(pdf_path)
+        print(f"Error queueing OCR job: {str(e)}")
+        return jsonify({"error": f"Error queueing OCR job: {str(e)}"}), 500
+
+    return jsonify({
+        "job_id": job_id,
+        "status_url": url_for('get_ocr_job_status', job_id=job_id),
+        "result_url": url_for('get_ocr_job_result', job_id=job_id),
+    }), 202
+
+@app.route('/api/ocr/jobs/<job_id>')
+def get_ocr_job_status(job_id):
+    job = get_ocr_job(job_id, ocr_job_owner())
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job_status(job))
+
+@app.route('/api/ocr/jobs/<job_id>/result')
+def get_ocr_job_result(job_id):
+    job = get_ocr_job(job_id, ocr_job_owner())
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    if job["status"] == FAILED:
+        return jsonify({"error": job["error"], "success": False}), 500
+    if job["status"] != DONE:
+        return jsonify(job_status(job)), 202
+    return jsonify({
+        **job["result"],
+        "filename": job["filename"],
+        "success": True
+    })
+
+@app.route('/api/ocr/stats')
+def get_ocr_stats():
+    return jsonify({**get_queue_stats(), "cache": get_cache_stats()})
+
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=6767)
\ No newline at end of file
@@ -0,0 +1,183 @@
+import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from email_handler.email_client import (fetch_messages, fetch_attachments, get_attachments, list_message_ids,
+                                        GMAIL_BATCH_SIZE)
+from util.db import get_case_document_hashes, get_case_attachment_sources, get_case_email_attachments
+from util.ocr import spool_pdf
+from util.ocr_batch import iter_batch, remove_spooled, CaseDocumentWriter
+
+# Ingests PDF attachments of a lawyer's messages into a case's documents.
+# Attachments are downloaded in Gmail batch requests, a chunk at a time, and
+# their decoded bytes go straight to the OCR scratch dir (RAM-backed where
+# possible, see util.ocr.spool_pdf) that the batch OCR pool reads from. The
+# next chunk downloads while the current one is OCR'd. Files are deduplicated
+# by SHA-256, within a run and against what the case already holds, and
+# attachments the case already has from the same message are not downloaded
+# again.
+
+# Upper bound on attachment bytes held at once (downloads plus spooled files)
+ATTACHMENT_INGEST_MEMORY_MB = int(os.getenv("ATTACHMENT_INGEST_MEMORY_MB", 128))
+# Larger attachments are skipped (Gmail's own limit is 25 MB)
+ATTACHMENT_MAX_MB = int(os.getenv("ATTACHMENT_MAX_MB", 25))
+ATTACHMENT_INGEST_MAX_MESSAGES = int(os.getenv("ATTACHMENT_INGEST_MAX_MESSAGES", 100))
+
+# A chunk costs about 3x its size while downloading (the base64 batch response
+# and the decoded bytes) and 1x once spooled. One chunk is OCR'd while the next
+# downloads, so each gets a quarter of the budget.
+_CHUNK_SHARE = 4
+
+
+def is_pdf(attachment: dict) -> bool:
+    return attachment.get("mime_type") == "application/pdf" or attachment.get("filename", "").lower().endswith(".pdf")
+
+
+def find_pdf_attachments(service, gmail_ids: List[str]) -> List[dict]:
+    """PDF attachments of the given messages: [{"gmail_id", "attachment_id", "filename", "mime_type", "size"}]."""
+    found = []
+
+    def on_message(msg_id, message, error):
+        if error is None:
+            found.extend(dict(attachment, gmail_id=msg_id) for attachment in get_attachments(message)
+                         if is_pdf(attachment))
+
+    fetch_messages(service, gmail_ids, format='full', callback=on_message)
+    return found
+
+
+def case_pdf_attachments(case_id: str) -> List[dict]:
+    """PDF attachments listed on the emails already attached to a case (no Gmail request needed)."""
+    return [dict(attachment, gmail_id=email["gmail_id"])
+            for email in get_case_email_attachments(case_id)
+            for attachment in email["attachments"] if is_pdf(attachment)]
+
+
+def _chunks(attachments: List[dict], budget_bytes: int):
+    # An attachment larger than the budget still goes through, alone
+    chunk, size = [], 0
+    for attachment in attachments:
+        if chunk and (size + attachment["size"] > budget_bytes or len(chunk) >= GMAIL_BATCH_SIZE):
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(attachment)
+        size += attachment["size"]
+    if chunk:
+        yield chunk
+
+
+def _download_chunk(service, case_id: str, attachments: List[dict], seen: set) -> tuple:
+    """
+    Download one chunk and spool the files that are new to the run and the case.
+    Returns (documents for iter_batch, counts).
+    """
+    downloaded = {}
+    counts = {"downloaded": 0, "download_failed": 0, "duplicates": 0, "already_stored": 0, "bytes": 0}
+
+    def on_attachment(attachment, data, error):
+        if error is not None:
+            counts["download_failed"] += 1
+            return
+        counts["downloaded"] += 1
+        counts["bytes"] += len(data)
+        content_hash = hashlib.sha256(data).hexdigest()
+        if content_hash in seen or content_hash in downloaded:
+            counts["duplicates"] += 1
+        else:
+            downloaded[content_hash] = (attachment, data)
+
+    fetch_attachments(service, attachments, on_attachment)
+    stored = get_case_document_hashes(case_id, list(downloaded))
+    counts["already_stored"] = len(stored)
+    seen.update(downloaded)
+
+    documents = []
+    try:
+        for content_hash, (attachment, data) in downloaded.items():
+            if content_hash in stored:
+                continue
+            path, _ = spool_pdf(data)
+            documents.append({"filename": attachment["filename"], "path": path, "content_hash": content_hash,
+                              "gmail_id": attachment["gmail_id"]})
+    except Exception:
+        remove_spooled(documents)
+        raise
+    return documents, counts
+
+
+def _discard(future):
+    # Remove the files of a chunk nobody will OCR
+    if not future.cancelled() and future.exception() is None:
+        remove_spooled(future.result()[0])
+
+
+def iter_ingest(service, user_id: str, case_id: str, gmail_ids: Optional[List[str]] = None,
+                query: Optional[str] = None, dpi: int = 300, mode: str = "auto", settings: Optional[dict] = None):
+    """
+    OCR the PDF attachments of some messages and store the text as the case's documents.
+
+    Messages are gmail_ids, else the matches of a Gmail search (query), else
+    the emails already attached to the case. Yields ("document", result) for
+    each distinct file (iter_batch results plus "gmail_id" and "stored"),
+    then ("done", counts). Files being stored are yielded after their bulk
+    write, so "stored" is what was actually written.
+    """
+    if gmail_ids is None and query:
+        gmail_ids, _ = list_message_ids(service, f"{query} has:attachment filename:pdf",
+                                        limit=ATTACHMENT_INGEST_MAX_MESSAGES)
+    if gmail_ids is not None:
+        attachments = find_pdf_attachments(service, gmail_ids[:ATTACHMENT_INGEST_MAX_MESSAGES])
+    else:
+        attachments = case_pdf_attachments(case_id)
+
+    counts = {"attachments": len(attachments), "already_stored": 0, "too_large": 0, "downloaded": 0,
+              "download_failed": 0, "duplicates": 0, "bytes": 0, "documents": 0, "failed": 0, "stored": 0}
+    sources = get_case_attachment_sources(case_id, list({attachment["gmail_id"] for attachment in attachments}))
+    todo = []
+    for attachment in attachments:
+        if (attachment["gmail_id"], attachment["filename"]) in sources:
+            counts["already_stored"] += 1
+        elif attachment["size"] > ATTACHMENT_MAX_MB * 1024 * 1024:
+            counts["too_large"] += 1
+        else:
+            todo.append(attachment)
+
+    chunks = list(_chunks(todo, ATTACHMENT_INGEST_MEMORY_MB * 1024 * 1024 // _CHUNK_SHARE))
+    counts["chunks"] = len(chunks)
+    seen = set()
+    writer = CaseDocumentWriter(user_id, case_id)
+
+    downloader = ThreadPoolExecutor(max_workers=1)
+    next_chunk = downloader.submit(_download_chunk, service, case_id, chunks[0], seen) if chunks else None
+    documents = []
+    try:
+        for i in range(len(chunks)):
+            documents, chunk_counts = next_chunk.result()
+            next_chunk = (downloader.submit(_download_chunk, service, case_id, chunks[i + 1], seen)
+                          if i + 1 < len(chunks) else None)
+            for key, value in chunk_counts.items():
+                counts[key] += value
+
+            by_hash = {document["content_hash"]: document for document in documents}
+            for result in iter_batch(documents, dpi, mode, settings):
+                counts["documents"] += 1
+                document = by_hash[result["content_hash"]]
+                if not result["success"]:
+                    counts["failed"] += 1
+                    yield "document", dict(result, gmail_id=document["gmail_id"], stored=False)
+                    continue
+                for written in writer.add(dict(result, gmail_id=document["gmail_id"]),
+                                          source="email", gmail_id=document["gmail_id"]):
+                    yield "document", written
+            remove_spooled(documents)
+            documents = []
+        for written in writer.flush():
+            yield "document", written
+        counts["stored"] = writer.stored
+        yield "done", counts
+    finally:
+        remove_spooled(documents)
+        if next_chunk is not None:
+            next_chunk.add_done_callback(_discard)
+        downloader.shutdown(wait=False)
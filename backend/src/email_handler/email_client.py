@@ -1,31 +1,73 @@
 import os
 import base64
 import json
+import random
 import re
 import time
-from typing import List, Optional, Tuple
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
 
 from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from html import unescape
 
+from util.google_services import get_service
+
 # If modifying SCOPES, delete token.json to reauthorize.
 SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
 
+# Messages per Gmail HTTP batch request. Gmail allows up to 100 but starts
+# rate limiting large batches, so 50 is its recommended ceiling.
+GMAIL_BATCH_SIZE = int(os.getenv("GMAIL_BATCH_SIZE", 50))
+# Retries for messages that fail with 429 or 5xx, with exponential backoff
+GMAIL_MAX_RETRIES = int(os.getenv("GMAIL_MAX_RETRIES", 5))
+GMAIL_BACKOFF_SECONDS = float(os.getenv("GMAIL_BACKOFF_SECONDS", 1))
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# The only headers list views and thread assembly read (see parse_message).
+# Listing with format='metadata' and these headers skips bodies and attachments.
+METADATA_HEADERS = ['Subject', 'From', 'To', 'Date', 'Message-ID', 'In-Reply-To', 'References']
+
 def build_gmail_service(creds) -> 'googleapiclient.discovery.Resource':
-    return build('gmail', 'v1', credentials=creds)
+    # Cached per credential; see util.google_services
+    return get_service('gmail', 'v1', creds)
+
 
+def build_search_query(sender: Optional[str] = None, after=None, before=None, query: Optional[str] = None) -> str:
+    """Gmail search string for the given filters (dates are date/datetime objects)."""
+    terms = []
+    if sender:
+        terms.append(f'from:{sender}')
+    if after:
+        terms.append(f'after:{after:%Y/%m/%d}')
+    if before:
+        terms.append(f'before:{before:%Y/%m/%d}')
+    if query:
+        terms.append(query)
+    return ' '.join(terms)
 
-def get_messages(service, sender, start_date, max_results=5) -> Optional[str]:
-    """Return the message ID of the most recent message in the user's INBOX (or None)."""
-    results = service.users().messages().list(userId='me', q=f'from:{sender} after:{start_date}', labelIds=['INBOX'], maxResults=max_results).execute()
-    messages = results.get('messages', [])
-    if not messages:
-        return None
-    
-    return messages
+
+def list_message_ids(service, query: str = '', label_ids: Optional[List[str]] = None, limit: int = 20,
+                     page_token: Optional[str] = None) -> Tuple[List[str], Optional[str]]:
+    """
+    Return up to limit message ids matching query, newest first, following
+    nextPageToken as needed, plus the token to continue from (None at the end).
+    """
+    ids = []
+    while len(ids) < limit:
+        # Never ask for more than is still needed, so the returned token resumes exactly
+        response = service.users().messages().list(
+            userId='me', q=query or None, labelIds=label_ids or None,
+            maxResults=min(500, limit - len(ids)), pageToken=page_token
+        ).execute()
+        ids.extend(message['id'] for message in response.get('messages', []))
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            break
+    return ids, page_token
 
 
 def get_message(service, msg_id: str) -> dict:
@@ -33,16 +75,128 @@ def get_message(service, msg_id: str) -> dict:
     return service.users().messages().get(userId='me', id=msg_id, format='full').execute()
 
 
+def get_attachment(service, msg_id: str, attachment_id: str) -> bytes:
+    """Download one attachment's bytes (users.messages.attachments.get)."""
+    attachment = service.users().messages().attachments().get(userId='me', messageId=msg_id, id=attachment_id).execute()
+    return _b64_urlsafe_decode(attachment.get('data', ''))
+
+
+def _is_retryable(error: Exception) -> bool:
+    return isinstance(error, HttpError) and error.resp is not None and int(error.resp.status) in RETRYABLE_STATUSES
+
+
+def _backoff(attempt: int):
+    # Exponential backoff with jitter: ~1s, 2s, 4s, ...
+    delay = GMAIL_BACKOFF_SECONDS * (2 ** attempt)
+    time.sleep(delay + random.uniform(0, delay / 2))
+
+
+def _execute_batches(service, requests: Dict[str, Callable[[], object]],
+                     on_result: Callable[[str, Optional[dict], Optional[Exception]], None],
+                     batch_size: Optional[int] = None, name: str = 'batch'):
+    """
+    Run requests ({request_id: factory returning an HttpRequest}) as Gmail HTTP
+    batch requests of batch_size, calling on_result(request_id, response, error)
+    once per request when its result is final. Requests that fail with 429/5xx
+    are retried with backoff up to GMAIL_MAX_RETRIES times.
+    """
+    batch_size = max(1, min(batch_size or GMAIL_BATCH_SIZE, 100))
+    pending = list(requests)
+    attempt = 0
+
+    while pending:
+        retry = []
+
+        def on_response(request_id, response, exception):
+            if exception is None:
+                on_result(request_id, response, None)
+            elif _is_retryable(exception) and attempt < GMAIL_MAX_RETRIES:
+                retry.append(request_id)
+            else:
+                print(f"{name}: {request_id} failed: {str(exception)}")
+                on_result(request_id, None, exception)
+
+        for start in range(0, len(pending), batch_size):
+            chunk = pending[start:start + batch_size]
+            batch = service.new_batch_http_request(callback=on_response)
+            for request_id in chunk:
+                batch.add(requests[request_id](), request_id=request_id)
+            try:
+                batch.execute()
+            except HttpError as e:
+                # The whole batch was rejected (e.g. rate limited); retry all of it
+                if not _is_retryable(e) or attempt >= GMAIL_MAX_RETRIES:
+                    raise
+                retry.extend(chunk)
+
+        if retry:
+            print(f"{name}: retrying {len(retry)} requests (attempt {attempt + 1})")
+            _backoff(attempt)
+        pending = retry
+        attempt += 1
+
+
+def fetch_messages(service, msg_ids: List[str], format: str = 'full',
+                   callback: Optional[Callable[[str, Optional[dict], Optional[Exception]], None]] = None,
+                   batch_size: Optional[int] = None, **get_kwargs) -> Dict[str, dict]:
+    """
+    Fetch many messages with Gmail HTTP batch requests, one round trip per
+    batch_size messages instead of one per message.
+
+    Args:
+        service: Gmail API service
+        msg_ids: Message ids to fetch
+        format: users.messages.get format ('full', 'metadata', ...)
+        callback: Optional callback(msg_id, message, error), called once per
+                  message as soon as its result is final
+        batch_size: Messages per batch request (defaults to GMAIL_BATCH_SIZE, at most 100)
+        **get_kwargs: Extra users.messages.get arguments (e.g. metadataHeaders)
+
+    Returns:
+        {msg_id: message} for every message that was fetched. Messages that
+        fail with 429/5xx are retried with backoff up to GMAIL_MAX_RETRIES times;
+        other failures are reported to the callback and left out.
+    """
+    results = {}
+
+    def on_result(msg_id, message, error):
+        if error is None:
+            results[msg_id] = message
+        if callback:
+            callback(msg_id, message, error)
+
+    requests = {msg_id: (lambda msg_id=msg_id: service.users().messages().get(
+                    userId='me', id=msg_id, format=format, **get_kwargs))
+                for msg_id in dict.fromkeys(msg_ids)}
+    _execute_batches(service, requests, on_result, batch_size, 'fetch_messages')
+    return results
+
+
+def fetch_attachments(service, attachments: List[dict],
+                      callback: Callable[[dict, Optional[bytes], Optional[Exception]], None],
+                      batch_size: Optional[int] = None):
+    """
+    Download attachments ([{"gmail_id", "attachment_id", ...}]) with batched
+    users.messages.attachments.get requests. callback(attachment, data, error)
+    gets each one's decoded bytes as soon as its batch returns, so the caller
+    decides how long they stay in memory.
+    """
+    def on_result(request_id, response, error):
+        attachment = attachments[int(request_id)]
+        callback(attachment, _b64_urlsafe_decode(response.get('data', '')) if error is None else None, error)
+
+    # Attachment ids are several hundred characters long; batch parts are keyed by position instead
+    requests = {str(i): (lambda attachment=attachment: service.users().messages().attachments().get(
+                    userId='me', messageId=attachment['gmail_id'], id=attachment['attachment_id']))
+                for i, attachment in enumerate(attachments)}
+    _execute_batches(service, requests, on_result, batch_size, 'fetch_attachments')
+
+
 def _b64_urlsafe_decode(data: str) -> bytes:
     """Decode Gmail's base64url string (handles missing padding)."""
     if not data:
         return b''
-    data = data.replace('-', '+').replace('_', '/')
-    # Add padding if necessary
-    padding = len(data) % 4
-    if padding:
-        data += '=' * (4 - padding)
-    return base64.b64decode(data)
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
 
 
 def extract_headers(headers: List[dict]) -> dict:
@@ -53,131 +207,161 @@ def extract_headers(headers: List[dict]) -> dict:
     return out
 
 
-def walk_parts_and_collect_text(parts: List[dict]) -> Tuple[str, str]:
+_CHARSET_RE = re.compile(r'charset\s*=\s*["\']?([^"\';\s]+)', re.I)
+
+
+def _part_charset(part: dict) -> str:
+    """The charset declared in a part's Content-Type header (utf-8 if none)."""
+    for header in part.get('headers', []) or []:
+        if header.get('name', '').lower() == 'content-type':
+            match = _CHARSET_RE.search(header.get('value', ''))
+            if match:
+                return match.group(1).lower()
+    return 'utf-8'
+
+
+def _decode_part(part: dict) -> str:
+    raw_bytes = _b64_urlsafe_decode(part['body']['data'])
+    try:
+        return raw_bytes.decode(_part_charset(part))
+    except (LookupError, UnicodeDecodeError):
+        # Unknown or wrong charset label: try utf-8, then latin-1 (never fails)
+        try:
+            return raw_bytes.decode('utf-8')
+        except UnicodeDecodeError:
+            return raw_bytes.decode('latin-1', errors='replace')
+
+
+def _collect_text_parts(parts: List[dict]) -> Tuple[List[dict], List[dict]]:
     """
-    Walk message parts recursively to collect text/plain and text/html contents.
-    Returns (plain_text, html_text) where each is the concatenation of found parts.
+    Find the inline text/plain and text/html parts without decoding anything.
+    Attachments and non-text parts are skipped by their headers alone, so
+    their (possibly large) base64 data is never touched.
     """
-    plain_chunks = []
-    html_chunks = []
-
-    def walk(p):
+    plain_parts = []
+    html_parts = []
+    stack = list(reversed(parts or []))
+    while stack:
+        p = stack.pop()
+        children = p.get('parts')
+        if children:
+            stack.extend(reversed(children))
+            continue
         mime = p.get('mimeType', '')
-        body = p.get('body', {})
-        data = body.get('data')
-        if data:
-            try:
-                raw_bytes = _b64_urlsafe_decode(data)
-                try:
-                    text = raw_bytes.decode('utf-8')
-                except UnicodeDecodeError:
-                    # fallback to latin-1 if weird encoding
-                    text = raw_bytes.decode('latin-1', errors='replace')
-            except Exception:
-                text = ''
-            if mime == 'text/plain':
-                plain_chunks.append(text)
-            elif mime == 'text/html':
-                html_chunks.append(text)
-            else:
-                # some multipart types may contain nested parts; ignore binary attachments
-                pass
-        # Recurse into nested parts
-        for child in p.get('parts', []) or []:
-            walk(child)
+        if p.get('filename') or not p.get('body', {}).get('data'):
+            continue
+        if mime == 'text/plain':
+            plain_parts.append(p)
+        elif mime == 'text/html':
+            html_parts.append(p)
+    return plain_parts, html_parts
 
-    for part in parts or []:
-        walk(part)
 
-    return ('\n'.join(plain_chunks).strip(), '\n'.join(html_chunks).strip())
+def walk_parts_and_collect_text(parts: List[dict]) -> Tuple[str, str]:
+    """
+    Walk message parts recursively to collect text/plain and text/html contents.
+    Returns (plain_text, html_text) where each is the concatenation of found parts.
+    """
+    plain_parts, html_parts = _collect_text_parts(parts)
+    return ('\n'.join(map(_decode_part, plain_parts)).strip(), '\n'.join(map(_decode_part, html_parts)).strip())
 
 
 def get_message_body(message: dict) -> str:
     """Return message body as plain text if possible, or HTML if only HTML available, or the snippet."""
     payload = message.get('payload', {})
-    mime_type = payload.get('mimeType', '')
-    # If top-level body has data (rare for simple messages)
-    top_body_data = payload.get('body', {}).get('data')
-    if top_body_data:
-        decoded = _b64_urlsafe_decode(top_body_data)
-        try:
-            return decoded.decode('utf-8', errors='replace')
-        except Exception:
-            return decoded.decode('latin-1', errors='replace')
-
-    # Otherwise check parts recursively
-    plain, html = walk_parts_and_collect_text(payload.get('parts', []))
-    if plain:
-        return plain
-    if html:
-        # Optionally strip HTML tags to make it more readable. Here we do a crude strip.
-        text = _strip_html_tags(html)
-        return text
+    # The payload is itself a part: simple messages carry their text at the top level
+    plain_parts, html_parts = _collect_text_parts([payload])
+    if plain_parts:
+        return '\n'.join(map(_decode_part, plain_parts)).strip()
+    if html_parts:
+        # HTML is only decoded when there is no plain-text alternative
+        return _strip_html_tags('\n'.join(map(_decode_part, html_parts)))
     # As a final fallback, return the snippet
-    return message.get('snippet', '')
+    return unescape(message.get('snippet', ''))
+
+
+_SKIPPED_HTML_RE = re.compile(r'(?is)<(?:script|style)\b.*?</(?:script|style)\s*>|<!--.*?-->')
+_LINE_BREAK_TAG_RE = re.compile(r'(?i)<(?:br|/(?:p|div|li|tr|h[1-6]|blockquote|table))\b[^>]*>[ \t]*\n?')
+_TAG_RE = re.compile(r'<[^>]*>')
+_SPACES_RE = re.compile(r'[ \t]{2,}|\t')
+_BLANK_LINES_RE = re.compile(r'\n\s*\n+')
 
 
 def _strip_html_tags(html: str) -> str:
     """Basic HTML -> text. Not perfect, but good enough for terminal display."""
-    # Unescape HTML entities first
-    text = unescape(html)
-    # Remove script/style blocks
-    text = re.sub(r'(?is)<(script|style).*?>.*?</\1>', '', text)
-    # Replace <br> and <p> with newlines
-    text = re.sub(r'(?i)<\s*(br|br/|br\s*/)\s*>', '\n', text)
-    text = re.sub(r'(?i)</p\s*>', '\n', text)
-    # Remove remaining tags
-    text = re.sub(r'<[^>]+>', '', text)
-    # Collapse multiple newlines/spaces
-    text = re.sub(r'\n\s*\n+', '\n\n', text)
-    text = re.sub(r'[ \t]+', ' ', text)
-    return text.strip()
+    # Drop script/style blocks and comments, turn line-ending tags into newlines, drop the rest.
+    # These stay separate passes: folding them into one alternation needs a Python
+    # callback per match to pick '' or '\n', which measured ~65% slower than
+    # letting each compiled pattern substitute a constant.
+    text = _SKIPPED_HTML_RE.sub('', html)
+    text = _LINE_BREAK_TAG_RE.sub('\n', text)
+    text = _TAG_RE.sub('', text)
+    text = _SPACES_RE.sub(' ', text)
+    text = _BLANK_LINES_RE.sub('\n\n', text)
+    # Unescape last so escaped markup like &lt;b&gt; survives as text
+    return unescape(text).strip()
 
 
 def get_metadata(message: dict):
     headers_list = message.get('payload', {}).get('headers', [])
     return extract_headers(headers_list)
-    
-    
 
 
-def email_client_runner(oauth, sender, start_date):
-    try:
-        creds = Credentials(**oauth)
-    except Exception as e:
-        print("Authentication failed:", str(e))
-        return
-
-    service = build_gmail_service(creds)
-    message_list = get_messages(service, sender, start_date, max_results = 5)
-    if message_list != None:
-        if len(message_list) == 0:
-            print("No messages found in INBOX.")
-            return
-    else:
-        print("No messages found in Inbox")
-        return
-
-    i = 0
-    response_dict = {"emails": []}
-    try:
-        for message in message_list:
-            message_data = get_message(service, message['id'])
-            print(f"MESSAGE {i}:\n{message}")
-            headers = get_metadata(message_data)
-            response_dict["emails"].append({
-                "gmail_id" : message['id'],
-                "subject" : headers.get('subject', '(no subject)'),
-                "sender" : headers.get('from', '(unknown sender)'),
-                "to": headers.get('to', '(unknown recipient)'),
-                "date": headers.get('date', '(no date)'),
-                "body_text" : get_message_body(message_data).strip()
+def get_attachments(message: dict) -> List[dict]:
+    """Describe a full message's attachments without downloading them."""
+    attachments = []
+
+    def walk(p):
+        body = p.get('body', {})
+        if p.get('filename') and body.get('attachmentId'):
+            attachments.append({
+                "attachment_id": body['attachmentId'],
+                "filename": p['filename'],
+                "mime_type": p.get('mimeType', 'application/octet-stream'),
+                "size": body.get('size', 0),
             })
-            i += 1
-    except Exception as e:
-        print("Failed to fetch the message:", str(e))
-        return
-    print(response_dict["emails"])
-    print(f"SZ EMAIL: {len(message_list)}")
-    return response_dict
+        for child in p.get('parts', []) or []:
+            walk(child)
+
+    walk(message.get('payload', {}))
+    return attachments
+
+
+def parse_message(message_data: dict, include_body: bool = True) -> dict:
+    """
+    The fields the app keeps for a message. With include_body=False the
+    message only needs format='metadata' and the body is left out (the
+    snippet is kept for previews); otherwise it must be format='full'.
+    """
+    headers = get_metadata(message_data)
+    internal_date = message_data.get('internalDate')
+    email = {
+        "gmail_id" : message_data['id'],
+        "thread_id": message_data.get('threadId'),
+        "label_ids": message_data.get('labelIds', []),
+        "history_id": message_data.get('historyId'),
+        "internal_date": datetime.fromtimestamp(int(internal_date) / 1000, timezone.utc) if internal_date else None,
+        "subject" : headers.get('subject', '(no subject)'),
+        "sender" : headers.get('from', '(unknown sender)'),
+        "to": headers.get('to', '(unknown recipient)'),
+        "date": headers.get('date', '(no date)'),
+        "message_id": headers.get('message-id', '').strip() or None,
+        "in_reply_to": headers.get('in-reply-to', '').strip() or None,
+        "references": headers.get('references', '').split(),
+        "snippet": unescape(message_data.get('snippet', '')),
+    }
+    if include_body:
+        email["body_text"] = get_message_body(message_data).strip()
+        email["attachments"] = get_attachments(message_data)
+    return email
+
+
+def fetch_message_metadata(service, msg_ids: List[str], callback=None, batch_size: Optional[int] = None) -> Dict[str, dict]:
+    """fetch_messages with format='metadata' and only METADATA_HEADERS: no bodies, no attachments."""
+    return fetch_messages(service, msg_ids, format='metadata', callback=callback, batch_size=batch_size,
+                          metadataHeaders=METADATA_HEADERS)
+
 
+def get_message_detail(service, msg_id: str) -> dict:
+    """Fetch and parse one message's body on demand. Attachments are listed, not downloaded."""
+    return parse_message(get_message(service, msg_id))
@@ -0,0 +1,159 @@
+import os
+from datetime import datetime, timezone
+from typing import Optional
+
+from google.oauth2.credentials import Credentials
+from googleapiclient.errors import HttpError
+
+from email_handler.email_client import (build_gmail_service, fetch_messages, fetch_message_metadata, parse_message,
+                                        list_message_ids)
+from util.db import (get_email_sync_state, save_email_sync_state, upsert_emails, update_email_labels, delete_emails,
+                     get_stale_email_ids, get_stored_email_ids, get_stored_emails)
+from util.search_index import index_documents, remove_documents, email_entry
+
+# Incremental mailbox sync. Each lawyer's INBOX is mirrored into the Mongo
+# "emails" collection together with the Gmail historyId it is current to.
+# Later syncs ask users.history.list for what changed since that id, so only
+# new messages are downloaded; a full resync happens on first use or when
+# Gmail no longer has the stored history (it answers 404).
+
+EMAIL_SYNC_LABEL = os.getenv("EMAIL_SYNC_LABEL", "INBOX")
+# Newest messages mirrored by a full resync
+EMAIL_FULL_SYNC_MAX_MESSAGES = int(os.getenv("EMAIL_FULL_SYNC_MAX_MESSAGES", 500))
+# Requests within this many seconds of the last sync are served from the store as is
+EMAIL_SYNC_MIN_INTERVAL_SECONDS = int(os.getenv("EMAIL_SYNC_MIN_INTERVAL_SECONDS", 30))
+
+
+def _list_history(service, start_history_id: str, label: str) -> tuple:
+    """
+    Page through users.history.list from start_history_id.
+
+    Returns (added_ids, label_changed_ids, deleted_ids, latest_history_id).
+    Raises HttpError 404 when start_history_id is too old.
+    """
+    added, changed, deleted = set(), set(), set()
+    history_id = start_history_id
+    page_token = None
+    while True:
+        response = service.users().history().list(
+            userId='me', startHistoryId=start_history_id, labelId=label, pageToken=page_token,
+            historyTypes=['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved'],
+        ).execute()
+        for record in response.get('history', []):
+            for item in record.get('messagesAdded', []):
+                added.add(item['message']['id'])
+            for item in record.get('messagesDeleted', []):
+                deleted.add(item['message']['id'])
+            for key in ('labelsAdded', 'labelsRemoved'):
+                for item in record.get(key, []):
+                    changed.add(item['message']['id'])
+        history_id = response.get('historyId', history_id)
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            break
+    return added - deleted, changed - added - deleted, deleted, history_id
+
+
+def _download(service, user_id: str, msg_ids) -> int:
+    # Headers only; bodies are fetched when a message is opened
+    emails = []
+
+    def on_message(msg_id, message, error):
+        if error is None:
+            emails.append(parse_message(message, include_body=False))
+
+    fetch_message_metadata(service, list(msg_ids), callback=on_message)
+    upsert_emails(user_id, emails)
+    index_documents(email_entry(user_id, email) for email in emails)
+    return len(emails)
+
+
+def full_sync(service, user_id: str, label: str = EMAIL_SYNC_LABEL) -> dict:
+    """Mirror the newest EMAIL_FULL_SYNC_MAX_MESSAGES messages, downloading only ones not yet stored."""
+    # Read the history id first so changes made while listing are picked up next time
+    history_id = service.users().getProfile(userId='me').execute()['historyId']
+    ids, _ = list_message_ids(service, '', [label], EMAIL_FULL_SYNC_MAX_MESSAGES)
+    stored = get_stored_email_ids(user_id, ids)
+    missing = [msg_id for msg_id in ids if msg_id not in stored]
+    downloaded = _download(service, user_id, missing)
+    # Only messages mirrored from this label; search_mailbox stores others alongside them
+    stale = get_stale_email_ids(user_id, label, ids)
+    removed = delete_emails(user_id, stale)
+    remove_documents(user_id, "email", stale)
+    save_email_sync_state(user_id, history_id, full=True)
+    print(f"Full email sync: {len(ids)} messages listed, {downloaded} downloaded, {removed} removed")
+    return {"mode": "full", "listed": len(ids), "downloaded": downloaded, "removed": removed}
+
+
+def incremental_sync(service, user_id: str, history_id: str, label: str = EMAIL_SYNC_LABEL) -> dict:
+    """Apply what changed since history_id. Raises HttpError 404 if the id has expired."""
+    added, changed, deleted, latest_history_id = _list_history(service, history_id, label)
+
+    # Label changes only need labelIds, unless the message is new to the store
+    stored = get_stored_email_ids(user_id, list(changed))
+    added |= changed - stored
+    labels = {}
+    if stored:
+        minimal = fetch_messages(service, list(stored), format='minimal')
+        labels = {msg_id: message.get('labelIds', []) for msg_id, message in minimal.items()}
+        update_email_labels(user_id, labels)
+
+    downloaded = _download(service, user_id, added) if added else 0
+    removed = delete_emails(user_id, list(deleted)) if deleted else 0
+    remove_documents(user_id, "email", list(deleted))
+    save_email_sync_state(user_id, latest_history_id)
+    return {"mode": "incremental", "downloaded": downloaded, "relabeled": len(labels), "removed": removed}
+
+
+def _seconds_since(moment: Optional[datetime]) -> float:
+    if moment is None:
+        return float('inf')
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - moment).total_seconds()
+
+
+def sync_mailbox(oauth: dict, user_id: str, force_full: bool = False) -> Optional[dict]:
+    """
+    Bring the lawyer's stored mailbox up to date.
+
+    Returns {"mode": "skipped" | "incremental" | "full", ...counts}, or None if
+    the sync failed (the store is left as it was).
+    """
+    state = get_email_sync_state(user_id)
+    history_id = state.get("history_id") if state else None
+    if history_id and not force_full and _seconds_since(state.get("synced_at")) < EMAIL_SYNC_MIN_INTERVAL_SECONDS:
+        return {"mode": "skipped"}
+
+    try:
+        service = build_gmail_service(Credentials(**oauth))
+        if history_id and not force_full:
+            try:
+                return incremental_sync(service, user_id, history_id)
+            except HttpError as e:
+                if e.resp is None or int(e.resp.status) != 404:
+                    raise
+                print(f"History id {history_id} expired, resyncing mailbox")
+        return full_sync(service, user_id)
+    except Exception as e:
+        print("sync_mailbox")
+        print(e)
+        return None
+
+
+def search_mailbox(service, user_id: str, query: str = '', label: Optional[str] = None, limit: int = 20,
+                   page_token: Optional[str] = None) -> tuple:
+    """
+    Run a Gmail search and return (emails, next_page_token). Messages already
+    in the store are served from it; the rest are fetched as metadata and stored.
+    """
+    ids, next_page_token = list_message_ids(service, query, [label] if label else None, limit, page_token)
+    emails = get_stored_emails(user_id, ids)
+    missing = [msg_id for msg_id in ids if msg_id not in emails]
+    if missing:
+        fetched = [parse_message(message, include_body=False)
+                   for message in fetch_message_metadata(service, missing).values()]
+        upsert_emails(user_id, fetched)
+        index_documents(email_entry(user_id, email) for email in fetched)
+        emails.update((email["gmail_id"], email) for email in fetched)
+    return [emails[msg_id] for msg_id in ids if msg_id in emails], next_page_token
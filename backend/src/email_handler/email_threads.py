@@ -0,0 +1,191 @@
+import re
+import hashlib
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from bson.objectid import ObjectId
+
+from email_handler.email_client import parse_message
+from util.db import add_case_items, get_case_email_message_ids, store_email_bodies, get_email_bodies
+from util.search_index import index_documents, email_entry
+
+# Conversation view and case attachment for email threads. Messages are
+# grouped by Gmail threadId, and threads that Gmail split (e.g. after a
+# subject change) are joined again through In-Reply-To / References.
+# Quoted replies are cut from each body before it is stored, and bodies are
+# kept once per content hash, so attaching a long thread to several cases
+# stores each message's new text a single time.
+
+
+def _date_key(moment: Optional[datetime]) -> datetime:
+    # Messages without a date sort first. Stored messages come back from Mongo
+    # as naive UTC and freshly parsed ones as aware, so compare both as naive UTC.
+    if moment is None:
+        return datetime.min
+    return moment.astimezone(timezone.utc).replace(tzinfo=None) if moment.tzinfo else moment
+
+
+# Lines that start the quoted part of a reply. Forwarded messages are kept:
+# their content usually isn't stored anywhere else.
+_WROTE_RE = re.compile(r'^On\b.{0,200}\bwrote:\s*$')
+_ORIGINAL_MESSAGE_RE = re.compile(r'^(?:-{2,}\s*Original Message\s*-{2,}|_{10,}\s*$)', re.I)
+_OUTLOOK_FROM_RE = re.compile(r'^From:\s.+', re.I)
+
+
+def _starts_quote(lines: List[str], i: int, kept: List[str]) -> bool:
+    line = lines[i].strip()
+    if _WROTE_RE.match(line) or _ORIGINAL_MESSAGE_RE.match(line):
+        return True
+    # Clients often wrap "On <date>, <name> <address> wrote:" over two lines
+    if line.startswith('On ') and i + 1 < len(lines) and _WROTE_RE.match(f"{line} {lines[i + 1].strip()}"):
+        return True
+    # Outlook quotes with a header block; only trust "From:" after some text and a blank line
+    return bool(_OUTLOOK_FROM_RE.match(line)) and len(kept) > 1 and not kept[-1].strip()
+
+
+def strip_quoted_reply(text: str) -> str:
+    """
+    Return only the new text of a reply: everything before the first
+    "On ... wrote:" / "Original Message" style marker, minus "> " quoted lines.
+    """
+    lines = text.splitlines()
+    kept = []
+    for i, line in enumerate(lines):
+        if _starts_quote(lines, i, kept):
+            break
+        if not line.lstrip().startswith('>'):
+            kept.append(line)
+    return '\n'.join(kept).strip()
+
+
+def body_hash(text: str) -> str:
+    """Hash of a body with whitespace normalized, so re-wrapped copies match."""
+    return hashlib.sha256(' '.join(text.split()).encode('utf-8')).hexdigest()
+
+
+def assemble_threads(emails: List[dict]) -> List[dict]:
+    """
+    Group parsed messages into conversations, newest conversation first.
+
+    Messages sharing a thread_id are one conversation; conversations are also
+    merged when a message's In-Reply-To / References name a message in another.
+    Returns [{"thread_id", "thread_ids", "subject", "participants",
+    "message_count", "last_date", "messages"}] with messages oldest first.
+    """
+    parent = {}
+
+    def find(key):
+        root = key
+        while parent.setdefault(root, root) != root:
+            root = parent[root]
+        while parent[key] != root:
+            parent[key], key = root, parent[key]
+        return root
+
+    def union(a, b):
+        parent[find(a)] = find(b)
+
+    thread_of_message = {email["message_id"]: email.get("thread_id") or email["gmail_id"]
+                         for email in emails if email.get("message_id")}
+    for email in emails:
+        thread_id = email.get("thread_id") or email["gmail_id"]
+        find(thread_id)
+        for reference in email.get("references", []) + [email.get("in_reply_to")]:
+            if reference in thread_of_message:
+                union(thread_id, thread_of_message[reference])
+
+    groups = {}
+    for email in emails:
+        groups.setdefault(find(email.get("thread_id") or email["gmail_id"]), []).append(email)
+
+    threads = []
+    for messages in groups.values():
+        messages.sort(key=lambda email: _date_key(email.get("internal_date")))
+        participants = list(dict.fromkeys(email.get("sender") for email in messages if email.get("sender")))
+        threads.append({
+            "thread_id": messages[0].get("thread_id") or messages[0]["gmail_id"],
+            "thread_ids": list(dict.fromkeys(email.get("thread_id") for email in messages if email.get("thread_id"))),
+            "subject": messages[0].get("subject"),
+            "participants": participants,
+            "message_count": len(messages),
+            "last_date": messages[-1].get("internal_date"),
+            "messages": messages,
+        })
+    threads.sort(key=lambda thread: _date_key(thread["last_date"]), reverse=True)
+    return threads
+
+
+def fetch_thread(service, thread_id: str) -> List[dict]:
+    """Every message of a Gmail thread, parsed with its body, in one request."""
+    thread = service.users().threads().get(userId='me', id=thread_id, format='full').execute()
+    return [parse_message(message) for message in thread.get('messages', [])]
+
+
+def attach_thread_to_case(service, user_id: str, case_id: str, thread_id: str) -> Optional[dict]:
+    """
+    Attach a thread's messages to a case's emails, skipping ones already
+    attached (by Message-ID). Only the new text of each reply is stored, once
+    per distinct body. Returns counts, or None on failure.
+    """
+    try:
+        messages = fetch_thread(service, thread_id)
+    except Exception as e:
+        print("attach_thread_to_case")
+        print(e)
+        return None
+
+    # Messages without a Message-ID header fall back to their Gmail id
+    for message in messages:
+        message["message_id"] = message.get("message_id") or f"gmail:{message['gmail_id']}"
+    attached = get_case_email_message_ids(case_id, [message["message_id"] for message in messages])
+    new_messages = [message for message in messages if message["message_id"] not in attached]
+
+    entries = []
+    bodies = {}
+    raw_bytes = 0
+    for message in new_messages:
+        raw_text = message.pop("body_text")
+        text = strip_quoted_reply(raw_text)
+        digest = body_hash(text)
+        bodies[digest] = text
+        raw_bytes += len(raw_text.encode('utf-8'))
+        entries.append({
+            "_id": ObjectId(),
+            "gmail_id": message["gmail_id"],
+            "thread_id": message["thread_id"],
+            "message_id": message["message_id"],
+            "in_reply_to": message["in_reply_to"],
+            "subject": message["subject"],
+            "sender": message["sender"],
+            "to": message["to"],
+            "date": message["date"],
+            "internal_date": message["internal_date"],
+            "attachments": message["attachments"],
+            "body_hash": digest,
+        })
+
+    new_bodies = store_email_bodies(bodies)
+    # A concurrent attach of the same thread can still hit the unique (case_id, message_id) index
+    ids = set(add_case_items(user_id, case_id, "emails", entries))
+    index_documents(email_entry(user_id, entry, case_id, entry["_id"], bodies[entry["body_hash"]])
+                    for entry in entries if entry["_id"] in ids)
+    stored_bytes = sum(len(bodies[digest].encode('utf-8')) for digest in new_bodies)
+    print(f"Attached {len(ids)} of {len(messages)} messages from thread {thread_id} to case {case_id}")
+    return {
+        "thread_id": thread_id,
+        "messages": len(messages),
+        "attached": len(ids),
+        "already_attached": len(messages) - len(new_messages),
+        "new_bodies": len(new_bodies),
+        "raw_bytes": raw_bytes,
+        "stored_bytes": stored_bytes,
+    }
+
+
+def with_email_bodies(entries: List[dict]) -> List[dict]:
+    """Fill in body_text for case email entries stored by body_hash."""
+    texts = get_email_bodies([entry["body_hash"] for entry in entries if entry.get("body_hash")])
+    for entry in entries:
+        if entry.get("body_hash") in texts:
+            entry["body_text"] = texts[entry["body_hash"]]
+    return entries
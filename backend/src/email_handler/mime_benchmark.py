@@ -0,0 +1,146 @@
+"""
+Measure body extraction throughput on Gmail message payloads.
+
+Point it at a folder of recorded users.messages.get(format='full') responses
+saved as <name>.json, or run it without arguments to use a synthetic corpus
+(plain+HTML newsletters with inline images, HTML-only mail, short replies).
+It reports messages/sec and MB/sec for the current extractor and for the
+previous one, kept here as the baseline. Run from the backend/src directory:
+
+    python -m email_handler.mime_benchmark [path/to/payloads] [rounds]
+"""
+import base64
+import json
+import os
+import re
+import sys
+import time
+from html import unescape
+
+from email_handler.email_client import get_message_body
+
+
+def _legacy_b64_urlsafe_decode(data: str) -> bytes:
+    if not data:
+        return b''
+    data = data.replace('-', '+').replace('_', '/')
+    padding = len(data) % 4
+    if padding:
+        data += '=' * (4 - padding)
+    return base64.b64decode(data)
+
+
+def _legacy_strip_html_tags(html: str) -> str:
+    text = unescape(html)
+    text = re.sub(r'(?is)<(script|style).*?>.*?</\1>', '', text)
+    text = re.sub(r'(?i)<\s*(br|br/|br\s*/)\s*>', '\n', text)
+    text = re.sub(r'(?i)</p\s*>', '\n', text)
+    text = re.sub(r'<[^>]+>', '', text)
+    text = re.sub(r'\n\s*\n+', '\n\n', text)
+    text = re.sub(r'[ \t]+', ' ', text)
+    return text.strip()
+
+
+def legacy_message_body(message: dict) -> str:
+    """The extractor before it skipped non-text parts (decodes every part)."""
+    payload = message.get('payload', {})
+    top_body_data = payload.get('body', {}).get('data')
+    if top_body_data:
+        return _legacy_b64_urlsafe_decode(top_body_data).decode('utf-8', errors='replace')
+    plain_chunks, html_chunks = [], []
+
+    def walk(p):
+        data = p.get('body', {}).get('data')
+        if data:
+            raw_bytes = _legacy_b64_urlsafe_decode(data)
+            try:
+                text = raw_bytes.decode('utf-8')
+            except UnicodeDecodeError:
+                text = raw_bytes.decode('latin-1', errors='replace')
+            if p.get('mimeType') == 'text/plain':
+                plain_chunks.append(text)
+            elif p.get('mimeType') == 'text/html':
+                html_chunks.append(text)
+        for child in p.get('parts', []) or []:
+            walk(child)
+
+    for part in payload.get('parts', []) or []:
+        walk(part)
+    plain, html = '\n'.join(plain_chunks).strip(), '\n'.join(html_chunks).strip()
+    if plain:
+        return plain
+    if html:
+        return _legacy_strip_html_tags(html)
+    return message.get('snippet', '')
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def _part(mime: str, data: bytes, filename: str = '', charset: str = 'utf-8') -> dict:
+    headers = [{"name": "Content-Type", "value": f"{mime}; charset={charset}" if mime.startswith('text/') else mime}]
+    return {"mimeType": mime, "filename": filename, "headers": headers, "body": {"size": len(data), "data": _b64(data)}}
+
+
+def synthetic_corpus() -> list:
+    row = ('<tr><td style="padding:4px;font-family:Arial"><a href="https://example.com/a?b=1">Docket &amp; '
+           'filings</a> updated for <b>Case 24-118</b>&nbsp;today</td></tr>\n')
+    html = ('<html><head><style>td{color:#333}</style></head><body><table>' + row * 400
+            + '</table><p>Unsubscribe</p></body></html>').encode('utf-8')
+    plain = ('Docket & filings updated for Case 24-118 today\n' * 400).encode('utf-8')
+    image = os.urandom(300 * 1024)
+    newsletter = {"id": "newsletter", "snippet": "Docket updates", "payload": {
+        "mimeType": "multipart/related", "parts": [
+            {"mimeType": "multipart/alternative", "parts": [_part('text/plain', plain), _part('text/html', html)]},
+            _part('image/png', image, 'logo.png'),
+        ]}}
+    html_only = {"id": "html-only", "snippet": "Docket updates", "payload": {
+        "mimeType": "multipart/mixed", "parts": [_part('text/html', html), _part('application/pdf', image, 'exhibit.pdf')]}}
+    reply = ('Thanks, I will review the exhibit before Thursday.\n\n> On Mon, counsel wrote:\n> '
+             + 'Please see the attached. ' * 20).encode('latin-1')
+    short_reply = {"id": "reply", "snippet": "Thanks", "payload": _part('text/plain', reply, charset='iso-8859-1')}
+    return [newsletter, html_only, short_reply]
+
+
+def load_corpus(folder: str) -> list:
+    corpus = []
+    for name in sorted(os.listdir(folder)):
+        if name.endswith('.json'):
+            with open(os.path.join(folder, name), 'r', encoding='utf-8') as f:
+                corpus.append(json.load(f))
+    return corpus
+
+
+def run(extract, corpus: list, rounds: int) -> dict:
+    payload_bytes = sum(len(json.dumps(message)) for message in corpus) * rounds
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for message in corpus:
+            extract(message)
+    elapsed = time.perf_counter() - start
+    messages = len(corpus) * rounds
+    return {
+        "messages": messages,
+        "seconds": round(elapsed, 3),
+        "messages_per_second": round(messages / elapsed, 1) if elapsed else 0.0,
+        "mb_per_second": round(payload_bytes / elapsed / (1024 * 1024), 1) if elapsed else 0.0,
+    }
+
+
+def main(argv):
+    corpus = load_corpus(argv[0]) if argv else synthetic_corpus()
+    if not corpus:
+        print("No <name>.json payloads found")
+        return 1
+    rounds = int(argv[1]) if len(argv) > 1 else 50
+    print(f"{'extractor':<10} {'messages':>9} {'seconds':>9} {'msgs/s':>9} {'MB/s':>7}")
+    for name, extract in (("before", legacy_message_body), ("after", get_message_body)):
+        result = run(extract, corpus, rounds)
+        print(f"{name:<10} {result['messages']:>9} {result['seconds']:>9} "
+              f"{result['messages_per_second']:>9} {result['mb_per_second']:>7}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
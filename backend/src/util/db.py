@@ -1,31 +1,214 @@
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
+from pymongo import monitoring, IndexModel, ReplaceOne, UpdateOne, ReturnDocument, ASCENDING, DESCENDING
+from pymongo.errors import DuplicateKeyError, BulkWriteError
 from dotenv import load_dotenv
 import os
+import re
+import threading
+from datetime import datetime, timezone
 from bson.objectid import ObjectId
+from cachetools import TTLCache
 
 
 database_name = "db"
 
+# One MongoClient per process. MongoClient is thread-safe and keeps its own
+# connection pool, so every data-access helper below shares it instead of
+# connecting, pinging and closing on each call.
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
 
-def get_mongo_client():
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Counts connection pool activity so it can be reported by get_pool_stats()."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checked_out = 0
+            self.checkouts = 0
+            self.checkout_failures = 0
+            self.connections_created = 0
+            self.connections_closed = 0
+            self.total_wait_ms = 0.0
+            self.max_wait_ms = 0.0
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "checked_out": self.checked_out,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "connections_created": self.connections_created,
+                "connections_closed": self.connections_closed,
+                "total_wait_ms": round(self.total_wait_ms, 3),
+                "avg_wait_ms": round(self.total_wait_ms / self.checkouts, 3) if self.checkouts else 0.0,
+                "max_wait_ms": round(self.max_wait_ms, 3),
+            }
+
+    def connection_checked_out(self, event):
+        # event.duration is the time spent waiting for the pool, in seconds
+        wait_ms = (getattr(event, "duration", 0.0) or 0.0) * 1000
+        with self._lock:
+            self.checked_out += 1
+            self.checkouts += 1
+            self.total_wait_ms += wait_ms
+            self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out = max(self.checked_out - 1, 0)
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures += 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self.connections_created += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.connections_closed += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+
+pool_stats = PoolStatsListener()
+
+
+def _int_env(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _create_mongo_client():
     load_dotenv()
 
     uri = os.getenv("MONGO_CONNNECTION_STRING")
-    print(uri)
 
-    # Create a new client and connect to the server
-    client = MongoClient(uri, server_api=ServerApi('1'))
+    # Pool size, timeouts and heartbeat are all tunable from the environment
+    client = MongoClient(
+        uri,
+        server_api=ServerApi('1'),
+        maxPoolSize=_int_env("MONGO_MAX_POOL_SIZE", 50),
+        minPoolSize=_int_env("MONGO_MIN_POOL_SIZE", 0),
+        maxIdleTimeMS=_int_env("MONGO_MAX_IDLE_TIME_MS", 300000),
+        waitQueueTimeoutMS=_int_env("MONGO_WAIT_QUEUE_TIMEOUT_MS", 5000),
+        serverSelectionTimeoutMS=_int_env("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000),
+        connectTimeoutMS=_int_env("MONGO_CONNECT_TIMEOUT_MS", 10000),
+        socketTimeoutMS=_int_env("MONGO_SOCKET_TIMEOUT_MS", 30000),
+        heartbeatFrequencyMS=_int_env("MONGO_HEARTBEAT_FREQUENCY_MS", 10000),
+        event_listeners=[pool_stats],
+    )
 
-    # Send a ping to confirm a successful connection
+    # Send a ping to confirm a successful connection. A client that can't
+    # reach the server is closed here, or its monitor threads and pool would
+    # leak on every retry.
     try:
         client.admin.command('ping')
-        print("Pinged your deployment. You successfully connected to MongoDB!")
+    except Exception:
+        client.close()
+        raise
+    print("Pinged your deployment. You successfully connected to MongoDB!")
+    return client
+
+
+def get_mongo_client():
+    """
+    Return the process-wide MongoClient, creating it on first use.
+
+    The client is recreated after a fork so that child processes never reuse
+    sockets inherited from the parent. Returns None if the server cannot be
+    reached; the next call will try again.
+    """
+    global _client, _client_pid
+
+    client = _client
+    if client is not None and _client_pid == os.getpid():
         return client
+
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            return _client
+        try:
+            _client = _create_mongo_client()
+            _client_pid = os.getpid()
+            return _client
+        except Exception as e:
+            print(e)
+            _client = None
+            _client_pid = None
+            return None
+
+
+def close_mongo_client():
+    """Close the shared client (e.g. on shutdown)."""
+    global _client, _client_pid
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+
+
+def _reset_client_after_fork():
+    # Sockets inherited from the parent must not be used or closed in the child
+    global _client, _client_pid, _client_lock
+    _client = None
+    _client_pid = None
+    _client_lock = threading.Lock()
+    pool_stats.reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_client_after_fork)
+
+
+def check_mongo_health() -> bool:
+    """Ping the deployment through the shared pool."""
+    try:
+        client = get_mongo_client()
+        if client is None:
+            return False
+        client.admin.command('ping')
+        return True
     except Exception as e:
+        print("check_mongo_health")
         print(e)
-        return None
-    
+        return False
+
+
+def get_pool_stats() -> dict:
+    """Connection pool counters for the shared client."""
+    stats = pool_stats.snapshot()
+    stats["connected"] = _client is not None and _client_pid == os.getpid()
+    stats["pid"] = os.getpid()
+    return stats
+
 def get_lawyers_collection(client):
     try:
         database = client.get_database(database_name)
@@ -43,7 +226,206 @@ def get_cases_collection(client):
         print("get_cases_collection")
         print(e)
         return None
-    
+
+# A case's documents, history and emails live in their own collections,
+# keyed by case_id, rather than as arrays on the case document
+CASE_CHILD_COLLECTIONS = ("documents", "history", "emails")
+
+def get_case_child_collection(client, kind: str):
+    """The collection holding one kind of case child: case_documents, case_history or case_emails."""
+    if kind not in CASE_CHILD_COLLECTIONS:
+        raise ValueError(f"Unknown case collection: {kind}")
+    try:
+        database = client.get_database(database_name)
+        return database.get_collection(f"case_{kind}")
+    except Exception as e:
+        print("get_case_child_collection")
+        print(e)
+        return None
+
+def get_emails_collection(client):
+    try:
+        database = client.get_database(database_name)
+        return database.get_collection("emails")
+    except Exception as e:
+        print("get_emails_collection")
+        print(e)
+        return None
+
+def get_email_bodies_collection(client):
+    try:
+        database = client.get_database(database_name)
+        return database.get_collection("email_bodies")
+    except Exception as e:
+        print("get_email_bodies_collection")
+        print(e)
+        return None
+
+def get_email_sync_collection(client):
+    try:
+        database = client.get_database(database_name)
+        return database.get_collection("email_sync")
+    except Exception as e:
+        print("get_email_sync_collection")
+        print(e)
+        return None
+
+
+# Indexes each collection needs, keyed by collection name. ensure_indexes()
+# creates them at startup; create_indexes is a no-op for ones that exist.
+INDEXES = {
+    "lawyers": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+    ],
+    "cases": [
+        # Serves the user_id filter in get_cases, newest-first when sorted on _id
+        IndexModel([("user_id", ASCENDING), ("_id", DESCENDING)], name="user_id_id"),
+    ],
+    # Per-case child collections, listed newest first per case
+    "case_documents": [
+        IndexModel([("case_id", ASCENDING), ("_id", DESCENDING)], name="case_id_id"),
+        # Lets batch OCR skip files a case already holds
+        IndexModel([("case_id", ASCENDING), ("content_hash", ASCENDING)], name="case_id_content_hash"),
+    ],
+    # Synced Gmail messages, one per lawyer and message, listed newest first
+    "emails": [
+        IndexModel([("user_id", ASCENDING), ("gmail_id", ASCENDING)], name="user_id_gmail_id", unique=True),
+        IndexModel([("user_id", ASCENDING), ("internal_date", DESCENDING), ("gmail_id", DESCENDING)],
+                   name="user_id_internal_date_gmail_id"),
+    ],
+    "case_history": [
+        IndexModel([("case_id", ASCENDING), ("_id", DESCENDING)], name="case_id_id"),
+    ],
+    "case_emails": [
+        IndexModel([("case_id", ASCENDING), ("_id", DESCENDING)], name="case_id_id"),
+        # Each message is attached to a case at most once (entries added before
+        # threads were ingested have no message_id and are not constrained)
+        IndexModel([("case_id", ASCENDING), ("message_id", ASCENDING)], name="case_id_message_id", unique=True,
+                   partialFilterExpression={"message_id": {"$type": "string"}}),
+    ],
+}
+
+
+def ensure_indexes() -> dict:
+    """
+    Create every index in INDEXES. Safe to call repeatedly.
+
+    Returns the names of the indexes present per collection, or an error
+    string for collections where creation failed (e.g. duplicate emails
+    blocking the unique index).
+    """
+    result = {}
+    client = get_mongo_client()
+    if client is None:
+        return result
+    database = client.get_database(database_name)
+    for collection_name, indexes in INDEXES.items():
+        try:
+            database.get_collection(collection_name).create_indexes(indexes)
+            result[collection_name] = sorted(database.get_collection(collection_name).index_information())
+        except Exception as e:
+            print("ensure_indexes")
+            print(e)
+            result[collection_name] = str(e)
+    return result
+
+
+def _plan_stages(plan: dict) -> list:
+    """Flatten a winningPlan tree into its list of stage names."""
+    stages = []
+    if not isinstance(plan, dict):
+        return stages
+    if "stage" in plan:
+        stages.append(plan["stage"])
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages.extend(_plan_stages(plan[key]))
+    for child in plan.get("inputStages", []):
+        stages.extend(_plan_stages(child))
+    return stages
+
+
+def explain_queries(email: str = "explain@example.com", user_id=None) -> dict:
+    """
+    Run explain() for the query behind each data-access function.
+
+    Returns {function_name: {"collection", "filter", "stages", "collscan", "explain"}}
+    so a regression back to a collection scan is easy to assert on.
+    """
+    client = get_mongo_client()
+    if client is None:
+        return {}
+    user_id = ObjectId(user_id) if user_id is not None else ObjectId()
+    queries = {
+        "get_lawyer": (get_lawyers_collection(client), {"email": email}, None),
+        "get_cases": (get_cases_collection(client), {"user_id": user_id}, None),
+        "get_cases_page": (get_cases_collection(client), {"user_id": user_id, "_id": {"$lt": ObjectId()}}, [("_id", DESCENDING)]),
+        "find_emails": (get_emails_collection(client), {"user_id": user_id, "label_ids": "INBOX"},
+                        [("internal_date", DESCENDING), ("gmail_id", DESCENDING)]),
+    }
+    report = {}
+    for name, (collection, query, sort) in queries.items():
+        cursor = collection.find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = cursor.explain()
+        stages = _plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {}))
+        report[name] = {
+            "collection": collection.name,
+            "filter": {k: str(v) for k, v in query.items()},
+            "stages": stages,
+            "collscan": "COLLSCAN" in stages,
+            "explain": explain,
+        }
+    return report
+
+
+# Process-wide email -> lawyer cache so authenticated endpoints don't query
+# Mongo just to turn a session into a user id. Entries are invalidated when
+# the lawyer record changes in this process and expire after the TTL.
+_lawyer_cache = TTLCache(
+    maxsize=_int_env("LAWYER_CACHE_SIZE", 1024),
+    ttl=_int_env("LAWYER_CACHE_TTL_SECONDS", 300),
+)
+_lawyer_cache_lock = threading.Lock()
+_lawyer_cache_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+
+def _copy_lawyer(lawyer):
+    # Callers mutate what they get back (e.g. stringifying ids)
+    copy = dict(lawyer)
+    if isinstance(copy.get("cases"), list):
+        copy["cases"] = list(copy["cases"])
+    return copy
+
+
+def invalidate_lawyer(email: str = None, user_id=None):
+    """Drop a lawyer from the cache by email and/or _id."""
+    with _lawyer_cache_lock:
+        keys = set()
+        if email is not None:
+            keys.add(email)
+        if user_id is not None:
+            user_oid = ObjectId(user_id)
+            keys.update(k for k, v in _lawyer_cache.items() if v.get("_id") == user_oid)
+        for key in keys:
+            if _lawyer_cache.pop(key, None) is not None:
+                _lawyer_cache_stats["invalidations"] += 1
+
+
+def clear_lawyer_cache():
+    with _lawyer_cache_lock:
+        _lawyer_cache.clear()
+
+
+def get_lawyer_cache_stats() -> dict:
+    with _lawyer_cache_lock:
+        stats = dict(_lawyer_cache_stats)
+        stats["size"] = len(_lawyer_cache)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+    return stats
+
 
 def create_lawyer(email: str, name: str, picture: str):
     try:
@@ -55,67 +437,616 @@ def create_lawyer(email: str, name: str, picture: str):
             "picture": picture,
             "cases": []
         })
-        client.close()
+    except DuplicateKeyError:
+        # Another request created this lawyer first (email is uniquely indexed)
+        pass
     except Exception as e:
         print("create_lawyer")
         print(e)
+    finally:
+        invalidate_lawyer(email=email)
 
 
-def get_lawyer(email: str):
+def get_lawyer(email: str, use_cache: bool = True):
+    if use_cache:
+        with _lawyer_cache_lock:
+            lawyer = _lawyer_cache.get(email)
+            if lawyer is not None:
+                _lawyer_cache_stats["hits"] += 1
+                return _copy_lawyer(lawyer)
+            _lawyer_cache_stats["misses"] += 1
     try:
         client = get_mongo_client()
         collection = get_lawyers_collection(client)
         lawyer = collection.find_one({"email": email})
-        client.close()
+        # Misses are not cached: the lawyer may be created right after
+        if lawyer is not None:
+            with _lawyer_cache_lock:
+                _lawyer_cache[email] = lawyer
+            return _copy_lawyer(lawyer)
         return lawyer
     except Exception as e:
         print("get_lawyer")
         print(e)
         return None
-    
+
+
+def _supports_transactions(client) -> bool:
+    # Multi-document transactions need a replica set or sharded cluster
+    return client.topology_description.topology_type_name in ("ReplicaSetWithPrimary", "Sharded", "LoadBalanced")
+
+
 def create_case(user_id: str, case_name: str, case_summary: str, client_name: str, client_email: str):
+    """
+    Insert a case and push its id onto the owning lawyer in one transaction.
+
+    Returns the inserted case document (with its _id), or None on failure.
+    On a standalone server (no transactions) the two writes run back to back.
+    """
     try:
         client = get_mongo_client()
         cases_collection = get_cases_collection(client)
-        db_res = cases_collection.insert_one({
-            "user_id": user_id,
+        lawyers_collection = get_lawyers_collection(client)
+        user_oid = ObjectId(user_id)
+        case = {
+            "_id": ObjectId(),
+            "user_id": user_oid,
             "case_name": case_name,
             "case_summary": case_summary,
             "client_name": client_name,
             "client_email": client_email,
-            "documents": [],
-            "history": [],
-            "emails": []
-        })
-        lawyers_collection = get_lawyers_collection(client)
-        lawyer = lawyers_collection.find_one({"_id": ObjectId(user_id)})
-        if lawyer is not None:
-            lawyers_collection.update_one({"_id": lawyer['_id']}, {"$push": {"cases": db_res.inserted_id}})
-        client.close()
+        }
+
+        def write_case(session=None):
+            cases_collection.insert_one(case, session=session)
+            lawyers_collection.update_one({"_id": user_oid}, {"$push": {"cases": case["_id"]}}, session=session)
+
+        if _supports_transactions(client):
+            with client.start_session() as session:
+                session.with_transaction(write_case)
+        else:
+            write_case()
+        # The lawyer's cases list changed
+        invalidate_lawyer(user_id=user_oid)
+        return case
     except Exception as e:
         print("create_case")
         print(e)
+        return None
 
 def update_case_summary(case_id: str, case_summary: str):
+    # Imported here: util.search_index itself imports this module
+    from util.search_index import index_documents, case_entry
     try:
         client = get_mongo_client()
         collection = get_cases_collection(client)
-        case = collection.find_one({"_id": ObjectId(case_id)})
+        case = collection.find_one_and_update(
+            {"_id": ObjectId(case_id)}, {"$set": {"case_summary": case_summary}},
+            projection={"user_id": 1, "case_name": 1, "case_summary": 1, "client_name": 1},
+            return_document=ReturnDocument.AFTER)
         if case is not None:
-            collection.update_one({"_id": ObjectId(case_id)}, {"$set": {"case_summary": case_summary}})
-        client.close()
+            index_documents([case_entry(case["user_id"], case)])
     except Exception as e:
         print("update_case_summary")
         print(e)
 
-def get_cases(user_id: str):
+# Fields needed by list views. Cases created before the child collections
+# may still embed documents/history/emails arrays; never pull them for lists.
+CASE_SUMMARY_PROJECTION = {
+    "user_id": 1,
+    "case_name": 1,
+    "case_summary": 1,
+    "client_name": 1,
+    "client_email": 1,
+}
+
+MAX_CASES_PAGE_SIZE = 100
+
+
+def get_cases(user_id: str, projection: dict = None):
     try:
         client = get_mongo_client()
         collection = get_cases_collection(client)
-        cases = list(collection.find({"user_id": ObjectId(user_id)}))
-        client.close()
+        cases = list(collection.find({"user_id": ObjectId(user_id)}, projection))
         return cases
     except Exception as e:
         print("get_cases")
         print(e)
-        return None
\ No newline at end of file
+        return None
+
+
+def get_cases_page(user_id: str, limit: int = 20, after: str = None, projection: dict = CASE_SUMMARY_PROJECTION):
+    """
+    Return one page of a lawyer's cases, newest first, using keyset pagination.
+
+    `after` is the next_cursor returned by the previous page (the last case's
+    _id). Returns (cases, next_cursor); next_cursor is None on the last page.
+    """
+    try:
+        limit = max(1, min(int(limit), MAX_CASES_PAGE_SIZE))
+        query = {"user_id": ObjectId(user_id)}
+        if after:
+            query["_id"] = {"$lt": ObjectId(after)}
+        client = get_mongo_client()
+        collection = get_cases_collection(client)
+        # Fetch one extra document to know whether another page exists
+        cases = list(collection.find(query, projection).sort("_id", DESCENDING).limit(limit + 1))
+        next_cursor = None
+        if len(cases) > limit:
+            cases = cases[:limit]
+            next_cursor = str(cases[-1]["_id"])
+        return cases, next_cursor
+    except Exception as e:
+        print("get_cases_page")
+        print(e)
+        return None, None
+
+
+def iter_cases(user_id: str, projection: dict = CASE_SUMMARY_PROJECTION, batch_size: int = 100):
+    """
+    Iterate over a lawyer's cases newest first straight from the cursor, one
+    batch in memory at a time. Returns None if the database can't be reached,
+    so callers can fail before they start streaming.
+    """
+    client = get_mongo_client()
+    collection = get_cases_collection(client) if client is not None else None
+    if collection is None:
+        return None
+    cursor = collection.find({"user_id": ObjectId(user_id)}, projection).sort("_id", DESCENDING).batch_size(batch_size)
+    return _iter_cursor(cursor)
+
+
+def _iter_cursor(cursor):
+    try:
+        for doc in cursor:
+            yield doc
+    finally:
+        cursor.close()
+
+
+def get_case(user_id: str, case_id: str, projection: dict = None):
+    """Fetch a single case (all fields unless projected), scoped to its owner."""
+    try:
+        client = get_mongo_client()
+        collection = get_cases_collection(client)
+        return collection.find_one({"_id": ObjectId(case_id), "user_id": ObjectId(user_id)}, projection)
+    except Exception as e:
+        print("get_case")
+        print(e)
+        return None
+
+
+def add_case_items(user_id: str, case_id: str, kind: str, items: list) -> list:
+    """
+    Store entries for one of a case's child collections ("documents",
+    "history" or "emails") in a single unordered insert_many. Returns the ids
+    of the entries that were inserted, in order; entries rejected by a unique
+    index (e.g. an email already on the case) are left out. Items may carry
+    their own "_id" so callers can tell which of them were stored.
+    """
+    if not items:
+        return []
+    try:
+        client = get_mongo_client()
+        collection = get_case_child_collection(client, kind)
+        user_oid = ObjectId(user_id)
+        case_oid = ObjectId(case_id)
+        docs = []
+        for item in items:
+            doc = dict(item) if isinstance(item, dict) else {"value": item}
+            doc["case_id"] = case_oid
+            doc["user_id"] = user_oid
+            doc.setdefault("created_at", datetime.now(timezone.utc))
+            docs.append(doc)
+        try:
+            return collection.insert_many(docs, ordered=False).inserted_ids
+        except BulkWriteError as e:
+            # Unordered: everything but the failed entries was written (nInserted of them)
+            failed = {error["index"] for error in e.details.get("writeErrors", [])}
+            ids = [doc["_id"] for i, doc in enumerate(docs) if i not in failed]
+            print(f"add_case_items: {e.details.get('nInserted', len(ids))} of {len(docs)} {kind} inserted")
+            return ids
+    except Exception as e:
+        print("add_case_items")
+        print(e)
+        return []
+
+
+def add_case_document(user_id: str, case_id: str, filename: str, text: str, **fields):
+    ids = add_case_items(user_id, case_id, "documents", [dict(fields, filename=filename, text=text)])
+    return ids[0] if ids else None
+
+
+def add_case_email(user_id: str, case_id: str, email: dict):
+    ids = add_case_items(user_id, case_id, "emails", [email])
+    return ids[0] if ids else None
+
+
+def add_case_history(user_id: str, case_id: str, entry: dict):
+    ids = add_case_items(user_id, case_id, "history", [entry])
+    return ids[0] if ids else None
+
+
+def get_case_items(case_id: str, kind: str, limit: int = 20, after: str = None, projection: dict = None):
+    """
+    Return one page of a case's documents, history or emails, newest first.
+    Works like get_cases_page: returns (items, next_cursor).
+    """
+    try:
+        limit = max(1, min(int(limit), MAX_CASES_PAGE_SIZE))
+        query = {"case_id": ObjectId(case_id)}
+        if after:
+            query["_id"] = {"$lt": ObjectId(after)}
+        client = get_mongo_client()
+        collection = get_case_child_collection(client, kind)
+        items = list(collection.find(query, projection).sort("_id", DESCENDING).limit(limit + 1))
+        next_cursor = None
+        if len(items) > limit:
+            items = items[:limit]
+            next_cursor = str(items[-1]["_id"])
+        return items, next_cursor
+    except Exception as e:
+        print("get_case_items")
+        print(e)
+        return None, None
+
+
+def get_case_document_hashes(case_id: str, content_hashes: list) -> set:
+    """Return which of content_hashes are already stored against the case's documents."""
+    if not content_hashes:
+        return set()
+    try:
+        client = get_mongo_client()
+        collection = get_case_child_collection(client, "documents")
+        query = {"case_id": ObjectId(case_id), "content_hash": {"$in": list(content_hashes)}}
+        return set(collection.distinct("content_hash", query))
+    except Exception as e:
+        print("get_case_document_hashes")
+        print(e)
+        return set()
+
+
+def get_case_attachment_sources(case_id: str, gmail_ids: list) -> set:
+    """Return (gmail_id, filename) for email attachments already stored as the case's documents."""
+    if not gmail_ids:
+        return set()
+    try:
+        client = get_mongo_client()
+        collection = get_case_child_collection(client, "documents")
+        query = {"case_id": ObjectId(case_id), "gmail_id": {"$in": list(gmail_ids)}}
+        return {(doc["gmail_id"], doc.get("filename")) for doc in collection.find(query, {"gmail_id": 1, "filename": 1})}
+    except Exception as e:
+        print("get_case_attachment_sources")
+        print(e)
+        return set()
+
+
+def get_case_email_attachments(case_id: str) -> list:
+    """The case's attached emails that list attachments: [{"gmail_id", "attachments"}]."""
+    try:
+        client = get_mongo_client()
+        collection = get_case_child_collection(client, "emails")
+        query = {"case_id": ObjectId(case_id), "attachments.0": {"$exists": True}}
+        return list(collection.find(query, {"_id": 0, "gmail_id": 1, "attachments": 1}))
+    except Exception as e:
+        print("get_case_email_attachments")
+        print(e)
+        return []
+
+
+def get_email_sync_state(user_id: str):
+    """The lawyer's mailbox sync state: {"history_id", "synced_at", "full_synced_at"}, or None."""
+    try:
+        client = get_mongo_client()
+        collection = get_email_sync_collection(client)
+        return collection.find_one({"_id": ObjectId(user_id)})
+    except Exception as e:
+        print("get_email_sync_state")
+        print(e)
+        return None
+
+
+def save_email_sync_state(user_id: str, history_id: str, full: bool = False) -> bool:
+    """Record the Gmail historyId the store is now current to."""
+    try:
+        client = get_mongo_client()
+        collection = get_email_sync_collection(client)
+        now = datetime.now(timezone.utc)
+        update = {"history_id": str(history_id), "synced_at": now}
+        if full:
+            update["full_synced_at"] = now
+        collection.update_one({"_id": ObjectId(user_id)}, {"$set": update}, upsert=True)
+        return True
+    except Exception as e:
+        print("save_email_sync_state")
+        print(e)
+        return False
+
+
+def upsert_emails(user_id: str, emails: list) -> int:
+    """Insert or refresh parsed messages (keyed by gmail_id) in one bulk write."""
+    if not emails:
+        return 0
+    try:
+        client = get_mongo_client()
+        collection = get_emails_collection(client)
+        user_oid = ObjectId(user_id)
+        now = datetime.now(timezone.utc)
+        operations = [
+            UpdateOne({"user_id": user_oid, "gmail_id": email["gmail_id"]},
+                      {"$set": dict(email, user_id=user_oid, synced_at=now)}, upsert=True)
+            for email in emails
+        ]
+        result = collection.bulk_write(operations, ordered=False)
+        return result.upserted_count + result.modified_count
+    except Exception as e:
+        print("upsert_emails")
+        print(e)
+        return 0
+
+
+def update_email_labels(user_id: str, labels: dict) -> int:
+    """Set label_ids for stored messages from {gmail_id: [label, ...]}."""
+    if not labels:
+        return 0
+    try:
+        client = get_mongo_client()
+        collection = get_emails_collection(client)
+        user_oid = ObjectId(user_id)
+        operations = [UpdateOne({"user_id": user_oid, "gmail_id": gmail_id}, {"$set": {"label_ids": label_ids}})
+                      for gmail_id, label_ids in labels.items()]
+        return collection.bulk_write(operations, ordered=False).modified_count
+    except Exception as e:
+        print("update_email_labels")
+        print(e)
+        return 0
+
+
+def delete_emails(user_id: str, gmail_ids: list) -> int:
+    """Delete the given messages."""
+    if not gmail_ids:
+        return 0
+    try:
+        client = get_mongo_client()
+        collection = get_emails_collection(client)
+        query = {"user_id": ObjectId(user_id), "gmail_id": {"$in": list(gmail_ids)}}
+        return collection.delete_many(query).deleted_count
+    except Exception as e:
+        print("delete_emails")
+        print(e)
+        return 0
+
+
+def get_stale_email_ids(user_id: str, label: str, keep_ids: list) -> list:
+    """
+    Stored messages carrying label that are not in keep_ids. Messages stored
+    under other labels (e.g. by a search) are never stale.
+    """
+    try:
+        client = get_mongo_client()
+        collection = get_emails_collection(client)
+        query = {"user_id": ObjectId(user_id), "label_ids": label, "gmail_id": {"$nin": list(keep_ids)}}
+        return [doc["gmail_id"] for doc in collection.find(query, {"_id": 0, "gmail_id": 1})]
+    except Exception as e:
+        print("get_stale_email_ids")
+        print(e)
+        return []
+
+
+def get_stored_email_ids(user_id: str, gmail_ids: list) -> set:
+    """Return which of gmail_ids are already in the store."""
+    if not gmail_ids:
+        return set()
+    try:
+        client = get_mongo_client()
+        collection = get_emails_collection(client)
+        query = {"user_id": ObjectId(user_id), "gmail_id": {"$in": list(gmail_ids)}}
+        return {doc["gmail_id"] for doc in collection.find(query, {"_id": 0, "gmail_id": 1})}
+    except Exception as e:
+        print("get_stored_email_ids")
+        print(e)
+        return set()
+
+
+# List views never carry bodies; those are loaded per message
+EMAIL_LIST_PROJECTION = {"_id": 0, "user_id": 0, "synced_at": 0, "body_text": 0, "attachments": 0}
+
+
+def _email_cursor(email: dict) -> str:
+    return f"{int(email['internal_date'].replace(tzinfo=timezone.utc).timestamp() * 1000)}:{email['gmail_id']}"
+
+
+def find_emails(user_id: str, sender: str = None, after: datetime = None, before: datetime = None,
+                label: str = "INBOX", limit: int = 20, cursor: str = None, projection: dict = EMAIL_LIST_PROJECTION):
+    """
+    One page of a lawyer's stored messages, newest first, filtered like a
+    Gmail from:/after:/before: search. Keyset-paginated on (internal_date,
+    gmail_id) like get_cases_page: returns (emails, next_cursor).
+    Raises ValueError for a malformed cursor.
+    """
+    if cursor:
+        try:
+            millis, cursor_id = cursor.split(":", 1)
+            cursor_date = datetime.fromtimestamp(int(millis) / 1000, timezone.utc)
+        except ValueError:
+            raise ValueError("Invalid cursor")
+    try:
+        query = {"user_id": ObjectId(user_id)}
+        if label:
+            query["label_ids"] = label
+        if sender:
+            query["sender"] = {"$regex": re.escape(sender), "$options": "i"}
+        if after or before:
+            query["internal_date"] = {}
+            if after:
+                query["internal_date"]["$gte"] = after
+            if before:
+                query["internal_date"]["$lt"] = before
+        if cursor:
+            query["$or"] = [
+                {"internal_date": {"$lt": cursor_date}},
+                {"internal_date": cursor_date, "gmail_id": {"$lt": cursor_id}},
+            ]
+        client = get_mongo_client()
+        collection = get_emails_collection(client)
+        limit = max(1, min(int(limit), MAX_CASES_PAGE_SIZE))
+        sort = [("internal_date", DESCENDING), ("gmail_id", DESCENDING)]
+        emails = list(collection.find(query, projection).sort(sort).limit(limit + 1))
+        next_cursor = None
+        if len(emails) > limit:
+            emails = emails[:limit]
+            next_cursor = _email_cursor(emails[-1])
+        return emails, next_cursor
+    except Exception as e:
+        print("find_emails")
+        print(e)
+        return None, None
+
+
+def get_stored_emails(user_id: str, gmail_ids: list, projection: dict = EMAIL_LIST_PROJECTION) -> dict:
+    """{gmail_id: message} for the given ids that are in the store."""
+    if not gmail_ids:
+        return {}
+    try:
+        client = get_mongo_client()
+        collection = get_emails_collection(client)
+        query = {"user_id": ObjectId(user_id), "gmail_id": {"$in": list(gmail_ids)}}
+        return {email["gmail_id"]: email for email in collection.find(query, projection)}
+    except Exception as e:
+        print("get_stored_emails")
+        print(e)
+        return {}
+
+
+def get_stored_email(user_id: str, gmail_id: str, projection: dict = None):
+    """One stored message (with its body, if it has been loaded)."""
+    try:
+        client = get_mongo_client()
+        collection = get_emails_collection(client)
+        projection = projection or {"_id": 0, "user_id": 0, "synced_at": 0}
+        return collection.find_one({"user_id": ObjectId(user_id), "gmail_id": gmail_id}, projection)
+    except Exception as e:
+        print("get_stored_email")
+        print(e)
+        return None
+
+
+def save_email_body(user_id: str, email: dict) -> bool:
+    """Store a message fetched in full, so its body is only downloaded once."""
+    return upsert_emails(user_id, [email]) > 0
+
+
+def get_case_email_message_ids(case_id: str, message_ids: list) -> set:
+    """Return which of message_ids (Message-ID headers) are already attached to the case."""
+    if not message_ids:
+        return set()
+    try:
+        client = get_mongo_client()
+        collection = get_case_child_collection(client, "emails")
+        query = {"case_id": ObjectId(case_id), "message_id": {"$in": list(message_ids)}}
+        return {doc["message_id"] for doc in collection.find(query, {"_id": 0, "message_id": 1})}
+    except Exception as e:
+        print("get_case_email_message_ids")
+        print(e)
+        return set()
+
+
+def store_email_bodies(bodies: dict) -> set:
+    """
+    Store {body_hash: text} in the shared email_bodies collection, keyed by
+    hash, so a body attached to many cases is kept once. Returns the hashes
+    that were not stored before.
+    """
+    if not bodies:
+        return set()
+    try:
+        client = get_mongo_client()
+        collection = get_email_bodies_collection(client)
+        now = datetime.now(timezone.utc)
+        operations = [
+            UpdateOne({"_id": body_hash}, {"$setOnInsert": {"text": text, "size": len(text.encode("utf-8")), "created_at": now}},
+                      upsert=True)
+            for body_hash, text in bodies.items()
+        ]
+        return set(collection.bulk_write(operations, ordered=False).upserted_ids.values())
+    except Exception as e:
+        print("store_email_bodies")
+        print(e)
+        return set()
+
+
+def get_email_bodies(body_hashes: list) -> dict:
+    """{body_hash: text} for the given hashes."""
+    if not body_hashes:
+        return {}
+    try:
+        client = get_mongo_client()
+        collection = get_email_bodies_collection(client)
+        return {doc["_id"]: doc["text"] for doc in collection.find({"_id": {"$in": list(set(body_hashes))}})}
+    except Exception as e:
+        print("get_email_bodies")
+        print(e)
+        return {}
+
+
+def migrate_embedded_case_arrays(batch_size: int = 100) -> dict:
+    """
+    Move documents/history/emails arrays embedded in old case documents into
+    the child collections, batch_size cases at a time.
+
+    Each entry is upserted on (case_id, migrated_index) before the arrays are
+    unset, so an interrupted run can simply be started again.
+    """
+    stats = {"cases": 0, "items": 0}
+    client = get_mongo_client()
+    if client is None:
+        return stats
+    cases_collection = get_cases_collection(client)
+    embedded = {"$or": [{kind: {"$exists": True}} for kind in CASE_CHILD_COLLECTIONS]}
+    projection = {"user_id": 1, **{kind: 1 for kind in CASE_CHILD_COLLECTIONS}}
+
+    while True:
+        batch = list(cases_collection.find(embedded, projection).limit(batch_size))
+        if not batch:
+            break
+        for case in batch:
+            for kind in CASE_CHILD_COLLECTIONS:
+                entries = case.get(kind) or []
+                if not entries:
+                    continue
+                requests = []
+                for i, entry in enumerate(entries):
+                    doc = dict(entry) if isinstance(entry, dict) else {"value": entry}
+                    doc.pop("_id", None)
+                    doc.update({"case_id": case["_id"], "user_id": case.get("user_id"), "migrated_index": i})
+                    doc.setdefault("created_at", case["_id"].generation_time)
+                    requests.append(ReplaceOne({"case_id": case["_id"], "migrated_index": i}, doc, upsert=True))
+                get_case_child_collection(client, kind).bulk_write(requests, ordered=False)
+                stats["items"] += len(requests)
+            cases_collection.update_one(
+                {"_id": case["_id"]},
+                {"$unset": {kind: "" for kind in CASE_CHILD_COLLECTIONS}},
+            )
+            stats["cases"] += 1
+        print(f"Migrated {stats['cases']} cases ({stats['items']} entries)")
+    return stats
+
+if __name__ == "__main__":
+    import sys
+    import json
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "indexes"
+    if command == "indexes":
+        print(json.dumps(ensure_indexes(), indent=2))
+    elif command == "migrate-case-arrays":
+        batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+        print(json.dumps(migrate_embedded_case_arrays(batch_size), indent=2))
+    elif command == "explain":
+        report = explain_queries()
+        for name, info in report.items():
+            print(f"{name}: {info['collection']} {info['filter']} -> {' > '.join(info['stages'])}")
+        if any(info["collscan"] for info in report.values()):
+            sys.exit(1)
+    else:
+        print(f"Unknown command: {command} (expected 'indexes', 'explain' or 'migrate-case-arrays')")
+        sys.exit(2)
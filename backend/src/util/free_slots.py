@@ -0,0 +1,114 @@
+from datetime import date, datetime, time, timedelta
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+# Free-slot search for meeting suggestions. Busy periods (from any number of
+# calendars) are sorted and merged once; the free gaps inside each allowed
+# window (working hours, or a requested time of day, per day of the range)
+# are then found in one sweep, so the cost is O(n log n) in the number of busy
+# periods rather than O(candidate slots x busy periods). Slot starts sit on a
+# grid of `granularity` from the start of each window.
+#
+# All datetimes are timezone-aware; windows are built in the user's zone so
+# they follow DST, and compared as instants.
+
+Interval = Tuple[datetime, datetime]
+
+# Monday..Friday, as datetime.weekday() numbers
+WORKING_DAYS = frozenset(range(5))
+WORKING_HOURS = (time(9, 0), time(18, 0))
+
+
+def _localize(tz, moment: datetime) -> datetime:
+    # pytz zones need localize() to pick the right offset; zoneinfo zones don't
+    return tz.localize(moment) if hasattr(tz, "localize") else moment.replace(tzinfo=tz)
+
+
+def merge_intervals(intervals: Iterable[Interval]) -> List[Interval]:
+    """
+    Sort intervals and merge the ones that overlap or touch. Empty intervals
+    are dropped. Several calendars' busy lists can be passed chained together;
+    each is already sorted, which the sort takes advantage of.
+    """
+    merged = []
+    for start, end in sorted(interval for interval in intervals if interval[0] < interval[1]):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def daily_windows(first_day: date, last_day: date, tz, start: time = WORKING_HOURS[0], end: time = WORKING_HOURS[1],
+                  weekdays: Optional[Iterable[int]] = WORKING_DAYS) -> List[Interval]:
+    """
+    One window per day from first_day to last_day (inclusive), start..end in
+    tz, on the given weekdays (None for every day). A window whose end is not
+    after its start runs past midnight.
+    """
+    weekdays = None if weekdays is None else set(weekdays)
+    windows = []
+    day = first_day
+    while day <= last_day:
+        if weekdays is None or day.weekday() in weekdays:
+            window_end_day = day if end > start else day + timedelta(days=1)
+            windows.append((_localize(tz, datetime.combine(day, start)),
+                            _localize(tz, datetime.combine(window_end_day, end))))
+        day += timedelta(days=1)
+    return windows
+
+
+def clip_windows(windows: Iterable[Interval], not_before: Optional[datetime] = None,
+                 not_after: Optional[datetime] = None) -> List[Interval]:
+    """Cut windows to not_before..not_after, dropping the ones left empty."""
+    clipped = []
+    for start, end in windows:
+        if not_before is not None and start < not_before:
+            start = not_before
+        if not_after is not None and end > not_after:
+            end = not_after
+        if start < end:
+            clipped.append((start, end))
+    return clipped
+
+
+def iter_free_slots(busy: List[Interval], windows: List[Interval], duration: timedelta,
+                    granularity: timedelta = timedelta(minutes=30)) -> Iterator[Interval]:
+    """
+    Yield every (start, end) slot of `duration` that lies inside a window and
+    clear of every busy period, in time order.
+
+    busy must be merged (merge_intervals) and windows sorted and non-overlapping.
+    """
+    if duration <= timedelta(0) or granularity <= timedelta(0):
+        raise ValueError("duration and granularity must be positive")
+    first = 0
+    for window_start, window_end in windows:
+        # Busy periods that ended before this window can't matter to it or any later one
+        while first < len(busy) and busy[first][1] <= window_start:
+            first += 1
+        cursor = window_start
+        i = first
+        while cursor < window_end:
+            gap_end = window_end
+            if i < len(busy) and busy[i][0] < window_end:
+                gap_end = busy[i][0]
+            if gap_end - cursor >= duration:
+                # First grid point at or after the start of the gap
+                steps = -((window_start - cursor) // granularity)
+                slot_start = window_start + steps * granularity
+                while slot_start + duration <= gap_end:
+                    yield slot_start, slot_start + duration
+                    slot_start += granularity
+            if gap_end == window_end:
+                break
+            cursor = max(cursor, busy[i][1])
+            i += 1
+
+
+def find_free_slots(busy: Iterable[Interval], windows: Iterable[Interval], duration: timedelta,
+                    granularity: timedelta = timedelta(minutes=30), limit: Optional[int] = None) -> List[Interval]:
+    """Merge busy periods and windows, then return the first `limit` free slots (all of them if None)."""
+    slots = iter_free_slots(merge_intervals(busy), merge_intervals(windows), duration, granularity)
+    return list(islice(slots, limit))
@@ -0,0 +1,84 @@
+"""
+Measure free-slot search on synthetic calendars with thousands of busy periods.
+
+Builds busy calendars for several attendees over a range of days (random
+meetings during and around working hours, often overlapping), then finds every
+free slot in the working-hours windows with the interval sweep and with the
+previous approach, kept here as the baseline: step through each window every
+`granularity` minutes and scan all busy periods for each candidate. Both must
+find the same slots. Run from the backend/src directory:
+
+    python -m util.free_slots_benchmark [busy_periods] [days] [attendees] [granularity_minutes]
+"""
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+
+from util.free_slots import daily_windows, find_free_slots, merge_intervals
+
+
+def baseline_free_slots(busy: list, windows: list, duration: timedelta, granularity: timedelta) -> list:
+    """Step-and-scan: O(candidate slots x busy periods)."""
+    slots = []
+    for window_start, window_end in merge_intervals(windows):
+        slot_start = window_start
+        while slot_start + duration <= window_end:
+            slot_end = slot_start + duration
+            if all(slot_end <= busy_start or slot_start >= busy_end for busy_start, busy_end in busy):
+                slots.append((slot_start, slot_end))
+            slot_start += granularity
+    return slots
+
+
+def synthetic_calendars(busy_periods: int, days: int, attendees: int, seed: int = 7) -> tuple:
+    """Returns (first_day, [one busy list per attendee]) with busy_periods periods in total."""
+    rng = random.Random(seed)
+    first_day = date(2025, 3, 3)
+    per_attendee = max(1, busy_periods // attendees)
+    calendars = []
+    for _ in range(attendees):
+        busy = []
+        for _ in range(per_attendee):
+            day = first_day + timedelta(days=rng.randrange(days))
+            start = datetime(day.year, day.month, day.day, tzinfo=timezone.utc) + timedelta(
+                minutes=rng.randrange(7 * 60, 19 * 60, 5))
+            busy.append((start, start + timedelta(minutes=rng.choice((15, 30, 30, 45, 60, 90)))))
+        calendars.append(sorted(busy))
+    return first_day, calendars
+
+
+def _time(function, *args) -> tuple:
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main(argv):
+    busy_periods = int(argv[0]) if argv else 5000
+    days = int(argv[1]) if len(argv) > 1 else 250
+    attendees = int(argv[2]) if len(argv) > 2 else 5
+    granularity = timedelta(minutes=int(argv[3]) if len(argv) > 3 else 15)
+    duration = timedelta(minutes=30)
+
+    first_day, calendars = synthetic_calendars(busy_periods, days, attendees)
+    busy = [period for calendar in calendars for period in calendar]
+    windows = daily_windows(first_day, first_day + timedelta(days=days - 1), timezone.utc, weekdays=None)
+    print(f"{len(busy)} busy periods, {attendees} attendees, {days} days, "
+          f"{int(granularity.total_seconds() // 60)}-minute grid, {len(windows)} windows")
+
+    after, after_seconds = _time(find_free_slots, busy, windows, duration, granularity)
+    before, before_seconds = _time(baseline_free_slots, busy, windows, duration, granularity)
+    if before != after:
+        print(f"Mismatch: baseline found {len(before)} slots, sweep found {len(after)}")
+        return 1
+
+    print(f"{'engine':<10} {'slots':>7} {'ms':>10}")
+    print(f"{'before':<10} {len(before):>7} {before_seconds * 1000:>10.1f}")
+    print(f"{'after':<10} {len(after):>7} {after_seconds * 1000:>10.1f}")
+    print(f"{before_seconds / after_seconds:.0f}x faster" if after_seconds else "")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,112 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from functools import lru_cache
+from typing import Optional
+
+import httplib2
+import google_auth_httplib2
+from cachetools import TTLCache
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.http import HttpRequest
+
+# Shared factory for Google API clients (Gmail, Calendar, OAuth2 userinfo).
+# Building a client means loading and parsing its discovery document and
+# wiring up every resource method, which costs far more than the API call it
+# is usually built for. Here each discovery document is parsed once per
+# process, and built clients are cached per credential for a while.
+#
+# A cached client may be used from several threads at once: each request
+# runs on a per-thread httplib2.Http (httplib2 is not thread-safe), wrapped
+# with that request's credentials.
+
+GOOGLE_SERVICE_CACHE_SIZE = int(os.getenv("GOOGLE_SERVICE_CACHE_SIZE", 256))
+GOOGLE_SERVICE_CACHE_TTL_SECONDS = int(os.getenv("GOOGLE_SERVICE_CACHE_TTL_SECONDS", 3600))
+
+_services = TTLCache(maxsize=GOOGLE_SERVICE_CACHE_SIZE, ttl=GOOGLE_SERVICE_CACHE_TTL_SECONDS)
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "builds": 0, "build_seconds": 0.0}
+_local = threading.local()
+
+
+@lru_cache(maxsize=None)
+def discovery_document(name: str, version: str) -> Optional[dict]:
+    """The parsed discovery document bundled with google-api-python-client (None if not bundled)."""
+    doc = get_static_doc(name, version)
+    return json.loads(doc) if doc else None
+
+
+def _thread_http() -> httplib2.Http:
+    if not hasattr(_local, "http"):
+        _local.http = httplib2.Http()
+    return _local.http
+
+
+def _request_builder(http, *args, **kwargs):
+    # Called for every API request: run it on this thread's connection
+    return HttpRequest(google_auth_httplib2.AuthorizedHttp(http.credentials, http=_thread_http()), *args, **kwargs)
+
+
+def credential_key(credentials) -> str:
+    """Cache key for a credentials object: the access and refresh tokens plus the client."""
+    identity = "|".join(str(getattr(credentials, attr, "") or "")
+                        for attr in ("token", "refresh_token", "client_id"))
+    return hashlib.sha256(identity.encode("utf-8")).hexdigest()
+
+
+def _build(name: str, version: str, credentials):
+    document = discovery_document(name, version)
+    if document is None:
+        return build(name, version, credentials=credentials, cache_discovery=False)
+    http = google_auth_httplib2.AuthorizedHttp(credentials, http=_thread_http())
+    return build_from_document(document, http=http, requestBuilder=_request_builder)
+
+
+def get_service(name: str, version: str, credentials, cache_key: Optional[str] = None):
+    """
+    Return an API client for (name, version) acting as credentials, reusing
+    one built earlier for the same credentials when there is one.
+
+    Args:
+        name, version: API, e.g. ("gmail", "v1") or ("calendar", "v3")
+        credentials: google.oauth2 credentials
+        cache_key: Identifies the credentials; defaults to credential_key().
+                   Pass a fixed key when one credentials object is refreshed in place.
+    """
+    key = (name, version, cache_key or credential_key(credentials))
+    with _lock:
+        service = _services.get(key)
+        if service is not None:
+            _stats["hits"] += 1
+            return service
+        _stats["misses"] += 1
+
+    start = time.perf_counter()
+    service = _build(name, version, credentials)
+    elapsed = time.perf_counter() - start
+    with _lock:
+        _stats["builds"] += 1
+        _stats["build_seconds"] += elapsed
+        _services[key] = service
+    return service
+
+
+def clear_service_cache():
+    with _lock:
+        _services.clear()
+
+
+def get_service_stats() -> dict:
+    """Cache counters, with the build time saved estimated from the mean build time."""
+    with _lock:
+        stats = dict(_stats)
+        stats["cached_services"] = len(_services)
+    mean_build = stats["build_seconds"] / stats["builds"] if stats["builds"] else 0.0
+    stats["build_seconds"] = round(stats["build_seconds"], 4)
+    stats["mean_build_ms"] = round(mean_build * 1000, 3)
+    stats["build_seconds_saved"] = round(stats["hits"] * mean_build, 4)
+    stats["discovery_documents"] = discovery_document.cache_info().currsize
+    return stats
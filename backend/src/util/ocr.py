@@ -1,35 +1,587 @@
+import io
 import os
+import hashlib
+import subprocess
 import tempfile
 import pytesseract
-from pdf2image import convert_from_path
-from typing import List, Optional
+import numpy as np
+from PIL import Image, ImageOps
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pdf2image import convert_from_path, pdfinfo_from_path
+from typing import Callable, List, Optional
+from util.ocr_cache import file_sha256, get_cached_pages, store_pages, OCR_CACHE_ENABLED
 
-def extract_text_from_pdf(pdf_path: str, dpi: int = 300) -> str:
+# Documents with fewer pages than this are OCR'd serially: starting a pool
+# costs more than it saves.
+PARALLEL_MIN_PAGES = int(os.getenv("OCR_PARALLEL_MIN_PAGES", 4))
+
+def default_ocr_workers() -> int:
+    """
+    Number of page workers to use for one document.
+
+    Tesseract may start several OpenMP threads per process; each worker is
+    limited to OMP_THREAD_LIMIT threads (1 unless set), so the CPUs are split
+    between workers rather than oversubscribed. OCR_PAGE_WORKERS overrides it.
+    """
+    configured = os.getenv("OCR_PAGE_WORKERS")
+    if configured:
+        return max(1, int(configured))
+    threads_per_worker = max(1, int(os.getenv("OMP_THREAD_LIMIT", 1)))
+    return max(1, (os.cpu_count() or 1) // threads_per_worker)
+
+OCR_MODES = ("auto", "ocr", "native")
+
+# Tesseract language(s), e.g. "eng" or "eng+spa"
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+
+# A page counts as having a text layer once it has this many non-space characters
+NATIVE_TEXT_MIN_CHARS = int(os.getenv("OCR_NATIVE_MIN_CHARS", 20))
+
+# Default OCR settings; each request can override them (see parse_ocr_settings).
+#   grayscale: rasterize pages in grayscale (a third of the memory of RGB)
+#   binarize: Otsu-threshold pages to black and white before OCR
+#   deskew: detect and undo small page rotations from scanning
+#   adaptive: OCR at dpi first and, when word confidence is below
+#     min_confidence, re-OCR at a DPI chosen from the detected text height
+#     (up to max_dpi)
+DEFAULT_OCR_SETTINGS = {
+    "dpi": 300,
+    "grayscale": True,
+    "binarize": False,
+    "deskew": False,
+    "adaptive": False,
+    "max_dpi": 400,
+    "min_confidence": 70,
+}
+
+# Starting DPI for adaptive OCR when the request doesn't give one
+ADAPTIVE_START_DPI = int(os.getenv("OCR_ADAPTIVE_START_DPI", 150))
+
+# Tesseract is most accurate when words are roughly this tall in pixels
+TARGET_TEXT_HEIGHT_PX = 32
+
+# Peak memory allowed for rasterized pages held at once by the serial path
+OCR_MEMORY_BUDGET_MB = int(os.getenv("OCR_MEMORY_BUDGET_MB", 256))
+
+# Scratch space for uploaded PDFs that poppler has to read from a path.
+# /dev/shm keeps them in RAM where available.
+OCR_SCRATCH_DIR = os.getenv("OCR_SCRATCH_DIR") or ("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir())
+
+class ScratchFile:
+    """
+    A file in OCR_SCRATCH_DIR that hashes what is written to it. Multipart
+    file parts are parsed straight into one (see scratch_upload_stream), so an
+    upload lands in scratch once, already hashed, and spool_pdf() just takes
+    it over. The file is removed on close unless it was taken over.
     """
-    Extract text from a PDF file using OCR.
-    
+
+    def __init__(self, suffix: str = ""):
+        fd, self.path = tempfile.mkstemp(suffix=suffix, dir=OCR_SCRATCH_DIR)
+        self._file = os.fdopen(fd, "w+b")
+        self._digest = hashlib.sha256()
+        self._owned = True
+
+    def write(self, data) -> int:
+        self._digest.update(data)
+        return self._file.write(data)
+
+    def detach(self) -> tuple:
+        """Hand the file over to the caller: returns (path, sha256), and close() leaves it in place."""
+        self._file.flush()
+        self._owned = False
+        return self.path, self._digest.hexdigest()
+
+    def close(self):
+        self._file.close()
+        if self._owned and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __getattr__(self, name):
+        # read, seek, tell, flush... go straight to the file
+        return getattr(self._file, name)
+
+def scratch_upload_stream(total_content_length, content_type, filename=None, content_length=None) -> ScratchFile:
+    """Werkzeug stream factory (Request._get_file_stream) writing file parts to OCR_SCRATCH_DIR."""
+    return ScratchFile(os.path.splitext(filename or "")[1])
+
+def spool_pdf(source) -> tuple:
+    """
+    Write PDF bytes or a readable binary stream (e.g. an upload's .stream)
+    to OCR_SCRATCH_DIR, hashing it on the way. Returns (path, sha256).
+    An upload parsed into a ScratchFile is taken over without copying.
+
+    The caller owns the file; use spooled_pdf() to have it removed automatically.
+    """
+    if isinstance(source, ScratchFile):
+        return source.detach()
+    fd, path = tempfile.mkstemp(suffix='.pdf', dir=OCR_SCRATCH_DIR)
+    digest = hashlib.sha256()
+    try:
+        with os.fdopen(fd, "wb") as f:
+            if isinstance(source, (bytes, bytearray, memoryview)):
+                f.write(source)
+                digest.update(source)
+            else:
+                for chunk in iter(lambda: source.read(1024 * 1024), b""):
+                    f.write(chunk)
+                    digest.update(chunk)
+    except Exception:
+        os.remove(path)
+        raise
+    return path, digest.hexdigest()
+
+@contextmanager
+def spooled_pdf(source):
+    """spool_pdf() as a context manager that always removes the file."""
+    path, content_hash = spool_pdf(source)
+    try:
+        yield path, content_hash
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+def _run_tesseract(image, *args) -> str:
+    buffer = io.BytesIO()
+    # PNM is uncompressed, so encoding it is nearly free
+    image.save(buffer, format="PPM")
+    result = subprocess.run(
+        [pytesseract.pytesseract.tesseract_cmd, "stdin", "stdout", "-l", OCR_LANG, *args],
+        input=buffer.getvalue(),
+        capture_output=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"tesseract failed: {result.stderr.decode('utf-8', errors='replace').strip()}")
+    return result.stdout.decode("utf-8", errors="replace")
+
+def image_to_text(image) -> str:
+    """
+    OCR a PIL image by piping it to tesseract's stdin and reading stdout.
+
+    Same result as pytesseract.image_to_string, without the temporary image
+    and output files pytesseract writes for every call.
+    """
+    return _run_tesseract(image)
+
+def image_to_data(image) -> tuple:
+    """
+    OCR a PIL image with tesseract's TSV output (what pytesseract.image_to_data
+    parses). Returns (text, mean word confidence, median word height in px).
+    """
+    lines = {}
+    paragraphs = []
+    confidences = []
+    heights = []
+    for row in _run_tesseract(image, "tsv").splitlines()[1:]:
+        fields = row.split("\t")
+        if len(fields) < 12 or fields[0] != "5" or not fields[11].strip():
+            continue
+        block, paragraph, line = fields[2], fields[3], fields[4]
+        if (block, paragraph) not in paragraphs:
+            paragraphs.append((block, paragraph))
+        lines.setdefault((block, paragraph), {}).setdefault(line, []).append(fields[11])
+        confidence = float(fields[10])
+        if confidence >= 0:
+            confidences.append(confidence)
+            heights.append(int(fields[9]))
+    text = "\n\n".join(
+        "\n".join(" ".join(words) for words in lines[key].values()) for key in paragraphs
+    )
+    mean_confidence = sum(confidences) / len(confidences) if confidences else 0.0
+    median_height = sorted(heights)[len(heights) // 2] if heights else 0
+    return text, mean_confidence, median_height
+
+def _otsu_threshold(image) -> int:
+    histogram = image.histogram()[:256]
+    total = sum(histogram)
+    weighted_total = sum(i * count for i, count in enumerate(histogram))
+    background = 0
+    weighted_background = 0.0
+    best_threshold, best_variance = 127, -1.0
+    for threshold, count in enumerate(histogram):
+        background += count
+        if background == 0:
+            continue
+        foreground = total - background
+        if foreground == 0:
+            break
+        weighted_background += threshold * count
+        mean_background = weighted_background / background
+        mean_foreground = (weighted_total - weighted_background) / foreground
+        variance = background * foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_threshold, best_variance = threshold, variance
+    return best_threshold
+
+def _skew_angle(image, max_angle: float = 5.0, step: float = 0.5) -> float:
+    """Estimate page skew by finding the rotation whose row ink profile is sharpest."""
+    sample = image.copy()
+    sample.thumbnail((1000, 1000))
+    best_angle, best_score = 0.0, -1.0
+    for angle in np.arange(-max_angle, max_angle + step / 2, step):
+        rotated = sample.rotate(float(angle), resample=Image.NEAREST, fillcolor=255)
+        profile = (np.asarray(rotated) < 128).sum(axis=1)
+        score = float(np.var(profile))
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+def preprocess_image(image, settings: dict):
+    """Apply the grayscale / deskew / binarize steps enabled in settings."""
+    if settings["grayscale"] or settings["binarize"] or settings["deskew"]:
+        if image.mode != "L":
+            image = ImageOps.grayscale(image)
+    if settings["deskew"]:
+        angle = _skew_angle(image)
+        if abs(angle) >= 0.5:
+            image = image.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+    if settings["binarize"]:
+        threshold = _otsu_threshold(image)
+        image = image.point([0 if value <= threshold else 255 for value in range(256)])
+    return image
+
+def ocr_settings(dpi: int = 300, settings: Optional[dict] = None) -> dict:
+    """DEFAULT_OCR_SETTINGS with dpi and any non-None overrides from settings applied."""
+    merged = dict(DEFAULT_OCR_SETTINGS, dpi=dpi)
+    merged.update({key: value for key, value in (settings or {}).items() if value is not None})
+    return merged
+
+def settings_key(settings: dict) -> str:
+    """Short name for everything in settings that changes OCR output (used by the OCR cache)."""
+    key = str(settings["dpi"])
+    if settings["grayscale"]:
+        key += "g"
+    if settings["binarize"]:
+        key += "b"
+    if settings["deskew"]:
+        key += "d"
+    if settings["adaptive"]:
+        key += f"a{settings['max_dpi']}c{settings['min_confidence']}"
+    return key
+
+def parse_ocr_settings(values) -> dict:
+    """
+    Read OCR settings from a request's form or query args. Returns only the
+    settings that were given; raises ValueError on bad values.
+    """
+    def flag(name):
+        value = values.get(name)
+        if value is None or value == "":
+            return None
+        return str(value).lower() in ("1", "true", "yes", "on")
+
+    def number(name, low, high):
+        value = values.get(name)
+        if value is None or value == "":
+            return None
+        try:
+            value = int(value)
+        except ValueError:
+            raise ValueError(f"{name} must be an integer")
+        if not low <= value <= high:
+            raise ValueError(f"{name} must be between {low} and {high}")
+        return value
+
+    settings = {
+        "dpi": number("dpi", 50, 600),
+        "grayscale": flag("grayscale"),
+        "binarize": flag("binarize"),
+        "deskew": flag("deskew"),
+        "adaptive": flag("adaptive"),
+        "max_dpi": number("max_dpi", 50, 600),
+        "min_confidence": number("min_confidence", 0, 100),
+    }
+    if settings["adaptive"] and settings["dpi"] is None:
+        settings["dpi"] = ADAPTIVE_START_DPI
+    return {key: value for key, value in settings.items() if value is not None}
+
+def _ocr_page_image(pdf_path: str, page_number: int, image, settings: dict) -> str:
+    """OCR one rendered page, re-rendering it at a higher DPI if adaptive OCR calls for it."""
+    prepared = preprocess_image(image, settings)
+    if not settings["adaptive"]:
+        return image_to_text(prepared)
+
+    text, confidence, text_height = image_to_data(prepared)
+    dpi = settings["dpi"]
+    if confidence >= settings["min_confidence"]:
+        return text
+
+    # Scale so words come out around TARGET_TEXT_HEIGHT_PX tall; if the text
+    # is already large enough, low confidence alone still earns a retry
+    target_dpi = dpi * TARGET_TEXT_HEIGHT_PX / text_height if text_height else dpi * 2
+    if target_dpi < dpi * 1.25:
+        target_dpi = dpi * 1.5
+    target_dpi = min(int(target_dpi), settings["max_dpi"])
+    if target_dpi <= dpi:
+        return text
+
+    print(f"Page {page_number}: confidence {confidence:.0f} at {dpi} DPI, retrying at {target_dpi} DPI")
+    sharper = convert_from_path(pdf_path, target_dpi, first_page=page_number, last_page=page_number,
+                                grayscale=settings["grayscale"])[0]
+    try:
+        retry_text, retry_confidence, _ = image_to_data(preprocess_image(sharper, settings))
+    finally:
+        sharper.close()
+    return retry_text if retry_confidence >= confidence else text
+
+def pdf_page_count(pdf_path: str) -> int:
+    return int(pdfinfo_from_path(pdf_path)["Pages"])
+
+def estimate_page_bytes(pdf_info: dict, dpi: int, channels: int = 3) -> int:
+    """Size of one page rendered at dpi, from pdfinfo's 'Page size' (in points)."""
+    try:
+        width_pts, height_pts = [float(v) for v in pdf_info["Page size"].split(" pts")[0].split(" x ")]
+    except (KeyError, ValueError):
+        # Assume US letter
+        width_pts, height_pts = 612.0, 792.0
+    return int(width_pts / 72 * dpi) * int(height_pts / 72 * dpi) * channels
+
+# convert_from_path reads all of pdftoppm's output for a window, then copies
+# each page out of it before decoding, so a window peaks at about three times
+# the size of its rendered pages (measured by tests/test_ocr_memory.py)
+_RASTER_MEMORY_FACTOR = 3
+
+def _page_windows(page_numbers, window: int):
+    """Group sorted page numbers into (first_page, last_page) runs of at most window pages."""
+    runs = []
+    for page_number in page_numbers:
+        if runs and page_number == runs[-1][1] + 1 and runs[-1][1] - runs[-1][0] + 1 < window:
+            runs[-1][1] = page_number
+        else:
+            runs.append([page_number, page_number])
+    return [tuple(run) for run in runs]
+
+def iter_page_images(pdf_path: str, dpi: int = 300, page_numbers: Optional[List[int]] = None,
+                     memory_budget_mb: Optional[int] = None, pdf_info: Optional[dict] = None,
+                     grayscale: bool = False):
+    """
+    Yield (page_number, image) for each page (or just page_numbers), rasterizing
+    only as many pages at once as fit in memory_budget_mb (default
+    OCR_MEMORY_BUDGET_MB).
+
+    Each image is closed once the consumer moves on to the next page.
+    """
+    info = pdf_info or pdfinfo_from_path(pdf_path)
+    page_count = int(info["Pages"])
+    pages = sorted(page_numbers) if page_numbers is not None else range(1, page_count + 1)
+    budget = (memory_budget_mb or OCR_MEMORY_BUDGET_MB) * 1024 * 1024
+    page_bytes = estimate_page_bytes(info, dpi, 1 if grayscale else 3) * _RASTER_MEMORY_FACTOR
+    window = max(1, budget // max(1, page_bytes))
+
+    for first_page, last_page in _page_windows(pages, window):
+        images = convert_from_path(pdf_path, dpi, first_page=first_page, last_page=last_page, grayscale=grayscale)
+        print(f"Rasterized pages {first_page}-{last_page} of {page_count}")
+        try:
+            for offset in range(len(images)):
+                yield first_page + offset, images[offset]
+                images[offset].close()
+                images[offset] = None
+        finally:
+            for image in images:
+                if image is not None:
+                    image.close()
+
+def _init_page_worker():
+    # Inherited by the tesseract subprocesses this worker starts
+    os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+def _ocr_page(pdf_path: str, page_number: int, settings: dict) -> str:
+    """Rasterize and OCR a single (1-based) page. Runs in a pool worker."""
+    image = convert_from_path(pdf_path, settings["dpi"], first_page=page_number, last_page=page_number,
+                              grayscale=settings["grayscale"])[0]
+    return _ocr_page_image(pdf_path, page_number, image, settings)
+
+def _iter_pages_parallel(pdf_path: str, page_numbers: List[int], settings: dict, workers: int):
+    pool = ProcessPoolExecutor(max_workers=min(workers, len(page_numbers)), initializer=_init_page_worker)
+    try:
+        futures = {pool.submit(_ocr_page, pdf_path, page_number, settings): page_number for page_number in page_numbers}
+        for done, future in enumerate(as_completed(futures), start=1):
+            # Drop each future once read so finished pages aren't kept around
+            page_number = futures.pop(future)
+            print(f"Processed page {page_number} ({done}/{len(page_numbers)})")
+            yield page_number, future.result()
+    finally:
+        # If the consumer stops early, don't OCR the pages nobody will read
+        pool.shutdown(wait=True, cancel_futures=True)
+
+def iter_extract_pages(pdf_path: str, page_numbers: List[int], settings: dict, workers: Optional[int] = None,
+                       pdf_info: Optional[dict] = None):
+    """
+    Yield (page_number, text) for each of page_numbers as soon as it is OCR'd.
+    Pages come back in page order when serial, completion order when parallel.
+    """
+    workers = workers or default_ocr_workers()
+    if workers > 1 and len(page_numbers) >= PARALLEL_MIN_PAGES:
+        print(f"OCR'ing {len(page_numbers)} pages with {min(workers, len(page_numbers))} workers")
+        yield from _iter_pages_parallel(pdf_path, page_numbers, settings, workers)
+        return
+
+    # Rasterize a window of pages at a time so memory stays within the budget
+    done = 0
+    for page_number, image in iter_page_images(pdf_path, settings["dpi"], page_numbers, pdf_info=pdf_info,
+                                               grayscale=settings["grayscale"]):
+        done += 1
+        print(f"Processing page {page_number} ({done}/{len(page_numbers)})")
+        yield page_number, _ocr_page_image(pdf_path, page_number, image, settings)
+
+def native_page_texts(pdf_path: str) -> List[str]:
+    """
+    Text layer of every page, read with poppler's pdftotext (installed
+    alongside pdf2image). Pages without a text layer come back empty.
+    """
+    result = subprocess.run(["pdftotext", "-enc", "UTF-8", pdf_path, "-"],
+                            capture_output=True, check=True)
+    page_count = pdf_page_count(pdf_path)
+    # pdftotext ends every page with a form feed
+    texts = result.stdout.decode("utf-8", errors="replace").split("\f")[:page_count]
+    return texts + [""] * (page_count - len(texts))
+
+def has_text_layer(text: str) -> bool:
+    return sum(1 for c in text if not c.isspace()) >= NATIVE_TEXT_MIN_CHARS
+
+def plan_document(pdf_path: str, dpi: int = 300, mode: str = "auto", content_hash: Optional[str] = None,
+                  settings: Optional[dict] = None) -> dict:
+    """
+    Work out what it takes to extract a PDF without OCR'ing anything yet.
+
+    Returns {"page_count", "settings", "content_hash", "variant",
+    "ready": {page: (text, source, cached)}, "todo": [pages to OCR]} where
+    ready holds pages read from the text layer or the OCR cache.
+    """
+    if mode not in OCR_MODES:
+        raise ValueError(f"mode must be one of {', '.join(OCR_MODES)}")
+    settings = ocr_settings(dpi, settings)
+
+    native = None
+    if mode != "ocr":
+        try:
+            native = native_page_texts(pdf_path)
+        except (OSError, subprocess.CalledProcessError) as e:
+            if mode == "native":
+                raise
+            print(f"Could not read text layer, falling back to OCR: {str(e)}")
+
+    if native is None:
+        page_count = pdf_page_count(pdf_path)
+        missing = list(range(1, page_count + 1))
+    else:
+        page_count = len(native)
+        missing = [] if mode == "native" else [i + 1 for i, text in enumerate(native) if not has_text_layer(text)]
+    if mode == "auto":
+        print(f"{page_count - len(missing)} of {page_count} pages have a text layer, OCR'ing {len(missing)}")
+
+    missing_set = set(missing)
+    ready = {i + 1: (text, "native", False) for i, text in enumerate(native or []) if i + 1 not in missing_set}
+
+    if not OCR_CACHE_ENABLED:
+        content_hash = None
+    elif content_hash is None and missing:
+        content_hash = file_sha256(pdf_path)
+    variant = settings_key(settings)
+    cached = get_cached_pages(content_hash, variant, OCR_LANG, missing) if content_hash and missing else {}
+    if missing:
+        print(f"{len(cached)} of {len(missing)} pages found in the OCR cache")
+    for page_number, text in cached.items():
+        ready[page_number] = (text, "ocr", True)
+
+    return {
+        "page_count": page_count,
+        "settings": settings,
+        "content_hash": content_hash,
+        "variant": variant,
+        "ready": ready,
+        "todo": [page_number for page_number in missing if page_number not in cached],
+    }
+
+def iter_document(pdf_path: str, dpi: int = 300, mode: str = "auto", workers: Optional[int] = None,
+                  content_hash: Optional[str] = None, settings: Optional[dict] = None):
+    """
+    Yield each page of a PDF as soon as its text is available:
+    {"page": n, "page_count": total, "source": "native" | "ocr", "cached": bool, "text": ...}
+
+    Pages with a text layer and OCR cache hits come first, then freshly
+    OCR'd pages as they finish, so pages are not necessarily in order.
+    Arguments are as for extract_document. Apart from pages that needed no
+    OCR, only one page's text is held here at a time.
+    """
+    plan = plan_document(pdf_path, dpi, mode, content_hash, settings)
+    page_count = plan["page_count"]
+    ready = plan.pop("ready")
+    for page_number in sorted(ready):
+        text, source, cached = ready.pop(page_number)
+        yield {"page": page_number, "page_count": page_count, "source": source, "cached": cached, "text": text}
+
+    if plan["todo"]:
+        for page_number, text in iter_extract_pages(pdf_path, plan["todo"], plan["settings"], workers):
+            if plan["content_hash"]:
+                store_pages(plan["content_hash"], plan["variant"], OCR_LANG, {page_number: text})
+            yield {"page": page_number, "page_count": page_count, "source": "ocr", "cached": False, "text": text}
+
+def extract_document(pdf_path: str, dpi: int = 300, mode: str = "auto",
+                     progress_callback: Optional[Callable[[int, int], None]] = None,
+                     workers: Optional[int] = None, content_hash: Optional[str] = None,
+                     settings: Optional[dict] = None) -> dict:
+    """
+    Extract the text of every page of a PDF.
+
+    Args:
+        pdf_path: Path to the PDF file
+        dpi: Resolution for pages that are OCR'd (default: 300)
+        mode: "auto" reads the embedded text layer and only OCRs pages without
+            one, "native" only reads the text layer, "ocr" OCRs every page
+        progress_callback: Called as progress_callback(pages_done, total_pages)
+        workers: Page worker processes for OCR
+        content_hash: SHA-256 of the file if already known (see spool_pdf)
+        settings: Overrides for DEFAULT_OCR_SETTINGS (preprocessing, adaptive DPI)
+
+    Returns:
+        {"pages": [text, ...], "sources": ["native" | "ocr", ...], "cached_pages": n}
+        with pages in page order; cached_pages counts OCR pages served from
+        the OCR cache
+    """
+    texts = []
+    sources = []
+    cached_pages = 0
+    for done, event in enumerate(iter_document(pdf_path, dpi, mode, workers, content_hash, settings), start=1):
+        if not texts:
+            texts = [""] * event["page_count"]
+            sources = ["native"] * event["page_count"]
+        texts[event["page"] - 1] = event["text"]
+        sources[event["page"] - 1] = event["source"]
+        cached_pages += event["cached"]
+        if progress_callback:
+            progress_callback(done, event["page_count"])
+    return {"pages": texts, "sources": sources, "cached_pages": cached_pages}
+
+def summarize_sources(sources: List[str], cached_pages: int = 0) -> dict:
+    """Which extraction path each page took, for API responses."""
+    return {
+        "pages": [{"page": i + 1, "source": source} for i, source in enumerate(sources)],
+        "native_pages": sources.count("native"),
+        "ocr_pages": sources.count("ocr"),
+        "cached_pages": cached_pages,
+    }
+
+def format_pages(texts: List[str]) -> str:
+    """Join page texts into the '--- Page N ---' layout returned by the OCR endpoints."""
+    return ''.join(f"--- Page {i+1} ---\n{text}\n\n" for i, text in enumerate(texts))
+
+def extract_text_from_pdf(pdf_path: str, dpi: int = 300, progress_callback: Optional[Callable[[int, int], None]] = None,
+                          mode: str = "auto") -> str:
+    """
+    Extract text from a PDF file, using OCR for pages without a text layer.
+
     Args:
         pdf_path: Path to the PDF file
         dpi: Resolution for PDF to image conversion (default: 300)
-        
+        progress_callback: Called as progress_callback(pages_done, total_pages)
+        mode: "auto", "native" or "ocr" (see extract_document)
+
     Returns:
         Extracted text as a string
     """
     try:
-        print(f"Processing PDF: {pdf_path}")
-        
-        # Convert PDF to images with a lower DPI for faster processing
-        pages = convert_from_path(pdf_path, dpi)
-        print(f"Converted PDF to {len(pages)} images")
-        
-        # Extract text from each page
-        text_data = ''
-        for i, page in enumerate(pages):
-            print(f"Processing page {i+1}/{len(pages)}")
-            text = pytesseract.image_to_string(page)
-            text_data += f"--- Page {i+1} ---\n{text}\n\n"
-            
-        return text_data
+        return format_pages(extract_document(pdf_path, dpi, mode, progress_callback)["pages"])
     except Exception as e:
         print(f"Error extracting text from PDF: {str(e)}")
         return f"Error processing PDF: {str(e)}"
@@ -37,33 +589,20 @@ def extract_text_from_pdf(pdf_path: str, dpi: int = 300) -> str:
 def extract_text_from_pdf_bytes(pdf_bytes: bytes, dpi: int = 300) -> str:
     """
     Extract text from PDF bytes using OCR.
-    
+
     Args:
         pdf_bytes: PDF content as bytes
         dpi: Resolution for PDF to image conversion (default: 300)
-        
+
     Returns:
         Extracted text as a string
     """
     try:
-        # Create a temporary file with a proper name
-        fd, temp_path = tempfile.mkstemp(suffix='.pdf')
-        os.close(fd)
-        
-        # Write the bytes to the temporary file
-        with open(temp_path, "wb") as f:
-            f.write(pdf_bytes)
-        
-        print(f"Created temporary file at {temp_path}")
-        
-        # Extract text
-        text = extract_text_from_pdf(temp_path, dpi)
-        
-        # Clean up
-        os.remove(temp_path)
-        print(f"Removed temporary file {temp_path}")
-            
-        return text
+        # Poppler needs a path; the scratch file lives in RAM where possible
+        # and is removed even if extraction fails
+        with spooled_pdf(pdf_bytes) as (pdf_path, content_hash):
+            document = extract_document(pdf_path, dpi, content_hash=content_hash)
+        return format_pages(document["pages"])
     except Exception as e:
         print(f"Error extracting text from PDF bytes: {str(e)}")
-        return f"Error processing PDF bytes: {str(e)}"
\ No newline at end of file
+        return f"Error processing PDF bytes: {str(e)}"
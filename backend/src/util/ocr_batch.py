@@ -0,0 +1,254 @@
+import os
+import zipfile
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional
+
+from util.ocr import (plan_document, spool_pdf, format_pages, summarize_sources, default_ocr_workers,
+                      _init_page_worker, _ocr_page, OCR_LANG)
+from util.ocr_cache import store_pages
+from util.db import add_case_items
+from util.search_index import index_documents, document_entry
+from bson.objectid import ObjectId
+
+# Batch OCR: many PDFs in one request. Identical files are OCR'd once, and the
+# pages still needing OCR are fed to one shared process pool round-robin
+# across documents, so a 200-page scan can't hold back the 2-page letters
+# queued behind it. Each document is reported as soon as its last page is in.
+
+OCR_BATCH_MAX_FILES = int(os.getenv("OCR_BATCH_MAX_FILES", 50))
+OCR_BATCH_WORKERS = int(os.getenv("OCR_BATCH_WORKERS", default_ocr_workers()))
+# Finished documents are written to a case this many at a time
+OCR_BATCH_WRITE_SIZE = int(os.getenv("OCR_BATCH_WRITE_SIZE", 10))
+
+# Pages queued on the pool per worker; keeps the pool busy without letting one
+# batch queue all of its pages ahead of other requests sharing the pool
+OCR_BATCH_PAGES_IN_FLIGHT = 2
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=OCR_BATCH_WORKERS, initializer=_init_page_worker)
+        return _pool
+
+
+def _drop_pool(pool: ProcessPoolExecutor):
+    # A dead worker breaks the whole pool; the next batch starts a new one
+    global _pool
+    with _pool_lock:
+        if _pool is not pool:
+            return
+        _pool = None
+    pool.shutdown(wait=False)
+
+
+def spool_zip(source) -> List[dict]:
+    """
+    Spool every PDF in a zip archive to scratch files.
+
+    Returns [{"filename", "path", "content_hash"}]; the caller removes the files.
+    Raises ValueError if the archive holds more than OCR_BATCH_MAX_FILES PDFs.
+    """
+    documents = []
+    try:
+        with zipfile.ZipFile(source) as archive:
+            members = [info for info in archive.infolist()
+                       if not info.is_dir() and info.filename.lower().endswith(".pdf")
+                       and not os.path.basename(info.filename).startswith(".")]
+            if len(members) > OCR_BATCH_MAX_FILES:
+                raise ValueError(f"At most {OCR_BATCH_MAX_FILES} PDFs can be processed in one batch")
+            for info in members:
+                with archive.open(info) as member:
+                    path, content_hash = spool_pdf(member)
+                documents.append({"filename": info.filename, "path": path, "content_hash": content_hash})
+    except Exception:
+        remove_spooled(documents)
+        raise
+    return documents
+
+
+def remove_spooled(documents: List[dict]):
+    for document in documents:
+        if os.path.exists(document["path"]):
+            os.remove(document["path"])
+
+
+class CaseDocumentWriter:
+    """
+    Stores finished batch results as a case's documents, OCR_BATCH_WRITE_SIZE
+    at a time, and indexes the ones written.
+
+    add() and flush() return the results whose bulk write just went through,
+    each with "stored" set to whether it was actually written, so callers
+    only report a document once they know.
+    """
+
+    def __init__(self, user_id, case_id: str):
+        self.user_id = user_id
+        self.case_id = case_id
+        self.stored = 0
+        self._pending = []
+
+    def add(self, result: dict, **fields) -> List[dict]:
+        """Queue a successful result; fields are extra keys for the stored document."""
+        self._pending.append((result, dict({
+            "_id": ObjectId(),
+            "filename": result["filename"],
+            "content_hash": result["content_hash"],
+            "text": result["text"],
+            "page_count": result["page_count"],
+        }, **fields)))
+        if len(self._pending) >= OCR_BATCH_WRITE_SIZE:
+            return self.flush()
+        return []
+
+    def flush(self) -> List[dict]:
+        if not self._pending:
+            return []
+        writes = [write for _, write in self._pending]
+        ids = set(add_case_items(self.user_id, self.case_id, "documents", writes))
+        self.stored += len(ids)
+        index_documents(document_entry(self.user_id, self.case_id, write["_id"], write)
+                        for write in writes if write["_id"] in ids)
+        results = [dict(result, stored=write["_id"] in ids) for result, write in self._pending]
+        self._pending = []
+        return results
+
+
+def _round_robin(entries: List[dict]):
+    # One page from each document in turn, skipping documents that failed
+    queues = [(entry, deque(entry["todo"])) for entry in entries if entry["todo"]]
+    while queues:
+        for entry, queue in queues:
+            if queue and entry["error"] is None:
+                yield entry, queue.popleft()
+        queues = [(entry, queue) for entry, queue in queues if queue and entry["error"] is None]
+
+
+def _result(entry: dict) -> dict:
+    result = {
+        "filename": entry["filename"],
+        "filenames": entry["filenames"],
+        "content_hash": entry["content_hash"],
+    }
+    if entry["error"] is not None:
+        return dict(result, error=entry["error"], success=False)
+    pages = entry["pages"]
+    texts = [pages[page_number] for page_number in sorted(pages)]
+    sources = [entry["sources"][page_number] for page_number in sorted(pages)]
+    return dict(result, **summarize_sources(sources, entry["cached_pages"]), page_count=entry["page_count"],
+                text=format_pages(texts), success=True)
+
+
+def iter_batch(documents: List[dict], dpi: int = 300, mode: str = "auto", settings: Optional[dict] = None):
+    """
+    OCR several PDFs on the shared pool and yield one result per distinct file
+    as soon as it is finished, in completion order.
+
+    Args:
+        documents: [{"filename", "path", "content_hash"}] as returned by
+                   spool_pdf / spool_zip. Files with the same content hash are
+                   processed once and reported together under "filenames".
+        dpi, mode, settings: as for extract_document
+
+    Yields:
+        {"filename", "filenames", "content_hash", "text", "page_count",
+        "native_pages", "ocr_pages", "cached_pages", "success": True}, or
+        {"filename", "filenames", "content_hash", "error", "success": False}
+    """
+    entries = {}
+    for document in documents:
+        key = document.get("content_hash") or document["path"]
+        if key in entries:
+            entries[key]["filenames"].append(document["filename"])
+            continue
+        entries[key] = {
+            "filename": document["filename"],
+            "filenames": [document["filename"]],
+            "path": document["path"],
+            "content_hash": document.get("content_hash"),
+            "error": None,
+        }
+    if len(entries) < len(documents):
+        print(f"Batch OCR: {len(documents) - len(entries)} duplicate files skipped")
+
+    # Text layers and cache hits need no pool time, so those documents finish first
+    pending = []
+    for entry in entries.values():
+        try:
+            plan = plan_document(entry["path"], dpi, mode, entry["content_hash"], settings)
+        except Exception as e:
+            print(f"Batch OCR: could not read {entry['filename']}: {str(e)}")
+            entry["error"] = str(e)
+            yield _result(entry)
+            continue
+        entry.update(plan)
+        entry["pages"] = {page_number: text for page_number, (text, _, _) in plan["ready"].items()}
+        entry["sources"] = {page_number: source for page_number, (_, source, _) in plan["ready"].items()}
+        entry["cached_pages"] = sum(1 for _, _, cached in plan["ready"].values() if cached)
+        entry["remaining"] = len(plan["todo"])
+        del entry["ready"]
+        if entry["remaining"]:
+            pending.append(entry)
+        else:
+            yield _result(entry)
+
+    if not pending:
+        return
+    print(f"Batch OCR: {sum(entry['remaining'] for entry in pending)} pages "
+          f"across {len(pending)} documents with {OCR_BATCH_WORKERS} workers")
+
+    pool = _get_pool()
+    tasks = _round_robin(pending)
+    in_flight = {}
+    try:
+        while True:
+            # Top up the pool, then wait for whichever page finishes first
+            while len(in_flight) < OCR_BATCH_WORKERS * OCR_BATCH_PAGES_IN_FLIGHT:
+                task = next(tasks, None)
+                if task is None:
+                    break
+                entry, page_number = task
+                try:
+                    future = pool.submit(_ocr_page, entry["path"], page_number, entry["settings"])
+                except BrokenProcessPool:
+                    _drop_pool(pool)
+                    raise
+                in_flight[future] = task
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                entry, page_number = in_flight.pop(future)
+                entry["remaining"] -= 1
+                if entry["error"] is None:
+                    try:
+                        text = future.result()
+                    except Exception as e:
+                        if isinstance(e, BrokenProcessPool):
+                            _drop_pool(pool)
+                        print(f"Batch OCR: page {page_number} of {entry['filename']} failed: {str(e)}")
+                        entry["error"] = f"Page {page_number}: {str(e)}"
+                    else:
+                        entry["pages"][page_number] = text
+                        entry["sources"][page_number] = "ocr"
+                        if entry["content_hash"]:
+                            store_pages(entry["content_hash"], entry["variant"], OCR_LANG, {page_number: text})
+                # A failed document is reported once its queued pages drain
+                if entry["remaining"] == 0 or (entry["error"] is not None and
+                                               not any(e is entry for e, _ in in_flight.values())):
+                    if not entry.get("reported"):
+                        entry["reported"] = True
+                        yield _result(entry)
+                        entry["pages"] = {}
+    finally:
+        # If the client goes away, don't leave its pages queued on the shared pool
+        for future in in_flight:
+            future.cancel()
@@ -0,0 +1,91 @@
+"""
+Compare OCR settings on a folder of scanned PDFs with known text.
+
+Every <name>.pdf in the corpus folder needs a <name>.txt holding its expected
+text. Each preset OCRs the whole corpus and reports pages/sec and character
+accuracy. Run from the backend/src directory:
+
+    python -m util.ocr_benchmark path/to/corpus [preset ...]
+"""
+import os
+import sys
+import time
+from difflib import SequenceMatcher
+
+# Benchmark real OCR, not the cache
+os.environ["OCR_CACHE_ENABLED"] = "0"
+
+from util.ocr import extract_document, ADAPTIVE_START_DPI
+
+PRESETS = {
+    "fast": {"dpi": 150},
+    "default": {"dpi": 300},
+    "adaptive": {"dpi": ADAPTIVE_START_DPI, "adaptive": True},
+    "binarized": {"dpi": 300, "binarize": True},
+    "cleaned": {"dpi": 300, "binarize": True, "deskew": True},
+    "cleaned-adaptive": {"dpi": ADAPTIVE_START_DPI, "adaptive": True, "binarize": True, "deskew": True},
+}
+
+
+def _normalize(text: str) -> str:
+    lines = [line for line in text.splitlines() if not line.startswith("--- Page ")]
+    return " ".join(" ".join(lines).split())
+
+
+def character_accuracy(expected: str, actual: str) -> float:
+    expected, actual = _normalize(expected), _normalize(actual)
+    if not expected:
+        return 1.0 if not actual else 0.0
+    return SequenceMatcher(None, expected, actual, autojunk=False).ratio()
+
+
+def load_corpus(folder: str) -> list:
+    corpus = []
+    for name in sorted(os.listdir(folder)):
+        if not name.lower().endswith(".pdf"):
+            continue
+        truth_path = os.path.join(folder, name[:-4] + ".txt")
+        if not os.path.exists(truth_path):
+            print(f"Skipping {name}: no {name[:-4]}.txt")
+            continue
+        with open(truth_path, "r", encoding="utf-8") as f:
+            corpus.append((os.path.join(folder, name), f.read()))
+    return corpus
+
+
+def run_preset(corpus: list, settings: dict) -> dict:
+    pages = 0
+    accuracy = 0.0
+    start = time.perf_counter()
+    for pdf_path, expected in corpus:
+        document = extract_document(pdf_path, mode="ocr", settings=settings)
+        pages += len(document["pages"])
+        accuracy += character_accuracy(expected, "\n".join(document["pages"]))
+    elapsed = time.perf_counter() - start
+    return {
+        "pages": pages,
+        "seconds": round(elapsed, 2),
+        "pages_per_second": round(pages / elapsed, 3) if elapsed else 0.0,
+        "character_accuracy": round(accuracy / len(corpus), 4) if corpus else 0.0,
+    }
+
+
+def main(argv):
+    if not argv:
+        print(__doc__)
+        return 2
+    corpus = load_corpus(argv[0])
+    if not corpus:
+        print("No PDFs with expected text found")
+        return 1
+    names = argv[1:] or list(PRESETS)
+    print(f"{'preset':<18} {'pages':>6} {'seconds':>9} {'pages/s':>9} {'accuracy':>9}")
+    for name in names:
+        result = run_preset(corpus, PRESETS[name])
+        print(f"{name:<18} {result['pages']:>6} {result['seconds']:>9} "
+              f"{result['pages_per_second']:>9} {result['character_accuracy']:>9}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,188 @@
+import os
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Dict, List
+
+import pytesseract
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: size accounting is then only shared between threads
+    fcntl = None
+
+# Content-addressed cache of OCR'd page text. Entries are keyed by the PDF's
+# SHA-256 plus everything that changes Tesseract's output (the OCR settings
+# variant -- DPI and preprocessing --, language and Tesseract version), one
+# small file per page:
+#
+#   <OCR_CACHE_DIR>/<sha[:2]>/<sha>/<variant>-<lang>-<version>/<page>.txt
+#
+# Reads bump the file's mtime, and once the cache grows past OCR_CACHE_MAX_MB
+# the least recently used pages are deleted. Every process using the cache dir
+# (app workers, OCR job workers) keeps the running total in <OCR_CACHE_DIR>/.size
+# under a file lock, so the budget holds across all of them.
+
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "tender-ocr-cache")
+OCR_CACHE_MAX_MB = int(os.getenv("OCR_CACHE_MAX_MB", 512))
+OCR_CACHE_ENABLED = os.getenv("OCR_CACHE_ENABLED", "1") != "0"
+
+_lock = threading.Lock()
+_stats = {"page_hits": 0, "page_misses": 0, "document_hits": 0, "documents": 0, "writes": 0, "evictions": 0}
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=1)
+def tesseract_version() -> str:
+    try:
+        return str(pytesseract.get_tesseract_version())
+    except Exception:
+        return "unknown"
+
+
+def _variant_dir(content_hash: str, variant, lang: str) -> str:
+    name = f"{variant}-{lang.replace('+', '_')}-{tesseract_version()}"
+    return os.path.join(OCR_CACHE_DIR, content_hash[:2], content_hash, name)
+
+
+def _page_path(content_hash: str, variant, lang: str, page_number: int) -> str:
+    return os.path.join(_variant_dir(content_hash, variant, lang), f"{page_number}.txt")
+
+
+def _iter_cache_files():
+    for root, _, files in os.walk(OCR_CACHE_DIR):
+        for name in files:
+            if not name.endswith(".txt"):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            yield path, stat
+
+
+@contextmanager
+def _size_lock():
+    # Serializes writes, size accounting and eviction across threads and processes
+    with _lock:
+        os.makedirs(OCR_CACHE_DIR, exist_ok=True)
+        with open(os.path.join(OCR_CACHE_DIR, ".lock"), "a") as lock_file:
+            if fcntl is not None:
+                # Released when the file is closed
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+
+def _read_size() -> int:
+    # Caller holds _size_lock. Rebuilt from a walk if the file is missing.
+    try:
+        with open(os.path.join(OCR_CACHE_DIR, ".size"), "r") as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return sum(stat.st_size for _, stat in _iter_cache_files())
+
+
+def _write_size(size: int):
+    # Caller holds _size_lock
+    temp_path = os.path.join(OCR_CACHE_DIR, f".size.{os.getpid()}")
+    with open(temp_path, "w") as f:
+        f.write(str(size))
+    os.replace(temp_path, os.path.join(OCR_CACHE_DIR, ".size"))
+
+
+def _evict() -> int:
+    # Caller holds _size_lock. Delete least recently used pages down to 90% of
+    # the budget and return the new size, recounted from the directory.
+    budget = OCR_CACHE_MAX_MB * 1024 * 1024
+    files = sorted(_iter_cache_files(), key=lambda item: item[1].st_mtime)
+    size = sum(stat.st_size for _, stat in files)
+    for path, stat in files:
+        if size <= budget * 0.9:
+            break
+        try:
+            os.remove(path)
+            size -= stat.st_size
+            _stats["evictions"] += 1
+        except OSError:
+            pass
+    return size
+
+
+def get_cached_pages(content_hash: str, variant, lang: str, page_numbers: List[int]) -> Dict[int, str]:
+    """Return {page_number: text} for the requested pages that are cached."""
+    if not OCR_CACHE_ENABLED or not page_numbers:
+        return {}
+    found = {}
+    for page_number in page_numbers:
+        path = _page_path(content_hash, variant, lang, page_number)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                found[page_number] = f.read()
+            os.utime(path)
+        except OSError:
+            continue
+    with _lock:
+        _stats["documents"] += 1
+        _stats["page_hits"] += len(found)
+        _stats["page_misses"] += len(page_numbers) - len(found)
+        if len(found) == len(page_numbers):
+            _stats["document_hits"] += 1
+    return found
+
+
+def store_pages(content_hash: str, variant, lang: str, pages: Dict[int, str]):
+    """Write {page_number: text} to the cache, then evict if over budget."""
+    if not OCR_CACHE_ENABLED or not pages:
+        return
+    directory = _variant_dir(content_hash, variant, lang)
+    with _size_lock():
+        size = _read_size()
+        try:
+            os.makedirs(directory, exist_ok=True)
+            for page_number, text in pages.items():
+                path = os.path.join(directory, f"{page_number}.txt")
+                try:
+                    # Overwriting a page only adds the difference
+                    size -= os.path.getsize(path)
+                except OSError:
+                    pass
+                # Write then rename so readers never see a partial page
+                fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    f.write(text)
+                os.replace(temp_path, path)
+                size += os.path.getsize(path)
+                _stats["writes"] += 1
+        except OSError as e:
+            print(f"Could not write OCR cache: {str(e)}")
+        if size > OCR_CACHE_MAX_MB * 1024 * 1024:
+            size = _evict()
+        _write_size(size)
+
+
+def get_cache_stats() -> dict:
+    """Hit/miss counters for this process plus the cache's size on disk."""
+    if OCR_CACHE_ENABLED:
+        with _size_lock():
+            stats = dict(_stats)
+            stats["size_bytes"] = _read_size()
+    else:
+        with _lock:
+            stats = dict(_stats)
+        stats["size_bytes"] = 0
+    lookups = stats["page_hits"] + stats["page_misses"]
+    stats["page_hit_rate"] = round(stats["page_hits"] / lookups, 3) if lookups else 0.0
+    stats["max_bytes"] = OCR_CACHE_MAX_MB * 1024 * 1024
+    stats["enabled"] = OCR_CACHE_ENABLED
+    return stats
@@ -0,0 +1,274 @@
+import os
+import time
+import uuid
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from util.ocr import (plan_document, iter_extract_pages, format_pages, summarize_sources, default_ocr_workers,
+                      OCR_LANG)
+from util.ocr_cache import store_pages
+
+# Background OCR jobs. Uploads are queued here and OCR'd by a bounded process
+# pool so the Flask worker that received the file can return immediately.
+# Everything lives in this process: no external broker is needed. A job is
+# planned on a thread here (text layer and OCR cache reads), only the pages
+# left to OCR go to the pool, and their text is cached here once they're back,
+# so the OCR cache is only ever read and written by this process.
+
+OCR_JOB_WORKERS = int(os.getenv("OCR_JOB_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+OCR_JOB_QUEUE_LIMIT = int(os.getenv("OCR_JOB_QUEUE_LIMIT", 32))
+OCR_JOBS_PER_USER = int(os.getenv("OCR_JOBS_PER_USER", 4))
+OCR_JOB_RESULT_TTL_SECONDS = int(os.getenv("OCR_JOB_RESULT_TTL_SECONDS", 3600))
+
+# Jobs run side by side, so each one gets its share of the page workers
+PAGE_WORKERS_PER_JOB = max(1, default_ocr_workers() // OCR_JOB_WORKERS)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class OCRQueueFull(Exception):
+    """Raised when a job is rejected because of the queue or per-user limits."""
+
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+_executor = None
+_executor_lock = threading.Lock()
+_progress_queue = None
+# Threads are started on demand
+_planner = ThreadPoolExecutor(max_workers=OCR_JOB_WORKERS)
+
+# Set in each pool worker by _init_worker
+_worker_progress_queue = None
+
+
+def _init_worker(progress_queue):
+    global _worker_progress_queue
+    _worker_progress_queue = progress_queue
+
+
+def _ocr_job_pages(job_id: str, pdf_path: str, page_numbers: list, settings: dict) -> dict:
+    """Runs in a pool worker. OCRs the pages the plan left and returns {page_number: text}."""
+    texts = {}
+    for page_number, text in iter_extract_pages(pdf_path, page_numbers, settings, PAGE_WORKERS_PER_JOB):
+        texts[page_number] = text
+        _worker_progress_queue.put((job_id, len(texts)))
+    return texts
+
+
+def _listen_for_progress(progress_queue):
+    while True:
+        message = progress_queue.get()
+        if message is None:
+            # The pool this queue belonged to was dropped
+            return
+        job_id, done = message
+        with _jobs_lock:
+            job = _jobs.get(job_id)
+            if job is not None and job["status"] in (QUEUED, RUNNING):
+                job["status"] = RUNNING
+                job["started_at"] = job["started_at"] or time.time()
+                job["pages_done"] = job["pages_ready"] + done
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor, _progress_queue
+    # Without the lock, two first submissions at once would each start a pool and a listener
+    with _executor_lock:
+        if _executor is None:
+            _progress_queue = multiprocessing.Queue()
+            _executor = ProcessPoolExecutor(
+                max_workers=OCR_JOB_WORKERS,
+                initializer=_init_worker,
+                initargs=(_progress_queue,),
+            )
+            threading.Thread(target=_listen_for_progress, args=(_progress_queue,), daemon=True).start()
+        return _executor
+
+
+def _drop_executor(executor: ProcessPoolExecutor):
+    # A worker died (e.g. tesseract OOM-killed), which breaks the whole pool:
+    # every later submit would raise. Forget it so the next job starts a new one.
+    global _executor, _progress_queue
+    with _executor_lock:
+        if _executor is not executor:
+            return
+        _progress_queue.put(None)
+        _executor = None
+        _progress_queue = None
+    executor.shutdown(wait=False)
+
+
+def _prune_finished_jobs():
+    # Caller holds _jobs_lock
+    cutoff = time.time() - OCR_JOB_RESULT_TTL_SECONDS
+    expired = [job_id for job_id, job in _jobs.items()
+               if job["status"] in (DONE, FAILED) and job["finished_at"] < cutoff]
+    for job_id in expired:
+        del _jobs[job_id]
+
+
+def _remove_upload(pdf_path: str):
+    if os.path.exists(pdf_path):
+        os.remove(pdf_path)
+
+
+def _fail_job(job_id: str, pdf_path: str, error: Exception):
+    print(f"OCR job {job_id} failed: {str(error)}")
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is not None:
+            job["status"] = FAILED
+            job["error"] = str(error)
+            job["finished_at"] = time.time()
+    _remove_upload(pdf_path)
+
+
+def _finish_job(job_id: str, pdf_path: str, plan: dict, ready: dict, texts: dict):
+    try:
+        if plan["content_hash"] and texts:
+            store_pages(plan["content_hash"], plan["variant"], OCR_LANG, texts)
+        pages = [""] * plan["page_count"]
+        sources = ["native"] * plan["page_count"]
+        cached_pages = 0
+        for page_number, (text, source, cached) in ready.items():
+            pages[page_number - 1] = text
+            sources[page_number - 1] = source
+            cached_pages += cached
+        for page_number, text in texts.items():
+            pages[page_number - 1] = text
+            sources[page_number - 1] = "ocr"
+        result = dict(summarize_sources(sources, cached_pages), text=format_pages(pages))
+    except Exception as e:
+        _fail_job(job_id, pdf_path, e)
+        return
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is not None:
+            job["result"] = result
+            job["status"] = DONE
+            job["pages_done"] = job["pages_total"]
+            job["finished_at"] = time.time()
+            # Jobs served entirely from the text layer or cache never reach the pool
+            job["started_at"] = job["started_at"] or job["finished_at"]
+    _remove_upload(pdf_path)
+
+
+def _on_pages_done(job_id: str, pdf_path: str, plan: dict, ready: dict, executor, future):
+    try:
+        texts = future.result()
+    except Exception as e:
+        if isinstance(e, BrokenProcessPool):
+            _drop_executor(executor)
+        _fail_job(job_id, pdf_path, e)
+        return
+    _finish_job(job_id, pdf_path, plan, ready, texts)
+
+
+def _start_job(job_id: str, pdf_path: str, dpi: int, mode: str, content_hash: Optional[str],
+               settings: Optional[dict]):
+    """Runs on a planner thread: plan the document, then queue the pages left to OCR on the pool."""
+    try:
+        plan = plan_document(pdf_path, dpi, mode, content_hash, settings)
+        ready = plan.pop("ready")
+        with _jobs_lock:
+            job = _jobs.get(job_id)
+            if job is not None:
+                job["pages_total"] = plan["page_count"]
+                job["pages_ready"] = job["pages_done"] = len(ready)
+        if not plan["todo"]:
+            _finish_job(job_id, pdf_path, plan, ready, {})
+            return
+        executor = _get_executor()
+        try:
+            future = executor.submit(_ocr_job_pages, job_id, pdf_path, plan["todo"], plan["settings"])
+        except BrokenProcessPool:
+            _drop_executor(executor)
+            raise
+        future.add_done_callback(lambda f: _on_pages_done(job_id, pdf_path, plan, ready, executor, f))
+    except Exception as e:
+        _fail_job(job_id, pdf_path, e)
+
+
+def submit_ocr_job(owner: str, pdf_path: str, filename: str, dpi: int = 300, mode: str = "auto",
+                   content_hash: Optional[str] = None, settings: Optional[dict] = None) -> str:
+    """
+    Queue a PDF for OCR and return its job id.
+
+    The job takes ownership of pdf_path and deletes it when finished.
+    Raises OCRQueueFull if the global queue or the owner's job limit is reached.
+    """
+    with _jobs_lock:
+        _prune_finished_jobs()
+        active = [job for job in _jobs.values() if job["status"] in (QUEUED, RUNNING)]
+        if len(active) >= OCR_JOB_QUEUE_LIMIT:
+            raise OCRQueueFull("OCR queue is full, try again later")
+        if sum(1 for job in active if job["owner"] == owner) >= OCR_JOBS_PER_USER:
+            raise OCRQueueFull(f"At most {OCR_JOBS_PER_USER} OCR jobs can run at once per user")
+
+        job_id = uuid.uuid4().hex
+        _jobs[job_id] = {
+            "job_id": job_id,
+            "owner": owner,
+            "filename": filename,
+            "status": QUEUED,
+            "pages_done": 0,
+            "pages_ready": 0,
+            "pages_total": None,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None,
+        }
+
+    try:
+        _planner.submit(_start_job, job_id, pdf_path, dpi, mode, content_hash, settings)
+    except Exception:
+        # Never queued, so it must not count against the limits
+        with _jobs_lock:
+            _jobs.pop(job_id, None)
+        raise
+    return job_id
+
+
+def get_ocr_job(job_id: str, owner: Optional[str] = None) -> Optional[dict]:
+    """Return a copy of a job (None if unknown or owned by someone else)."""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is None or (owner is not None and job["owner"] != owner):
+            return None
+        return dict(job)
+
+
+def job_status(job: dict) -> dict:
+    """Public view of a job, without its result text."""
+    return {
+        "job_id": job["job_id"],
+        "filename": job["filename"],
+        "status": job["status"],
+        "progress": {"pages_done": job["pages_done"], "pages_total": job["pages_total"]},
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+    }
+
+
+def get_queue_stats() -> dict:
+    with _jobs_lock:
+        counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+        for job in _jobs.values():
+            counts[job["status"]] += 1
+    return {
+        "workers": OCR_JOB_WORKERS,
+        "queue_limit": OCR_JOB_QUEUE_LIMIT,
+        "per_user_limit": OCR_JOBS_PER_USER,
+        "jobs": counts,
+    }
@@ -0,0 +1,264 @@
+import os
+import re
+import sqlite3
+import threading
+from typing import Iterable, List, Optional
+
+from util.db import (get_mongo_client, get_cases_collection, get_case_child_collection, get_emails_collection,
+                     get_email_bodies)
+
+# Local full-text search over case summaries, OCR'd documents and emails,
+# kept in a SQLite FTS5 index next to the app. Writers call index_documents
+# as they store text, so the index stays current without rescans; rebuild()
+# backfills it from Mongo. Every entry belongs to a lawyer and every search
+# is scoped to one.
+#
+# Entry kinds: "case" (name + summary), "document" (OCR text attached to a
+# case), "case_email" (email attached to a case) and "email" (the lawyer's
+# synced mailbox).
+
+# Kept under backend/data by default so the index survives restarts
+SEARCH_INDEX_PATH = os.getenv("SEARCH_INDEX_PATH") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "data", "search-index.sqlite3")
+SEARCH_INDEX_ENABLED = os.getenv("SEARCH_INDEX_ENABLED", "1") != "0"
+SEARCH_KINDS = ("case", "document", "case_email", "email")
+MAX_SEARCH_RESULTS = 100
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    ref_id TEXT NOT NULL,
+    case_id TEXT,
+    UNIQUE (user_id, kind, ref_id)
+);
+CREATE INDEX IF NOT EXISTS entries_case_id ON entries (case_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(title, body, tokenize='porter unicode61');
+"""
+
+
+def _connection() -> sqlite3.Connection:
+    # sqlite3 connections can't be shared between threads, so keep one per thread
+    global _schema_ready
+    connection = getattr(_local, "connection", None)
+    if connection is None:
+        directory = os.path.dirname(SEARCH_INDEX_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(SEARCH_INDEX_PATH, timeout=30)
+        # WAL lets searches run while another thread is indexing
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        with _schema_lock:
+            if not _schema_ready:
+                connection.executescript(_SCHEMA)
+                _schema_ready = True
+        _local.connection = connection
+    return connection
+
+
+def index_documents(entries: Iterable[dict]) -> int:
+    """
+    Add or replace entries in one transaction. Each entry is
+    {"user_id", "kind", "ref_id", "title", "body", "case_id" (optional)}.
+    Returns how many were written (0 if indexing is disabled or fails).
+    """
+    if not SEARCH_INDEX_ENABLED:
+        return 0
+    count = 0
+    try:
+        connection = _connection()
+        with connection:
+            for entry in entries:
+                key = (str(entry["user_id"]), entry["kind"], str(entry["ref_id"]))
+                case_id = str(entry["case_id"]) if entry.get("case_id") else None
+                row = connection.execute(
+                    "SELECT id FROM entries WHERE user_id = ? AND kind = ? AND ref_id = ?", key).fetchone()
+                if row is None:
+                    rowid = connection.execute(
+                        "INSERT INTO entries (user_id, kind, ref_id, case_id) VALUES (?, ?, ?, ?)",
+                        key + (case_id,)).lastrowid
+                else:
+                    rowid = row[0]
+                    connection.execute("UPDATE entries SET case_id = ? WHERE id = ?", (case_id, rowid))
+                    connection.execute("DELETE FROM entries_fts WHERE rowid = ?", (rowid,))
+                connection.execute("INSERT INTO entries_fts (rowid, title, body) VALUES (?, ?, ?)",
+                                   (rowid, entry.get("title") or "", entry.get("body") or ""))
+                count += 1
+        return count
+    except Exception as e:
+        print("index_documents")
+        print(e)
+        return 0
+
+
+def index_document(user_id, kind: str, ref_id, title: str, body: str, case_id=None) -> bool:
+    return index_documents([{"user_id": user_id, "kind": kind, "ref_id": ref_id, "title": title,
+                             "body": body, "case_id": case_id}]) == 1
+
+
+def remove_documents(user_id, kind: str, ref_ids: List) -> int:
+    if not SEARCH_INDEX_ENABLED or not ref_ids:
+        return 0
+    try:
+        connection = _connection()
+        removed = 0
+        with connection:
+            for ref_id in ref_ids:
+                row = connection.execute("SELECT id FROM entries WHERE user_id = ? AND kind = ? AND ref_id = ?",
+                                         (str(user_id), kind, str(ref_id))).fetchone()
+                if row is not None:
+                    connection.execute("DELETE FROM entries_fts WHERE rowid = ?", (row[0],))
+                    connection.execute("DELETE FROM entries WHERE id = ?", (row[0],))
+                    removed += 1
+        return removed
+    except Exception as e:
+        print("remove_documents")
+        print(e)
+        return 0
+
+
+_QUERY_TOKEN_RE = re.compile(r'"([^"]*)"|(\S+)')
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def build_match_query(query: str) -> str:
+    """
+    Turn user input into an FTS5 query: "quoted text" stays a phrase, other
+    words must all appear, and a trailing * matches a prefix. FTS5 operators
+    and punctuation in the input are treated as plain text.
+    """
+    terms = []
+    for phrase, word in _QUERY_TOKEN_RE.findall(query):
+        if phrase:
+            words = _WORD_RE.findall(phrase)
+            if words:
+                terms.append('"' + ' '.join(words) + '"')
+            continue
+        parts = [f'"{part}"' for part in _WORD_RE.findall(word)]
+        if parts and word.endswith('*'):
+            parts[-1] += '*'
+        terms.extend(parts)
+    return ' AND '.join(terms)
+
+
+def search(user_id, query: str, kinds: Optional[List[str]] = None, case_id: Optional[str] = None,
+           limit: int = 20, offset: int = 0) -> Optional[list]:
+    """
+    Ranked (BM25, titles weighted higher) matches for one lawyer.
+
+    Returns [{"kind", "ref_id", "case_id", "title", "snippet", "score"}],
+    or None if the search failed.
+    """
+    match = build_match_query(query)
+    if not match:
+        return []
+    limit = max(1, min(int(limit), MAX_SEARCH_RESULTS))
+    sql = ["SELECT e.kind, e.ref_id, e.case_id, f.title,",
+           "snippet(entries_fts, 1, '[', ']', ' … ', 16), bm25(entries_fts, 5.0, 1.0) AS score",
+           "FROM entries_fts f JOIN entries e ON e.id = f.rowid",
+           "WHERE entries_fts MATCH ? AND e.user_id = ?"]
+    params = [match, str(user_id)]
+    if kinds:
+        sql.append(f"AND e.kind IN ({', '.join('?' for _ in kinds)})")
+        params.extend(kinds)
+    if case_id:
+        sql.append("AND e.case_id = ?")
+        params.append(str(case_id))
+    sql.append("ORDER BY score LIMIT ? OFFSET ?")
+    params.extend([limit, max(0, int(offset))])
+    try:
+        rows = _connection().execute(" ".join(sql), params).fetchall()
+    except Exception as e:
+        print("search")
+        print(e)
+        return None
+    return [{"kind": kind, "ref_id": ref_id, "case_id": row_case_id, "title": title, "snippet": snippet,
+             "score": round(-score, 4)}
+            for kind, ref_id, row_case_id, title, snippet, score in rows]
+
+
+def get_index_stats() -> dict:
+    stats = {"enabled": SEARCH_INDEX_ENABLED, "path": SEARCH_INDEX_PATH, "entries": {}}
+    if not SEARCH_INDEX_ENABLED:
+        return stats
+    try:
+        rows = _connection().execute("SELECT kind, COUNT(*) FROM entries GROUP BY kind").fetchall()
+        stats["entries"] = dict(rows)
+        stats["size_bytes"] = os.path.getsize(SEARCH_INDEX_PATH)
+    except Exception as e:
+        print("get_index_stats")
+        print(e)
+    return stats
+
+
+# Shapes of indexed entries, shared by the write paths and rebuild()
+
+def case_entry(user_id, case: dict) -> dict:
+    return {"user_id": user_id, "kind": "case", "ref_id": case["_id"], "case_id": case["_id"],
+            "title": case.get("case_name", ""),
+            "body": "\n".join(filter(None, [case.get("case_summary"), case.get("client_name")]))}
+
+
+def document_entry(user_id, case_id, ref_id, document: dict) -> dict:
+    return {"user_id": user_id, "kind": "document", "ref_id": ref_id, "case_id": case_id,
+            "title": document.get("filename", ""), "body": document.get("text", "")}
+
+
+def email_entry(user_id, email: dict, case_id=None, ref_id=None, body: Optional[str] = None) -> dict:
+    if body is None:
+        body = email.get("body_text") or email.get("snippet", "")
+    return {"user_id": user_id, "kind": "case_email" if case_id else "email",
+            "ref_id": ref_id or email["gmail_id"], "case_id": case_id,
+            "title": email.get("subject", ""), "body": f"{email.get('sender', '')}\n{body}"}
+
+
+def _case_email_entries(emails: List[dict]) -> List[dict]:
+    bodies = get_email_bodies([email["body_hash"] for email in emails if email.get("body_hash")])
+    return [email_entry(email["user_id"], email, email["case_id"], email["_id"], bodies.get(email.get("body_hash")))
+            for email in emails]
+
+
+def rebuild(batch_size: int = 500) -> dict:
+    """Index everything already in Mongo (cases, case documents and emails, synced emails)."""
+    client = get_mongo_client()
+    sources = [
+        ("case", get_cases_collection(client).find({}, {"user_id": 1, "case_name": 1, "case_summary": 1, "client_name": 1}),
+         lambda batch: [case_entry(case["user_id"], case) for case in batch]),
+        ("document", get_case_child_collection(client, "documents").find({}, {"user_id": 1, "case_id": 1, "filename": 1, "text": 1}),
+         lambda batch: [document_entry(doc["user_id"], doc["case_id"], doc["_id"], doc) for doc in batch]),
+        ("case_email", get_case_child_collection(client, "emails").find({}), _case_email_entries),
+        ("email", get_emails_collection(client).find({}, {"user_id": 1, "gmail_id": 1, "subject": 1, "sender": 1,
+                                                            "snippet": 1, "body_text": 1}),
+         lambda batch: [email_entry(email["user_id"], email) for email in batch]),
+    ]
+    counts = {}
+    for kind, cursor, to_entries in sources:
+        counts[kind] = 0
+        batch = []
+        for doc in cursor:
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                counts[kind] += index_documents(to_entries(batch))
+                batch = []
+        counts[kind] += index_documents(to_entries(batch))
+    return counts
+
+
+if __name__ == "__main__":
+    import sys
+    import json
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    if command == "rebuild":
+        print(json.dumps(rebuild(), indent=2))
+    elif command == "stats":
+        print(json.dumps(get_index_stats(), indent=2))
+    else:
+        print(f"Unknown command: {command} (expected 'rebuild' or 'stats')")
+        sys.exit(2)
@@ -0,0 +1,137 @@
+"""
+Measure what receiving a PDF upload costs, before and after uploads were
+parsed straight into the OCR scratch dir.
+
+  before: Werkzeug's default stream (a temp file on disk past 500 KB), then
+          file.save() to a mkstemp path and a second read to hash it for the
+          OCR cache; pages OCR'd with pytesseract.image_to_string, which writes
+          an image and a text file per page
+  after:  multipart file parts written once to OCR_SCRATCH_DIR and hashed on
+          the way (util.ocr.scratch_upload_stream); pages piped to tesseract
+          (util.ocr.image_to_text)
+
+Each path reports wall time plus the read/write syscalls and bytes written by
+this process, from /proc/self/io (Linux). The OCR stage runs when a PDF is
+given and Tesseract and Poppler are installed. Run from the backend/src
+directory:
+
+    python -m util.upload_benchmark [size_mb] [runs] [path/to/scan.pdf]
+"""
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request
+
+from util.ocr import spool_pdf, scratch_upload_stream, image_to_text, OCR_SCRATCH_DIR
+from util.ocr_cache import file_sha256
+
+
+class ScratchUploadRequest(Request):
+    # Same override as app.ScratchUploadRequest, without importing the app
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return scratch_upload_stream(total_content_length, content_type, filename, content_length)
+
+
+def _io_counters() -> dict:
+    try:
+        with open("/proc/self/io") as f:
+            return {key: int(value) for key, value in (line.split(": ") for line in f)}
+    except OSError:
+        return {}
+
+
+def _measure(function, runs: int, *args) -> dict:
+    before = _io_counters()
+    start = time.perf_counter()
+    for _ in range(runs):
+        function(*args)
+    elapsed = time.perf_counter() - start
+    after = _io_counters()
+    result = {"ms": elapsed * 1000 / runs}
+    if before and after:
+        result["syscalls"] = (after["syscr"] + after["syscw"] - before["syscr"] - before["syscw"]) / runs
+        result["written"] = (after["wchar"] - before["wchar"]) / runs
+    return result
+
+
+def _upload_environ(payload: bytes) -> dict:
+    builder = EnvironBuilder(method="POST", data={"file": (io.BytesIO(payload), "exhibit.pdf", "application/pdf")})
+    try:
+        return builder.get_environ()
+    finally:
+        builder.close()
+
+
+def upload_before(environ_bytes: tuple):
+    environ, body = environ_bytes
+    request = Request(dict(environ, **{"wsgi.input": io.BytesIO(body)}))
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    os.close(fd)
+    try:
+        request.files["file"].save(path)
+        file_sha256(path)
+    finally:
+        request.close()
+        os.remove(path)
+
+
+def upload_after(environ_bytes: tuple):
+    environ, body = environ_bytes
+    request = ScratchUploadRequest(dict(environ, **{"wsgi.input": io.BytesIO(body)}))
+    try:
+        path, _ = spool_pdf(request.files["file"].stream)
+    finally:
+        request.close()
+    os.remove(path)
+
+
+def ocr_before(images: list):
+    import pytesseract
+    for image in images:
+        pytesseract.image_to_string(image)
+
+
+def ocr_after(images: list):
+    for image in images:
+        image_to_text(image)
+
+
+def _report(stage: str, before: dict, after: dict):
+    print(f"\n{stage}")
+    print(f"{'path':<8} {'ms':>10} {'syscalls':>10} {'KB written':>12}")
+    for name, result in (("before", before), ("after", after)):
+        syscalls = f"{result['syscalls']:>10.0f}" if "syscalls" in result else f"{'n/a':>10}"
+        written = f"{result['written'] / 1024:>12.0f}" if "written" in result else f"{'n/a':>12}"
+        print(f"{name:<8} {result['ms']:>10.1f} {syscalls} {written}")
+
+
+def main(argv):
+    size_mb = float(argv[0]) if argv else 20
+    runs = int(argv[1]) if len(argv) > 1 else 10
+    pdf_path = argv[2] if len(argv) > 2 else None
+
+    payload = os.urandom(int(size_mb * 1024 * 1024))
+    environ = _upload_environ(payload)
+    body = environ["wsgi.input"].read()
+    print(f"{size_mb:g} MB upload, {runs} runs, temp dir {tempfile.gettempdir()}, scratch dir {OCR_SCRATCH_DIR}")
+    _report("upload", _measure(upload_before, runs, (environ, body)), _measure(upload_after, runs, (environ, body)))
+
+    if pdf_path is None:
+        return 0
+    if shutil.which("tesseract") is None or shutil.which("pdftoppm") is None:
+        print("\nTesseract or Poppler not installed, skipping the OCR stage")
+        return 0
+    from pdf2image import convert_from_path
+    images = convert_from_path(pdf_path, 300, first_page=1, last_page=3)
+    print(f"\nOCR of {len(images)} pages from {pdf_path}")
+    _report("ocr", _measure(ocr_before, 1, images), _measure(ocr_after, 1, images))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,169 @@
+import json
+import re
+from email.parser import BytesParser
+from urllib.parse import urlparse
+
+import pytest
+
+httplib2 = pytest.importorskip("httplib2")
+pytest.importorskip("googleapiclient")
+
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.errors import HttpError
+
+from email_handler import email_client
+from email_handler.email_client import fetch_messages, fetch_attachments
+
+_BATCH_PATH = "/batch"
+_MESSAGE_PATH_RE = re.compile(r"^/gmail/v1/users/me/messages/([^/?]+)(?:/attachments/([^/?]+))?")
+
+
+class RecordingGmailHttp:
+    """
+    Stands in for httplib2.Http behind a Gmail service. Answers batch requests
+    part by part and records every HTTP call and the message ids in it.
+
+    batch_status(call_number) can fail a whole batch call; part_status(msg_id,
+    attempt) can fail single parts, attempt counting from 0 per message.
+    """
+
+    def __init__(self, batch_status=None, part_status=None):
+        self.batch_status = batch_status or (lambda call_number: 200)
+        self.part_status = part_status or (lambda msg_id, attempt: 200)
+        self.calls = []
+        self.attempts = {}
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=None, connection_type=None):
+        if urlparse(uri).path != _BATCH_PATH:
+            raise AssertionError(f"unexpected non-batch request to {uri}")
+        content_type = next(value for key, value in headers.items() if key.lower() == "content-type")
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        message = BytesParser().parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode("utf-8") + body)
+        parts = []
+        for part in message.get_payload():
+            request_line = part.get_payload().lstrip().split("\n", 1)[0]
+            match = _MESSAGE_PATH_RE.match(request_line.split(" ")[1])
+            parts.append((part["Content-ID"], match.group(1), match.group(2)))
+        self.calls.append([msg_id for _, msg_id, _ in parts])
+
+        status = self.batch_status(len(self.calls) - 1)
+        if status != 200:
+            return httplib2.Response({"status": status}), json.dumps({"error": {"code": status}}).encode("utf-8")
+
+        boundary = "batch_response"
+        lines = []
+        for content_id, msg_id, attachment_id in parts:
+            attempt = self.attempts.get(msg_id, 0)
+            self.attempts[msg_id] = attempt + 1
+            part_status = self.part_status(msg_id, attempt)
+            if part_status == 200:
+                payload = {"data": "aGVsbG8"} if attachment_id else {"id": msg_id, "threadId": msg_id}
+            else:
+                payload = {"error": {"code": part_status, "message": "failed"}}
+            lines += [f"--{boundary}", "Content-Type: application/http",
+                      f"Content-ID: <response-{content_id[1:-1]}>", "",
+                      f"HTTP/1.1 {part_status} {'OK' if part_status == 200 else 'Error'}",
+                      "Content-Type: application/json; charset=UTF-8", "", json.dumps(payload), ""]
+        lines.append(f"--{boundary}--")
+        response = httplib2.Response({"status": 200, "content-type": f"multipart/mixed; boundary={boundary}"})
+        return response, "\r\n".join(lines).encode("utf-8")
+
+
+def gmail_service(http):
+    return build_from_document(get_static_doc("gmail", "v1"), http=http)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(email_client, "GMAIL_BACKOFF_SECONDS", 0)
+
+
+def fetch(http, msg_ids, batch_size=50):
+    calls = []
+    results = fetch_messages(gmail_service(http), msg_ids, format="metadata", batch_size=batch_size,
+                             callback=lambda msg_id, message, error: calls.append((msg_id, error)))
+    return results, calls
+
+
+def test_one_http_call_per_batch_size_messages():
+    http = RecordingGmailHttp()
+    msg_ids = [f"m{i}" for i in range(120)]
+
+    results, calls = fetch(http, msg_ids)
+
+    assert [len(call) for call in http.calls] == [50, 50, 20]
+    assert sorted(results) == sorted(msg_ids)
+    assert sorted(msg_id for msg_id, _ in calls) == sorted(msg_ids)
+    assert all(error is None for _, error in calls)
+
+
+def test_partial_429_retries_only_the_failed_parts():
+    failing = {"m3", "m7"}
+    http = RecordingGmailHttp(part_status=lambda msg_id, attempt: 429 if msg_id in failing and attempt == 0 else 200)
+    msg_ids = [f"m{i}" for i in range(10)]
+
+    results, calls = fetch(http, msg_ids)
+
+    assert len(http.calls) == 2
+    assert sorted(http.calls[1]) == sorted(failing)
+    assert sorted(results) == sorted(msg_ids)
+    assert sorted(msg_id for msg_id, _ in calls) == sorted(msg_ids)
+
+
+def test_whole_batch_5xx_retries_the_whole_batch():
+    http = RecordingGmailHttp(batch_status=lambda call_number: 503 if call_number == 0 else 200)
+    msg_ids = [f"m{i}" for i in range(30)]
+
+    results, calls = fetch(http, msg_ids, batch_size=20)
+
+    # The rejected first batch is sent again after the second one
+    assert [len(call) for call in http.calls] == [20, 10, 20]
+    assert sorted(http.calls[2]) == sorted(http.calls[0])
+    assert sorted(results) == sorted(msg_ids)
+    assert len(calls) == len(msg_ids)
+
+
+def test_gives_up_after_max_retries(monkeypatch):
+    monkeypatch.setattr(email_client, "GMAIL_MAX_RETRIES", 2)
+    http = RecordingGmailHttp(part_status=lambda msg_id, attempt: 429 if msg_id == "m1" else 200)
+
+    results, calls = fetch(http, ["m0", "m1", "m2"])
+
+    assert http.calls == [["m0", "m1", "m2"], ["m1"], ["m1"]]
+    assert sorted(results) == ["m0", "m2"]
+    errors = {msg_id: error for msg_id, error in calls}
+    assert len(calls) == 3
+    assert isinstance(errors["m1"], HttpError) and errors["m1"].resp.status == 429
+
+
+def test_whole_batch_errors_raise_once_retries_run_out(monkeypatch):
+    monkeypatch.setattr(email_client, "GMAIL_MAX_RETRIES", 1)
+    http = RecordingGmailHttp(batch_status=lambda call_number: 503)
+
+    with pytest.raises(HttpError):
+        fetch(http, ["m0", "m1"])
+    assert len(http.calls) == 2
+
+
+def test_non_retryable_part_errors_are_reported_without_retrying():
+    http = RecordingGmailHttp(part_status=lambda msg_id, attempt: 404 if msg_id == "m1" else 200)
+
+    results, calls = fetch(http, ["m0", "m1"])
+
+    assert len(http.calls) == 1
+    assert sorted(results) == ["m0"]
+    assert [msg_id for msg_id, error in calls if error is not None] == ["m1"]
+
+
+def test_fetch_attachments_shares_the_retry_loop():
+    http = RecordingGmailHttp(part_status=lambda msg_id, attempt: 500 if msg_id == "m1" and attempt == 0 else 200)
+    attachments = [{"gmail_id": f"m{i}", "attachment_id": f"a{i}"} for i in range(3)]
+    downloaded = []
+
+    fetch_attachments(gmail_service(http), attachments,
+                      lambda attachment, data, error: downloaded.append((attachment["gmail_id"], data, error)))
+
+    assert http.calls == [["m0", "m1", "m2"], ["m1"]]
+    assert sorted(downloaded) == [("m0", b"hello", None), ("m1", b"hello", None), ("m2", b"hello", None)]
@@ -0,0 +1,61 @@
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("pdf2image")
+Image = pytest.importorskip("PIL.Image")
+
+pytestmark = pytest.mark.skipif(shutil.which("pdftoppm") is None or not os.path.exists("/proc/self/status"),
+                                reason="needs poppler and Linux /proc")
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src")
+PAGES = 40
+DPI = 150
+BUDGET_MB = 32
+# Interpreter, allocator and pdftoppm pipe overhead on top of the budget
+SLACK_MB = 24
+
+# Runs in a fresh interpreter so its high-water mark only covers rasterizing
+_MEASURE = """
+import sys
+from util.ocr import iter_page_images
+
+def status_kb(field):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+
+path, dpi, budget = sys.argv[1], int(sys.argv[2]), int(sys.argv[3])
+baseline = status_kb("VmRSS")
+pages = 0
+for page_number, image in iter_page_images(path, dpi, memory_budget_mb=budget, grayscale=False):
+    image.load()
+    pages += 1
+print(pages, (status_kb("VmHWM") - baseline) // 1024)
+"""
+
+
+def make_pdf(path: str, pages: int):
+    # US letter at 72 DPI, so a page is 612 x 792 points
+    page = Image.new("RGB", (612, 792), "white")
+    page.save(path, save_all=True, append_images=[page] * (pages - 1), resolution=72)
+
+
+def test_serial_rasterizing_stays_within_memory_budget(tmp_path):
+    from util.ocr import estimate_page_bytes
+
+    pdf_path = str(tmp_path / "exhibit.pdf")
+    make_pdf(pdf_path, PAGES)
+    whole_document_mb = PAGES * estimate_page_bytes({"Page size": "612 x 792 pts"}, DPI) // (1024 * 1024)
+    assert whole_document_mb > 4 * (BUDGET_MB + SLACK_MB)
+
+    result = subprocess.run([sys.executable, "-c", _MEASURE, pdf_path, str(DPI), str(BUDGET_MB)],
+                            cwd=SRC, capture_output=True, text=True, check=True)
+    pages, peak_growth_mb = map(int, result.stdout.strip().splitlines()[-1].split())
+
+    assert pages == PAGES
+    assert peak_growth_mb <= BUDGET_MB + SLACK_MB
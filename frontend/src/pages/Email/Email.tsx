@@ -123,7 +123,7 @@ const Email: React.FC = () => {
           })
           .then(data => {
             data['emails'].forEach((element: any) => {
-              mockEmails.push({id : `${element.gmail_id}`, subject : `${element.subject}`, sender : `${element.sender}`, recipient : `${element.to}`, content : `${element.body_text}`, date : new Date(element.date), caseId : selectedCaseId, read : false});
+              mockEmails.push({id : `${element.gmail_id}`, subject : `${element.subject}`, sender : `${element.sender}`, recipient : `${element.to}`, content : `${element.body_text ?? element.snippet ?? ''}`, date : new Date(element.date), caseId : selectedCaseId, read : false});
             });
             setEmails(mockEmails);
             setLoading(false);
@@ -168,6 +168,21 @@ const Email: React.FC = () => {
       );
       setEmails(updatedEmails);
     }
+
+    // The list only carries a preview; load the full body on demand
+    fetch(`http://localhost:6767/api/email/${email.id}`, {"credentials": "include"})
+      .then(response => {
+        if(!response.ok){
+          throw new Error("Error fetching from API");
+        }
+        return response.json();
+      })
+      .then(data => {
+        const content = data['body_text'] ?? email.content;
+        setEmails(prev => prev.map(e => e.id === email.id ? { ...e, content } : e));
+        setSelectedEmail(prev => prev && prev.id === email.id ? { ...prev, content } : prev);
+      })
+      .catch(err => console.error(err));
   };
 
   // Generate AI summary for the selected email by calling the AI endpoint